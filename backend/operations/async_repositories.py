@@ -0,0 +1,129 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import AsyncIterator, Iterator, Optional
+from .database_operations import Product, Klant, Bedrijf, Factuur, FactuurPagina, SingleEntityRepository, FactuurRepository
+
+class AsyncRepository:
+    '''
+    Runs the blocking calls of a repository on a bounded pool of threads, so the event loop never waits on SQLite.
+    Each thread borrows its own connection from the ConnectionPool of the repository, so the repository must not have a conn assigned explicitly.
+    At most 2 * max_workers calls are queued at a time; further calls wait on the event loop.
+    get_all runs on a thread of its own, so all chunks of one iteration are read by the same connection;
+    at most max_workers iterations run at a time, further ones wait on the event loop until one is done.
+    An executor can be shared between async repositories, pass its max_workers along; it is only shut down by close() when the repository created it.'''
+    def __init__(self, repo: SingleEntityRepository | FactuurRepository, executor: Optional[ThreadPoolExecutor] = None, max_workers: int = 4):
+        if repo._conn is not None:
+            raise ValueError("An async repository needs a repository that borrows its connections from a ConnectionPool.")
+        self.repo = repo
+        self.owns_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="repository")
+        self.slots = asyncio.Semaphore(2 * max_workers)
+        # Every running iteration holds a thread and a connection of its own, so at most max_workers of them run at a time
+        self.iterations = asyncio.Semaphore(max_workers)
+
+    async def _run(self, func, *args, **kwargs):
+        return await self._run_on(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _run_on(self, executor: ThreadPoolExecutor, func):
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(executor, func)
+
+    def _finish(self, items: Iterator) -> None:
+        try:
+            items.close()
+        finally:
+            self.repo.pool.release()
+
+    async def _iterate(self, items: Iterator, chunk_size: int) -> AsyncIterator:
+        # The cursor of the blocking iterator belongs to the connection of the thread that started it,
+        # so every chunk is taken on one dedicated thread, whose connection is released when the iterator is done
+        async with self.iterations:
+            thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="iterator")
+            try:
+                while True:
+                    chunk = await self._run_on(thread, lambda: list(islice(items, chunk_size)))
+                    if not chunk:
+                        break
+                    for item in chunk:
+                        yield item
+            finally:
+                await self._run_on(thread, functools.partial(self._finish, items))
+                thread.shutdown(wait=False)
+
+    async def create(self) -> None:
+        await self._run(self.repo.create)
+
+    async def close(self) -> None:
+        if self.owns_executor:
+            await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+        self.repo.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+class AsyncSingleEntityRepository(AsyncRepository):
+    def __init__(self, repo: SingleEntityRepository, executor: Optional[ThreadPoolExecutor] = None, max_workers: int = 4):
+        super().__init__(repo, executor, max_workers)
+
+    async def get(self, id: int, table_name: str) -> Product | Klant | Bedrijf:
+        return await self._run(self.repo.get, id, table_name)
+
+    def get_all(self, table_name: str, chunk_size: int = 500) -> AsyncIterator[Product | Klant | Bedrijf]:
+        '''
+        Yields all entities of table_name, loading chunk_size of them per round trip to the executor.'''
+        return self._iterate(self.repo.iter_all(table_name, chunk_size=chunk_size, include_blobs=True), chunk_size)
+
+    async def add(self, item: Product | Klant | Bedrijf) -> None:
+        await self._run(self.repo.add, item)
+
+    async def add_many(self, items: list[Product | Klant | Bedrijf], batch_size: int = 500) -> None:
+        await self._run(self.repo.add_many, items, batch_size)
+
+    async def update(self, item: Product | Klant | Bedrijf) -> None:
+        await self._run(self.repo.update, item)
+
+    async def update_many(self, items: list[Product | Klant | Bedrijf], batch_size: int = 500) -> None:
+        await self._run(self.repo.update_many, items, batch_size)
+
+    async def delete(self, item: Product | Klant | Bedrijf) -> None:
+        await self._run(self.repo.delete, item)
+
+class AsyncFactuurRepository(AsyncRepository):
+    def __init__(self, repo: FactuurRepository, executor: Optional[ThreadPoolExecutor] = None, max_workers: int = 4):
+        super().__init__(repo, executor, max_workers)
+
+    async def get(self, factuurnummer: str, include_producten: bool = True) -> Factuur:
+        return await self._run(self.repo.get, factuurnummer, include_producten=include_producten)
+
+    def get_all(self, klant: Optional[int] = None, bedrijf: Optional[int] = None, betaalstatus: Optional[bool] = None, vanaf: Optional[str] = None, tot_en_met: Optional[str] = None, chunk_size: int = 100, include_blobs: bool = True) -> AsyncIterator[Factuur]:
+        '''
+        Yields the facturen matching the filters of FactuurRepository.get_all, loading chunk_size facturen per round trip to the executor.
+        Without include_blobs the pdf and logo are left out.'''
+        items = self.repo.iter_all(klant, bedrijf, betaalstatus, vanaf, tot_en_met, chunk_size=chunk_size, include_blobs=include_blobs)
+        return self._iterate(items, chunk_size)
+
+    async def page(self, klant: Optional[int] = None, bedrijf: Optional[int] = None, betaalstatus: Optional[bool] = None, vanaf: Optional[str] = None, tot_en_met: Optional[str] = None, verlopen: bool = False, na: Optional[tuple[str, str]] = None, limit: int = 50, aflopend: bool = False) -> FactuurPagina:
+        return await self._run(self.repo.page, klant, bedrijf, betaalstatus, vanaf, tot_en_met, verlopen, na, limit, aflopend)
+
+    async def add(self, item: Factuur) -> None:
+        await self._run(self.repo.add, item)
+
+    async def add_many(self, items: list[Factuur], batch_size: int = 100) -> None:
+        await self._run(self.repo.add_many, items, batch_size)
+
+    async def update(self, item: Factuur) -> None:
+        await self._run(self.repo.update, item)
+
+    async def update_many(self, items: list[Factuur], batch_size: int = 100) -> None:
+        await self._run(self.repo.update_many, items, batch_size)
+
+    async def set_betaalstatus(self, factuurnummers: list[str], betaalstatus: bool = True) -> int:
+        return await self._run(self.repo.set_betaalstatus, factuurnummers, betaalstatus)
+
+    async def delete(self, item: Factuur) -> None:
+        await self._run(self.repo.delete, item)
@@ -1,20 +1,80 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, GetCoreSchemaHandler
+from pydantic_core import core_schema
 import sqlite3
 from sqlite3 import Error
 from abc import ABC, abstractmethod
-from typing import Union, Optional
+from typing import Union, Optional, Iterable, Iterator, BinaryIO, Callable, NamedTuple, Sequence
+from array import array
 import contextlib
-from datetime import datetime, timedelta
+import copy
+import functools
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from .pdf_store import PdfStore, StoredPdf
+from .migrations import migrate
+from .geld import Centen, btw_regel
+
+class LazyBlob:
+    '''
+    Handle to a BLOB value that is only read from the database when it is accessed.
+    open() returns SQLite's incremental blob reader, so large values can be streamed without a full copy in memory.
+    The handle is only valid while the connection it was loaded from is open.'''
+    def __init__(self, conn: sqlite3.Connection, table_name: str, column: str, rowid: int, length: int):
+        self.conn = conn
+        self.table_name = table_name
+        self.column = column
+        self.rowid = rowid
+        self.length = length
+
+    def open(self) -> sqlite3.Blob:
+        return self.conn.blobopen(self.table_name, self.column, self.rowid, readonly=True)
+
+    def read(self) -> bytes:
+        with self.open() as blob:
+            return blob.read()
+
+    def copy_to(self, file: BinaryIO, chunk_size: int = 64 * 1024) -> None:
+        with self.open() as blob:
+            while True:
+                chunk = blob.read(chunk_size)
+                if not chunk:
+                    break
+                file.write(chunk)
+
+    def __bytes__(self) -> bytes:
+        return self.read()
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, LazyBlob):
+            other = other.read()
+        if not isinstance(other, bytes):
+            return NotImplemented
+        return self.length == len(other) and self.read() == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"LazyBlob({self.table_name}.{self.column}, rowid={self.rowid}, length={self.length})"
+
+# Lazily loaded values are read when they are written back to the database
+sqlite3.register_adapter(LazyBlob, LazyBlob.read)
 
 class Product(BaseModel):
     id: int
     naam: str
     omschrijving: str
     productcategorie: str
-    eenheidsprijs: float
+    # In eurocents, see geld.centen
+    eenheidsprijs: Centen
     btw_percentage: float
 
 class Bedrijf(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     id: int
     handelsnaam: str
     straatnaam: str
@@ -28,7 +88,7 @@ class Bedrijf(BaseModel):
     bic: str
     telefoonnummer: str
     email: str
-    logo: Optional[bytes] = None
+    logo: Optional[bytes | LazyBlob] = None
 
 class Klant(BaseModel):
     id: int
@@ -43,21 +103,102 @@ class BevatProduct(BaseModel):
     product: Product
     hoeveelheid: int
     datum: str
+
+class Regels(Sequence[BevatProduct]):
+    '''
+    The line items of a factuur in typed arrays: per line the index of its product, the hoeveelheid and the index of its datum.
+    Every Product and every datum is kept once, however many lines refer to it, so a factuur with 20k lines of a few products stays small.
+    Lines of the same product id with different values, e.g. a price overridden on one line, each keep their own Product.
+    It reads like a list of BevatProduct, whose items are built on access; add lines with append, extend or add.'''
+    def __init__(self, regels: Iterable[BevatProduct] = ()):
+        self.producten: list[Product] = []
+        self.product_index = array("I")
+        self.hoeveelheden = array("q")
+        self.datums: list[str] = []
+        self.datum_index = array("I")
+        self._product_posities: dict[tuple, int] = {}
+        self._laatste_posities: dict[int, int] = {}
+        self._datum_posities: dict[str, int] = {}
+        self.extend(regels)
+
+    def _product_positie(self, product: Product) -> int:
+        # Products are interned by id and values; the object of the previous line with the same id is found without hashing its values
+        positie = self._laatste_posities.get(product.id)
+        if positie is None or self.producten[positie] is not product:
+            sleutel = (product.id, *product.__dict__.values())
+            positie = self._product_posities.get(sleutel)
+            if positie is None:
+                positie = self._product_posities[sleutel] = len(self.producten)
+                self.producten.append(product)
+            self._laatste_posities[product.id] = positie
+        return positie
+
+    def add(self, product: Product, hoeveelheid: int, datum: str) -> None:
+        positie = self._datum_posities.get(datum)
+        if positie is None:
+            positie = self._datum_posities[datum] = len(self.datums)
+            self.datums.append(datum)
+        self.product_index.append(self._product_positie(product))
+        self.hoeveelheden.append(hoeveelheid)
+        self.datum_index.append(positie)
+
+    def append(self, regel: BevatProduct) -> None:
+        self.add(regel.product, regel.hoeveelheid, regel.datum)
+
+    def extend(self, regels: Iterable[BevatProduct]) -> None:
+        for regel in regels:
+            self.append(regel)
+
+    def _regel(self, product_index: int, hoeveelheid: int, datum_index: int) -> BevatProduct:
+        return BevatProduct.model_construct(product=self.producten[product_index], hoeveelheid=hoeveelheid, datum=self.datums[datum_index])
+
+    def __len__(self) -> int:
+        return len(self.product_index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._regel(self.product_index[index], self.hoeveelheden[index], self.datum_index[index])
+
+    def __iter__(self) -> Iterator[BevatProduct]:
+        for product_index, hoeveelheid, datum_index in zip(self.product_index, self.hoeveelheden, self.datum_index):
+            yield self._regel(product_index, hoeveelheid, datum_index)
+
+    def __eq__(self, other) -> bool:
+        # Equal to any sequence of the same line items, so a loaded factuur equals the one that was written
+        if not isinstance(other, (Regels, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(regel == other_regel for regel, other_regel in zip(self, other))
+
+    def __repr__(self) -> str:
+        return f"Regels({list(self)!r})"
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        # Accepts a Regels as it is and any list of BevatProduct, and dumps as that list
+        regels = handler.generate_schema(list[BevatProduct])
+        return core_schema.union_schema(
+            [core_schema.is_instance_schema(cls), core_schema.no_info_after_validator_function(cls, regels)],
+            serialization=core_schema.plain_serializer_function_ser_schema(list, return_schema=regels)
+        )
     
 class Factuur(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     factuurnummer: str
     klant: Klant
     bedrijf: Bedrijf
     factuurdatum: str
     uiterste_betaaldatum: Optional[str] = None
-    producten: list[BevatProduct]
-    totaalbedrag_excl: Optional[float] = None
-    btw_bedrag: Optional[float] = None
-    totaalbedrag_incl: Optional[float] = None
+    producten: Regels
+    # Amounts in eurocents
+    totaalbedrag_excl: Optional[Centen] = None
+    btw_bedrag: Optional[Centen] = None
+    totaalbedrag_incl: Optional[Centen] = None
     betaalstatus: bool = False
-    pdf: Optional[bytes] = None
+    pdf: Optional[bytes | LazyBlob | StoredPdf] = None
 
-    def __init__(self, factuurnummer: str, klant: Klant, bedrijf: Bedrijf, factuurdatum: str, producten: list[BevatProduct], betaalstatus: bool = False, uiterste_betaaldatum: Optional[str] = None, totaalbedrag_excl: Optional[float] = None, btw_bedrag: Optional[float] = None, totaalbedrag_incl: Optional[float] = None, pdf: Optional[bytes] = None):
+    def __init__(self, factuurnummer: str, klant: Klant, bedrijf: Bedrijf, factuurdatum: str, producten: Iterable[BevatProduct], betaalstatus: bool = False, uiterste_betaaldatum: Optional[str] = None, totaalbedrag_excl: Optional[int] = None, btw_bedrag: Optional[int] = None, totaalbedrag_incl: Optional[int] = None, pdf: Optional[bytes | LazyBlob | StoredPdf] = None):
         super().__init__(
             factuurnummer=factuurnummer,
             klant=klant,
@@ -79,19 +220,355 @@ class Factuur(BaseModel):
 
         # If totaalbedrag_excl is not provided, calculate it
         if self.totaalbedrag_excl is None:
-            totaalbedrag_excl = sum(bevatproduct.product.eenheidsprijs * bevatproduct.hoeveelheid for bevatproduct in producten)
+            totaalbedrag_excl = sum(bevatproduct.product.eenheidsprijs * bevatproduct.hoeveelheid for bevatproduct in self.producten)
             self.totaalbedrag_excl = totaalbedrag_excl
 
-        # If btw_bedrag is not provided, calculate it
+        # If btw_bedrag is not provided, calculate it, rounding the BTW of every line item
         if self.btw_bedrag is None:
-            btw_bedrag = sum(bevatproduct.product.eenheidsprijs * bevatproduct.hoeveelheid * bevatproduct.product.btw_percentage / 100 for bevatproduct in producten)
-            self.btw_bedrag = round(btw_bedrag, 2)
+            btw_bedrag = sum(btw_regel(bevatproduct.product.eenheidsprijs * bevatproduct.hoeveelheid, bevatproduct.product.btw_percentage) for bevatproduct in self.producten)
+            self.btw_bedrag = btw_bedrag
 
         # If totaalbedrag_incl is not provided, calculate it
         if self.totaalbedrag_incl is None:
             self.totaalbedrag_incl = self.totaalbedrag_excl + self.btw_bedrag
 
-class Repository[T](ABC):
+class FactuurOverzicht(NamedTuple):
+    '''
+    A factuur without its line items and pdf, as shown in a list of facturen. Amounts are in eurocents.'''
+    factuurnummer: str
+    klant: int
+    bedrijf: int
+    factuurdatum: str
+    uiterste_betaaldatum: str
+    totaalbedrag_excl: int
+    btw_bedrag: int
+    totaalbedrag_incl: int
+    betaalstatus: bool
+
+def factuur_overzicht(row: tuple) -> FactuurOverzicht:
+    # A row of the Factuur columns named like the FactuurOverzicht fields; klant and bedrijf are stored as text and betaalstatus as an integer
+    factuurnummer, klant, bedrijf, factuurdatum, uiterste_betaaldatum, excl, btw, incl, betaald = row
+    return FactuurOverzicht(factuurnummer, int(klant), int(bedrijf), factuurdatum, uiterste_betaaldatum, excl, btw, incl, bool(betaald))
+
+class FactuurPagina(NamedTuple):
+    '''
+    One page of FactuurRepository.page. volgende is the (factuurdatum, factuurnummer) to pass as na for the next page,
+    or None on the last page.'''
+    facturen: list[FactuurOverzicht]
+    volgende: Optional[tuple[str, str]]
+
+ENTITY_MODELS = {
+    "Product": Product,
+    "Klant": Klant,
+    "Bedrijf": Bedrijf
+}
+
+FACTUUR_COLUMNS = ["factuurnummer", "klant", "bedrijf", "factuurdatum", "uiterste_betaaldatum", "totaalbedrag_excl", "btw_bedrag", "totaalbedrag_incl", "betaalstatus", "pdf"]
+
+# pdf_ref holds the PdfStore key when the pdf is not stored in the Factuur row itself
+FACTUUR_WRITE_COLUMNS = FACTUUR_COLUMNS + ["pdf_ref"]
+
+INSERT_FACTUUR = f"INSERT INTO Factuur ({', '.join(FACTUUR_WRITE_COLUMNS)}) VALUES ({', '.join(['?'] * len(FACTUUR_WRITE_COLUMNS))});"
+
+UPDATE_FACTUUR = f"UPDATE Factuur SET {', '.join(f'{column} = ?' for column in FACTUUR_WRITE_COLUMNS[1:])} WHERE factuurnummer = ?;"
+
+INSERT_BEVATPRODUCT = "INSERT INTO BevatProduct (factuur, product, hoeveelheid, datum) VALUES (?, ?, ?, ?);"
+
+# Columns that are only read when the caller asks for them
+BLOB_COLUMNS = {"logo", "pdf"}
+
+def _select_columns(columns: list[str], include_blobs: bool, lazy_blobs: bool = False) -> str:
+    # Lazily loaded BLOB columns only select their length, see _lazy_blobs
+    if lazy_blobs:
+        return ", ".join(f"length({column})" if column in BLOB_COLUMNS else column for column in columns)
+    return ", ".join(column if include_blobs or column not in BLOB_COLUMNS else "NULL" for column in columns)
+
+def _lazy_blobs(conn: sqlite3.Connection, table_name: str, values: dict, rowid: int) -> dict:
+    for column in BLOB_COLUMNS & values.keys():
+        if values[column] is not None:
+            values[column] = LazyBlob(conn, table_name, column, rowid, values[column])
+    return values
+
+# How SQLite returns the values of fields whose column type differs from the field type
+STORED_TYPES = {"betaalstatus": bool, "btw_percentage": float}
+
+class Hydrator:
+    '''
+    Builds models from the rows of a table, with the mapping from columns to fields worked out once per model and column list, see hydrator.
+    Rows read from our own database are trusted: the model is built with model_construct, without validation,
+    and a Factuur keeps its stored uiterste_betaaldatum and totals instead of computing them again.
+    With strict every row is validated like a model created by hand, e.g. for rows imported from a database of unknown quality.'''
+    def __init__(self, model: type[BaseModel], columns: tuple[str, ...]):
+        self.model = model
+        self.columns = columns
+        self.conversions = [(column, STORED_TYPES[column]) for column in columns if column in STORED_TYPES]
+
+    def values(self, row: tuple) -> dict:
+        return dict(zip(self.columns, row))
+
+    def build(self, values: dict, strict: bool = False) -> BaseModel:
+        if strict:
+            return self.model(**values)
+        for column, stored_type in self.conversions:
+            if values[column] is not None:
+                values[column] = stored_type(values[column])
+        return self.model.model_construct(**values)
+
+@functools.cache
+def hydrator(model: type[BaseModel], columns: Optional[tuple[str, ...]] = None) -> Hydrator:
+    # columns defaults to the fields of the model, in the order of the columns of its table
+    return Hydrator(model, columns if columns is not None else tuple(model.model_fields))
+
+def _same_value(stored, value) -> bool:
+    # Foreign keys are stored as text and booleans as integers
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(stored, str) and not isinstance(value, str) and value is not None:
+        value = str(value)
+    return stored == value
+
+def _same_pdf(conn: sqlite3.Connection, pdf, length: Optional[int], rowid: int) -> bool:
+    # Compares the new pdf column value with the stored one without reading it, unless the lengths are equal
+    if pdf is None or length is None:
+        return pdf is None and length is None
+    if isinstance(pdf, LazyBlob) and pdf.conn is conn and (pdf.table_name, pdf.column, pdf.rowid) == ("Factuur", "pdf", rowid):
+        return True
+    return LazyBlob(conn, "Factuur", "pdf", rowid, length) == bytes(pdf)
+
+class EntityCache:
+    '''
+    Bounded LRU identity map for Product, Klant and Bedrijf, keyed by (table_name, id).
+    The result of get_all is stored under (table_name, None).
+    Repositories on the same database must share one cache, so that writes invalidate it for all of them:
+    pass the same cache or the same ConnectionPool to all of them. A repository that opens its own pool from a db_path
+    only caches when it is given a cache, because writes through other repositories would not invalidate it.
+    Strict repositories store the models they validated, but always read rows from the database.
+    A model read before a write is not stored after that write invalidated it, see version.
+    The cache can be shared between threads.'''
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        # Bumped by every invalidation of a key, so a model read before a write is never stored after it, see version
+        self.versions: dict[tuple[str, Optional[int]], int] = {}
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(key: tuple[str, Optional[Union[int, str]]]) -> tuple[str, Optional[int]]:
+        # Foreign keys come back as text from their VARCHAR columns, so ids are normalised to int
+        table_name, id = key
+        return (table_name, int(id) if id is not None else None)
+
+    def get(self, key: tuple[str, Optional[int]]):
+        key = self._key(key)
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def version(self, key: tuple[str, Optional[int]]) -> tuple[int, int]:
+        '''
+        Take the version of a key before reading its row, and pass it to put: the model is not stored when the key was invalidated in between.'''
+        key = self._key(key)
+        with self.lock:
+            return (self.epoch, self.versions.get(key, 0))
+
+    def put(self, key: tuple[str, Optional[int]], value, version: Optional[tuple[int, int]] = None) -> None:
+        key = self._key(key)
+        with self.lock:
+            if version is not None and version != (self.epoch, self.versions.get(key, 0)):
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, table_name: str, id: int) -> None:
+        with self.lock:
+            for key in [self._key((table_name, id)), (table_name, None)]:
+                self.entries.pop(key, None)
+                self.versions[key] = self.versions.get(key, 0) + 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+            self.epoch += 1
+
+class StorageProfile(NamedTuple):
+    '''
+    SQLite settings applied to every connection of a ConnectionPool.
+    The defaults are those of SQLite: the journal mode of the database file is kept, and synchronous FULL syncs at every commit.
+    WAL_PROFIEL trades durability for speed, see there.
+    cache_size follows SQLite: a negative value is in KiB. mmap_size is in bytes and busy_timeout in milliseconds.
+    read_only connections cannot write, so reporting queries can run next to the connections that create facturen.'''
+    # None keeps the journal mode stored in the database file, which is DELETE for a new file
+    journal_mode: Optional[str] = None
+    synchronous: str = "FULL"
+    cache_size: int = -2000
+    mmap_size: int = 0
+    busy_timeout: int = 5000
+    foreign_keys: bool = False
+    read_only: bool = False
+
+    def apply(self, conn: sqlite3.Connection) -> None:
+        # The journal mode is stored in the database file, so a read-only connection keeps whatever mode it has
+        if self.journal_mode is not None and not self.read_only:
+            conn.execute(f"PRAGMA journal_mode = {self.journal_mode};")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous};")
+        conn.execute(f"PRAGMA cache_size = {self.cache_size};")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size};")
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout};")
+        conn.execute(f"PRAGMA foreign_keys = {'ON' if self.foreign_keys else 'OFF'};")
+        conn.execute(f"PRAGMA query_only = {'ON' if self.read_only else 'OFF'};")
+
+# In WAL mode readers do not block the writer, and synchronous NORMAL only syncs at checkpoints instead of at every commit:
+# a power loss can undo the last commits, but never corrupts the database. Opt in with profile=WAL_PROFIEL.
+WAL_PROFIEL = StorageProfile(journal_mode="WAL", synchronous="NORMAL", cache_size=-64000, mmap_size=256 * 1024 * 1024)
+
+class ConnectionPool:
+    '''
+    Hands out one connection per thread to the repositories that borrow from it, and owns the EntityCache they share.
+    A connection is opened the first time a thread asks for one and is reused by that thread afterwards.
+    An in-memory database only exists within one connection, whose transactions would interleave between threads,
+    so a pool for ':memory:' only hands out its connection to the thread that opened it; use a database file for threads.
+    close() closes the connections of all threads.
+    Every connection is set up with the StorageProfile of the pool.'''
+    def __init__(self, db_path: str, cache: Optional[EntityCache] = None, profile: Optional[StorageProfile] = None):
+        self.db_path = db_path
+        self.cache = cache if cache is not None else EntityCache()
+        self.profile = profile if profile is not None else StorageProfile()
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            return conn
+        with self.lock:
+            if self.closed:
+                raise ValueError(f"ConnectionPool for {self.db_path} is closed.")
+            if self.db_path == ':memory:' and self.connections:
+                raise ValueError("A ConnectionPool for ':memory:' can only be used by one thread, use a database file instead.")
+            # The pool makes sure a connection is only used by its own thread, close() may run on any thread
+            conn = self._connect()
+            self.connections.append(conn)
+        self.local.conn = conn
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.profile.read_only and self.db_path != ':memory:':
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.profile.apply(conn)
+        return conn
+
+    def release(self) -> None:
+        '''
+        Closes the connection of the calling thread, e.g. when a worker thread stops.'''
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            return
+        self.local.conn = None
+        with self.lock:
+            if self.db_path == ':memory:':
+                return
+            self.connections.remove(conn)
+        conn.close()
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
+        self.local = threading.local()
+
+    def __enter__(self) -> "ConnectionPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def _explain(conn: sqlite3.Connection, call: Callable) -> list[str]:
+    '''
+    Runs call and returns the query plan of every SELECT it executed, one line per plan step.'''
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        result = call()
+        # Generators only run their query when the first item is requested
+        if isinstance(result, Iterator):
+            next(result, None)
+            result.close()
+    except ValueError:
+        # A missing row still shows the plan of the queries that looked for it
+        pass
+    finally:
+        conn.set_trace_callback(None)
+    plan = []
+    cursor = conn.cursor()
+    for statement in statements:
+        if not statement.lstrip().upper().startswith("SELECT"):
+            continue
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}")
+        plan.extend(row[-1] for row in cursor.fetchall())
+    return plan
+
+def _batches(items: list, batch_size: int):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+def _missing_ids(conn: sqlite3.Connection, table_name: str, ids) -> set[int]:
+    '''
+    Returns the ids that have no row in table_name, using one IN query per 500 ids.'''
+    missing = set()
+    for chunk in _batches(sorted(set(ids)), 500):
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id FROM {table_name} WHERE id IN ({', '.join(['?'] * len(chunk))});", chunk)
+        missing.update(set(chunk) - {row[0] for row in cursor.fetchall()})
+    return missing
+
+class PoolRepository:
+    '''
+    Base of the repositories that borrow their connections from a ConnectionPool, or from a private pool opened from a db_path.'''
+    def _borrow(self, db_path: Optional[str], cache: Optional[EntityCache], pool: Optional[ConnectionPool], profile: Optional[StorageProfile]) -> None:
+        # Without a pool the repository gets a private one, which close() closes again, and caches nothing unless it is given a cache
+        if pool is None and db_path is None:
+            raise ValueError("A repository needs a db_path or a pool.")
+        if pool is not None and profile is not None:
+            raise ValueError("The profile of a shared pool is set on the ConnectionPool.")
+        self.owns_pool = pool is None
+        if pool is None:
+            pool = ConnectionPool(db_path, cache=cache if cache is not None else EntityCache(maxsize=0), profile=profile)
+        self.pool = pool
+        self.db_path = self.pool.db_path
+        self.cache = cache if cache is not None else self.pool.cache
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        '''
+        The connection of the calling thread, unless a connection was assigned to the repository explicitly.'''
+        return self._conn if self._conn is not None else self.pool.connection()
+
+    @conn.setter
+    def conn(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+
+    def close(self) -> None:
+        if self.owns_pool:
+            self.pool.close()
+
+class Repository[T](PoolRepository, ABC):
     @abstractmethod
     def create(self) -> None:
         raise NotImplementedError
@@ -117,85 +594,89 @@ class Repository[T](ABC):
         raise NotImplementedError
 
 class SingleEntityRepository(Repository[Union[Product, Klant, Bedrijf]]):
-    def __init__(self, db_path: str):
-        self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path)
+    def __init__(self, db_path: Optional[str] = None, cache: Optional[EntityCache] = None, pool: Optional[ConnectionPool] = None, profile: Optional[StorageProfile] = None, strict: bool = False):
+        # With strict every row read is validated, see Hydrator
+        self._borrow(db_path, cache, pool, profile)
+        self.strict = strict
     
     def create(self) -> None:
+        # The tables and indexes are defined by the migrations
+        migrate(self.conn)
+
+    def get(self, id: int, table_name: str, lazy_blobs: bool = False) -> Product | Klant | Bedrijf:
+        if lazy_blobs:
+            return self._get_lazy(id, table_name)
+        # A strict repository validates every row it returns, so it does not trust the cached models of other repositories
+        cached = self.cache.get((table_name, id)) if not self.strict else None
+        if cached is not None:
+            return cached
+        version = self.cache.version((table_name, id))
         cursor = self.conn.cursor()
-        cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS Product (
-                        id INTEGER NOT NULL,
-                        naam VARCHAR(255) NOT NULL,
-                        omschrijving VARCHAR(255) NOT NULL,
-                        productcategorie VARCHAR(255) NOT NULL,
-                        eenheidsprijs DECIMAL(10,2) NOT NULL,
-                        btw_percentage DECIMAL(10,2) NOT NULL,
-                        PRIMARY KEY (id)
-                        );
-                        """)
-        cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS Klant (
-                        id INTEGER NOT NULL,
-                        handelsnaam VARCHAR(255) NOT NULL, 
-                        ten_aanzien_van VARCHAR(255) NOT NULL,
-                        straatnaam VARCHAR(255) NOT NULL,
-                        huisnummer VARCHAR(255) NOT NULL,
-                        postcode VARCHAR(255) NOT NULL,
-                        plaats VARCHAR(255) NOT NULL,
-                        PRIMARY KEY (id)
-                        );
-                        """)
-        cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS Bedrijf (
-                        id INTEGER NOT NULL,
-                        handelsnaam VARCHAR(255) NOT NULL, 
-                        straatnaam VARCHAR(255) NOT NULL,
-                        huisnummer VARCHAR(255) NOT NULL,
-                        postcode VARCHAR(255) NOT NULL,
-                        plaats VARCHAR(255) NOT NULL,
-                        kvk_nummer VARCHAR(255) NOT NULL,
-                        btw_nummer VARCHAR(255) NOT NULL,
-                        bank VARCHAR(255) NOT NULL,
-                        iban VARCHAR(255) NOT NULL,
-                        bic VARCHAR(255) NOT NULL,
-                        telefoonnummer VARCHAR(255) NOT NULL,
-                        email VARCHAR(255) NOT NULL,
-                        logo BLOB,
-                        PRIMARY KEY (id)
-                        );
-                        """)
-
-    def get(self, id: int, table_name: str) -> Product | Klant | Bedrijf:
+        cursor.execute(f"SELECT * FROM {table_name} WHERE id = ?;", (id,))
+        query_result = cursor.fetchone()
+        if query_result is None:
+            raise ValueError(f"{table_name} with id {id} does not exist.")
+        entity = hydrator(ENTITY_MODELS[table_name])
+        item = entity.build(entity.values(query_result), self.strict)
+        self.cache.put((table_name, id), item, version)
+        return item
+
+    def _get_lazy(self, id: int, table_name: str) -> Product | Klant | Bedrijf:
+        # Entities with a LazyBlob are bound to this connection, so they bypass the cache
+        entity = hydrator(ENTITY_MODELS[table_name])
         cursor = self.conn.cursor()
-        cursor.execute(f"SELECT * FROM {table_name} WHERE id = {id};")
+        cursor.execute(f"SELECT {_select_columns(entity.columns, True, lazy_blobs=True)} FROM {table_name} WHERE id = ?;", (id,))
         query_result = cursor.fetchone()
         if query_result is None:
             raise ValueError(f"{table_name} with id {id} does not exist.")
-        mappings = {
-            "Product": Product,
-            "Klant": Klant,
-            "Bedrijf": Bedrijf
-        }
-        query_dict = dict(zip(list(mappings[table_name].model_fields.keys()), query_result))
-        return mappings[table_name](**query_dict)
+        return entity.build(_lazy_blobs(self.conn, table_name, entity.values(query_result), id), self.strict)
 
     def get_all(self, table_name: str) -> list[Product | Klant | Bedrijf]:
+        cached = self.cache.get((table_name, None)) if not self.strict else None
+        if cached is not None:
+            return list(cached)
+        version = self.cache.version((table_name, None))
         cursor = self.conn.cursor()
         cursor.execute(f"SELECT * FROM {table_name};")
         query_result = cursor.fetchall()
         if query_result is None:
             raise ValueError(f"No entries in {table_name} exist.")
-        mappings = {
-            "Product": Product,
-            "Klant": Klant,
-            "Bedrijf": Bedrijf
+        entity = hydrator(ENTITY_MODELS[table_name])
+        items = [entity.build(entity.values(item), self.strict) for item in query_result]
+        self.cache.put((table_name, None), items, version)
+        return list(items)
+
+    def explain(self, table_name: str) -> dict[str, list[str]]:
+        '''
+        Returns the SQLite query plan of each read method on table_name, keyed by the method.'''
+        # Bypass the cache, which would otherwise answer get without a query
+        repo = copy.copy(self)
+        repo.cache = EntityCache(maxsize=0)
+        calls = {
+            "get": lambda: repo.get(0, table_name),
+            "get(lazy_blobs)": lambda: repo.get(0, table_name, lazy_blobs=True),
+            "get_all": lambda: repo.get_all(table_name),
+            "iter_all": lambda: repo.iter_all(table_name)
         }
-        items = []
-        for item in query_result:
-            item_dict = dict(zip(list(mappings[table_name].model_fields.keys()), item))
-            items.append(mappings[table_name](**item_dict))               
-        return items
+        return {method: _explain(self.conn, call) for method, call in calls.items()}
+
+    def iter_all(self, table_name: str, chunk_size: int = 500, include_blobs: bool = False, lazy_blobs: bool = False) -> Iterator[Product | Klant | Bedrijf]:
+        '''
+        Yields the entries of table_name one at a time, fetching chunk_size rows per round trip.
+        The logo column is left out unless include_blobs is set, or loaded as a LazyBlob with lazy_blobs.'''
+        entity = hydrator(ENTITY_MODELS[table_name])
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT {_select_columns(entity.columns, include_blobs, lazy_blobs)} FROM {table_name};")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                values = entity.values(row)
+                if lazy_blobs:
+                    # The id column is the rowid of the entity tables
+                    values = _lazy_blobs(self.conn, table_name, values, values["id"])
+                yield entity.build(values, self.strict)
     
     def add(self, item: Product | Klant | Bedrijf) -> None:
         table_name = item.__class__.__name__
@@ -206,6 +687,13 @@ class SingleEntityRepository(Repository[Union[Product, Klant, Bedrijf]]):
         values = [getattr(item, column) for column in columns]
         cursor.execute(query, values)
         self.conn.commit()
+        self.cache.invalidate(table_name, item.id)
+
+    def add_many(self, items: list[Product | Klant | Bedrijf], batch_size: int = 500) -> None:
+        '''
+        Inserts the items with executemany and one commit per batch.
+        A failing batch is rolled back as a whole; earlier batches stay committed.'''
+        self._write_many(items, batch_size, update=False)
 
     def update(self, item: Product | Klant | Bedrijf) -> None:
         table_name = item.__class__.__name__
@@ -216,189 +704,434 @@ class SingleEntityRepository(Repository[Union[Product, Klant, Bedrijf]]):
         values = [getattr(item, column) for column in columns]
         cursor.execute(query, values)
         self.conn.commit()
+        self.cache.invalidate(table_name, item.id)
     
+    def update_many(self, items: list[Product | Klant | Bedrijf], batch_size: int = 500) -> None:
+        '''
+        Updates the items with executemany and one commit per batch.
+        A failing batch is rolled back as a whole; earlier batches stay committed.'''
+        self._write_many(items, batch_size, update=True)
+
+    def _write_many(self, items: list[Product | Klant | Bedrijf], batch_size: int, update: bool) -> None:
+        for batch in _batches(items, batch_size):
+            groups = {}
+            for item in batch:
+                groups.setdefault(item.__class__.__name__, []).append(item)
+            # The connection context manager commits the batch, or rolls it back on any error
+            with self.conn:
+                cursor = self.conn.cursor()
+                for table_name, group in groups.items():
+                    columns = list(ENTITY_MODELS[table_name].model_fields.keys())
+                    values = [[getattr(item, column) for column in columns] for item in group]
+                    if update:
+                        query = f"UPDATE {table_name} SET {', '.join([f'{column} = ?' for column in columns])} WHERE id = ?"
+                        values = [row + [item.id] for row, item in zip(values, group)]
+                    else:
+                        query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+                    cursor.executemany(query, values)
+            for item in batch:
+                self.cache.invalidate(item.__class__.__name__, item.id)
+
     def delete(self, item: Product | Klant | Bedrijf) -> None:
         table_name = item.__class__.__name__
         cursor = self.conn.cursor()
         cursor.execute(f"DELETE FROM {table_name} WHERE id = {item.id};")
+        self.conn.commit()
+        self.cache.invalidate(table_name, item.id)
 
 class FactuurRepository(Repository[Factuur]):
-    def __init__(self, db_path: str):
-        self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path)
+    def __init__(self, db_path: Optional[str] = None, cache: Optional[EntityCache] = None, pdf_store: Optional[PdfStore] = None, pool: Optional[ConnectionPool] = None, profile: Optional[StorageProfile] = None, strict: bool = False):
+        self._borrow(db_path, cache, pool, profile)
+        # Without a pdf_store the pdf is kept in the Factuur row
+        self.pdf_store = pdf_store
+        # With strict every row read is validated and the totals of a Factuur are only computed when they are missing, see Hydrator
+        self.strict = strict
 
     def create(self) -> None:
+        # The tables and indexes are defined by the migrations
+        migrate(self.conn)
+
+    def explain(self) -> dict[str, list[str]]:
+        '''
+        Returns the SQLite query plan of each read method, keyed by the method and the filter it was called with.
+        Lookups should SEARCH using an index; only the unfiltered get_all and iter_all are expected to SCAN Factuur.
+        add, update and delete locate their rows by primary key.'''
+        # Bypass the entity cache, so the entity queries show up in the plan as well
+        repo = copy.copy(self)
+        repo.cache = EntityCache(maxsize=0)
         cursor = self.conn.cursor()
-        cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS Factuur (
-                        factuurnummer VARCHAR(255) NOT NULL,
-                        klant VARCHAR(255) NOT NULL,
-                        bedrijf VARCHAR(255) NOT NULL,
-                        factuurdatum DATE NOT NULL,
-                        uiterste_betaaldatum DATE NOT NULL,
-                        totaalbedrag_excl DECIMAL(10,2) NOT NULL,
-                        btw_bedrag DECIMAL(10,2) NOT NULL,
-                        totaalbedrag_incl DECIMAL(10,2) NOT NULL,
-                        betaalstatus BOOLEAN NOT NULL DEFAULT FALSE,
-                        pdf BLOB,
-                        PRIMARY KEY (factuurnummer),
-                        FOREIGN KEY (klant) REFERENCES Klant(id),
-                        FOREIGN KEY (bedrijf) REFERENCES Bedrijf(id)
-                        );
-                        """)
-        cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS BevatProduct (
-                        factuur VARCHAR(255) NOT NULL,
-                        product VARCHAR(255) NOT NULL,
-                        hoeveelheid INT NOT NULL,
-                        datum DATE NOT NULL,
-                        PRIMARY KEY (factuur, product, datum),
-                        FOREIGN KEY (factuur) REFERENCES Factuur(factuurnummer),
-                        FOREIGN KEY (product) REFERENCES Product(id)
-                        );
-                    """)
+        cursor.execute("SELECT factuurnummer FROM Factuur LIMIT 1;")
+        row = cursor.fetchone()
+        factuurnummer = row[0] if row is not None else ""
+        calls = {
+            "get": lambda: repo.get(factuurnummer),
+            "get(lazy_blobs)": lambda: repo.get(factuurnummer, lazy_blobs=True),
+            "iter_producten": lambda: repo.iter_producten(factuurnummer),
+            "get_all": lambda: repo.get_all(),
+            "get_all(klant)": lambda: repo.get_all(klant=0),
+            "get_all(bedrijf)": lambda: repo.get_all(bedrijf=0),
+            "get_all(betaalstatus)": lambda: repo.get_all(betaalstatus=False),
+            "get_all(vanaf, tot_en_met)": lambda: repo.get_all(vanaf="0000-01-01", tot_en_met="9999-12-31"),
+            "iter_all": lambda: repo.iter_all(),
+            "iter_all(klant)": lambda: repo.iter_all(klant=0),
+            "page": lambda: repo.page(na=("0000-01-01", "")),
+            "page(klant)": lambda: repo.page(klant=0, na=("0000-01-01", "")),
+            "page(bedrijf, aflopend)": lambda: repo.page(bedrijf=0, na=("9999-12-31", ""), aflopend=True),
+            "page(verlopen)": lambda: repo.page(verlopen=True)
+        }
+        return {method: _explain(self.conn, call) for method, call in calls.items()}
     
-    def get(self, factuurnummer: str) -> Factuur:
+    def get(self, factuurnummer: str, lazy_blobs: bool = False, include_producten: bool = True) -> Factuur:
+        # Without include_producten the line items are left out, they can be streamed with iter_producten
+        if lazy_blobs:
+            facturen = self._load("Factuur.factuurnummer = ?", [factuurnummer], lazy_blobs=True, include_producten=include_producten)
+            if not facturen:
+                raise ValueError(f"Factuur with factuurnummer {factuurnummer} does not exist.")
+            return facturen[0]
         cursor = self.conn.cursor()
-        cursor.execute("""SELECT * FROM Factuur WHERE Factuur.factuurnummer = ?;""", (factuurnummer,))
+        cursor.execute(f"""SELECT {', '.join(FACTUUR_WRITE_COLUMNS)} FROM Factuur WHERE Factuur.factuurnummer = ?;""", (factuurnummer,))
         facturen = cursor.fetchone()
         if facturen is None:
             raise ValueError(f"Factuur with factuurnummer {factuurnummer} does not exist.")
-        factuur_dict = dict(zip(["factuurnummer", "klant", "bedrijf", "factuurdatum", "uiterste_betaaldatum", "totaalbedrag_excl", "btw_bedrag", "totaalbedrag_incl", "betaalstatus", "pdf"], facturen))
-        cursor.execute("""SELECT * FROM BevatProduct WHERE BevatProduct.factuur = ?;""", (factuurnummer,))
-        bevatproducten = cursor.fetchall()
-        repo = SingleEntityRepository(self.db_path)
-        repo.conn = self.conn
-        factuur = Factuur(
-            factuurnummer=factuur_dict["factuurnummer"],
-            klant=repo.get(factuur_dict["klant"], "Klant"),
-            bedrijf=repo.get(factuur_dict["bedrijf"], "Bedrijf"),
-            factuurdatum=factuur_dict["factuurdatum"],
-            uiterste_betaaldatum=factuur_dict["uiterste_betaaldatum"],
-            totaalbedrag_excl=factuur_dict["totaalbedrag_excl"],
-            btw_bedrag=factuur_dict["btw_bedrag"],
-            totaalbedrag_incl=factuur_dict["totaalbedrag_incl"],
-            betaalstatus=factuur_dict["betaalstatus"],
-            pdf=factuur_dict["pdf"],
-            producten=[BevatProduct(
-                factuur=bevatproduct[0],
-                product=repo.get(bevatproduct[1], "Product"),
-                hoeveelheid=bevatproduct[2],
-                datum=bevatproduct[3]
-            ) for bevatproduct in bevatproducten]
-        )
-        return factuur
+        # The row holds FACTUUR_COLUMNS followed by pdf_ref
+        factuur = hydrator(Factuur, tuple(FACTUUR_COLUMNS))
+        factuur_dict = factuur.values(facturen)
+        if facturen[-1] is not None:
+            factuur_dict["pdf"] = self._stored_pdf(facturen[-1], lazy=False)
+        bevatproducten = []
+        if include_producten:
+            cursor.execute("""SELECT product, hoeveelheid, datum FROM BevatProduct WHERE BevatProduct.factuur = ? ORDER BY BevatProduct.rowid;""", (factuurnummer,))
+            bevatproducten = cursor.fetchall()
+        repo = self._entities()
+        # Foreign keys are stored in VARCHAR columns, so ids come back as text
+        factuur_dict["klant"] = repo.get(int(factuur_dict["klant"]), "Klant")
+        factuur_dict["bedrijf"] = repo.get(int(factuur_dict["bedrijf"]), "Bedrijf")
+        factuur_dict["producten"] = Regels()
+        # Every product is loaded once, also when the repository does not cache
+        producten = {}
+        for product, hoeveelheid, datum in bevatproducten:
+            if product not in producten:
+                producten[product] = repo.get(int(product), "Product")
+            self._add_regel(factuur_dict["producten"], producten[product], hoeveelheid, datum)
+        return factuur.build(factuur_dict, self.strict)
+
+    def iter_producten(self, factuurnummer: str, chunk_size: int = 500) -> Iterator[BevatProduct]:
+        '''
+        Yields the line items of the factuur one at a time, fetching chunk_size rows per round trip.
+        A product that occurs on many lines is loaded once.'''
+        repo = self._entities()
+        producten = {}
+        cursor = self.conn.cursor()
+        cursor.execute("""SELECT product, hoeveelheid, datum FROM BevatProduct WHERE BevatProduct.factuur = ? ORDER BY BevatProduct.rowid;""", (factuurnummer,))
+        while True:
+            bevatproducten = cursor.fetchmany(chunk_size)
+            if not bevatproducten:
+                break
+            for product, hoeveelheid, datum in bevatproducten:
+                if product not in producten:
+                    producten[product] = repo.get(int(product), "Product")
+                yield self._bevatproduct(producten[product], hoeveelheid, datum)
  
-    def get_all(self) -> list[Factuur]:
+    def get_all(self, klant: Optional[int] = None, bedrijf: Optional[int] = None, betaalstatus: Optional[bool] = None, vanaf: Optional[str] = None, tot_en_met: Optional[str] = None, lazy_blobs: bool = False) -> list[Factuur]:
+        '''
+        Loads all facturen matching the optional filters in a fixed number of queries.
+        vanaf and tot_en_met are inclusive bounds on the factuurdatum.
+        With lazy_blobs the pdf and logo values are LazyBlob handles that are read on access.'''
+        where, params = self._filter(klant, bedrijf, betaalstatus, vanaf, tot_en_met)
+        return self._load(where, params, lazy_blobs=lazy_blobs)
+
+    def iter_all(self, klant: Optional[int] = None, bedrijf: Optional[int] = None, betaalstatus: Optional[bool] = None, vanaf: Optional[str] = None, tot_en_met: Optional[str] = None, chunk_size: int = 100, include_blobs: bool = False, lazy_blobs: bool = False) -> Iterator[Factuur]:
+        '''
+        Yields the facturen matching the filters one at a time, loading chunk_size facturen per round trip.
+        The pdf and logo columns are left out unless include_blobs is set, or loaded as a LazyBlob with lazy_blobs.'''
+        where, params = self._filter(klant, bedrijf, betaalstatus, vanaf, tot_en_met)
         cursor = self.conn.cursor()
-        cursor.execute("""SELECT Factuur.factuurnummer FROM Factuur;""")
-        factuurnummers = cursor.fetchall()
-        return [
-            self.get(factuurnummer[0])
-            for factuurnummer in factuurnummers
-        ]
-    
-    def add(self, item: Factuur) -> None:
+        cursor.execute(f"SELECT {_select_columns(FACTUUR_COLUMNS, include_blobs, lazy_blobs)}, Factuur.pdf_ref, Factuur.rowid FROM Factuur WHERE {where} ORDER BY Factuur.rowid;", params)
+        while True:
+            facturen = cursor.fetchmany(chunk_size)
+            if not facturen:
+                break
+            chunk_where = f"Factuur.factuurnummer IN ({', '.join(['?'] * len(facturen))})"
+            yield from self._assemble(facturen, chunk_where, [factuur[0] for factuur in facturen], include_blobs, lazy_blobs)
+
+    def page(self, klant: Optional[int] = None, bedrijf: Optional[int] = None, betaalstatus: Optional[bool] = None, vanaf: Optional[str] = None, tot_en_met: Optional[str] = None, verlopen: bool = False, na: Optional[tuple[str, str]] = None, limit: int = 50, aflopend: bool = False, vandaag: Optional[str] = None) -> FactuurPagina:
+        '''
+        Returns up to limit facturen matching the filters as FactuurOverzicht rows, ordered by factuurdatum and factuurnummer, newest first with aflopend.
+        na is the volgende of the previous page: the page continues after that key instead of skipping rows with an OFFSET,
+        so every page is read from the indexes on (factuurdatum, factuurnummer) in the same time, however deep it is.
+        verlopen only selects unpaid facturen whose uiterste_betaaldatum is before vandaag, which defaults to today.'''
+        if limit < 1:
+            raise ValueError(f"Limit {limit} must be at least 1.")
+        where, params = self._filter(klant, bedrijf, betaalstatus, vanaf, tot_en_met)
+        if verlopen:
+            # idx_factuur_betaalstatus_factuurdatum returns the rows in page order and checks the range from the index
+            where += " AND Factuur.betaalstatus = 0 AND Factuur.uiterste_betaaldatum < ?"
+            params.append(vandaag or date.today().isoformat())
+        richting = "DESC" if aflopend else "ASC"
+        if na is not None:
+            where += f" AND (Factuur.factuurdatum, Factuur.factuurnummer) {'<' if aflopend else '>'} (?, ?)"
+            params.extend(na)
         cursor = self.conn.cursor()
-        repo = SingleEntityRepository(self.db_path)
-        repo.conn = self.conn
-        # Check if all entities exist
-        if not item.klant == repo.get(item.klant.id, 'Klant'):
-            raise ValueError(f"Klant with id {item.klant.id} does not exist.")
-        if not item.bedrijf == repo.get(item.bedrijf.id, 'Bedrijf'):
-            raise ValueError(f"Bedrijf with id {item.bedrijf.id} does not exist.")
-        for product in item.producten:
-            if not product.product == repo.get(product.product.id, 'Product'):
-                raise ValueError(f"Product with id {product.id} does not exist.")
-        # Insert new factuur in database
-        cursor.execute("""
-                        INSERT INTO Factuur
-                        (factuurnummer, klant, bedrijf, factuurdatum, uiterste_betaaldatum, totaalbedrag_excl, btw_bedrag, totaalbedrag_incl, betaalstatus, pdf)
-                        VALUES
-                        (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-                        """, (
-                            item.factuurnummer,
-                            item.klant.id,
-                            item.bedrijf.id,
-                            item.factuurdatum,
-                            item.uiterste_betaaldatum,
-                            item.totaalbedrag_excl,
-                            item.btw_bedrag,
-                            item.totaalbedrag_incl,
-                            item.betaalstatus,
-                            item.pdf
-                        ))
-        # Insert Bevat products using a for loop
-        for product in item.producten:
-            cursor.execute("""
-                            INSERT INTO BevatProduct
-                            (factuur, product, hoeveelheid, datum)
-                            VALUES
-                            (?, ?, ?, ?);
-                            """, (
-                                item.factuurnummer,
-                                product.product.id,
-                                product.hoeveelheid,
-                                product.datum
-                            ))
-        self.conn.commit()
-        
-    def update(self, item: Factuur) -> None:
+        cursor.execute(f"""
+                        SELECT {', '.join(FactuurOverzicht._fields)} FROM Factuur WHERE {where}
+                        ORDER BY Factuur.factuurdatum {richting}, Factuur.factuurnummer {richting} LIMIT ?;
+                        """, [*params, limit + 1])
+        rows = cursor.fetchall()
+        # The row after the page only tells whether there is a next page
+        facturen = [factuur_overzicht(row) for row in rows[:limit]]
+        volgende = (facturen[-1].factuurdatum, facturen[-1].factuurnummer) if len(rows) > limit else None
+        return FactuurPagina(facturen, volgende)
+
+    def _filter(self, klant: Optional[int], bedrijf: Optional[int], betaalstatus: Optional[bool], vanaf: Optional[str], tot_en_met: Optional[str]) -> tuple[str, list]:
+        conditions = []
+        params = []
+        if klant is not None:
+            conditions.append("Factuur.klant = ?")
+            params.append(klant)
+        if bedrijf is not None:
+            conditions.append("Factuur.bedrijf = ?")
+            params.append(bedrijf)
+        if betaalstatus is not None:
+            conditions.append("Factuur.betaalstatus = ?")
+            params.append(betaalstatus)
+        if vanaf is not None:
+            conditions.append("Factuur.factuurdatum >= ?")
+            params.append(vanaf)
+        if tot_en_met is not None:
+            conditions.append("Factuur.factuurdatum <= ?")
+            params.append(tot_en_met)
+        return " AND ".join(conditions) or "1", params
+
+    def _load(self, where: str, params: list, include_blobs: bool = True, lazy_blobs: bool = False, include_producten: bool = True) -> list[Factuur]:
         cursor = self.conn.cursor()
-        repo = SingleEntityRepository(self.db_path)
-        repo.conn = self.conn
-        # Check if all entities exist
-        if not item.klant == repo.get(item.klant.id, 'Klant'):
-            raise ValueError(f"Klant with id {item.klant.id} does not exist.")
-        if not item.bedrijf == repo.get(item.bedrijf.id, 'Bedrijf'):
-            raise ValueError(f"Bedrijf with id {item.bedrijf.id} does not exist.")
-        for product in item.producten:
-            if not product.product == repo.get(product.product.id, 'Product'):
-                raise ValueError(f"Product with id {product.id} does not exist.")
-        # Update factuur in database
-        cursor.execute("""
-                        UPDATE Factuur SET
-                        factuurnummer = ?,
-                        klant = ?,
-                        bedrijf = ?,
-                        factuurdatum = ?,
-                        uiterste_betaaldatum = ?,
-                        totaalbedrag_excl = ?,
-                        btw_bedrag = ?,
-                        totaalbedrag_incl = ?,
-                        betaalstatus = ?,
-                        pdf = ?
-                        WHERE factuurnummer = ?;
-                       """, (
-                            item.factuurnummer,
-                            item.klant.id,
-                            item.bedrijf.id,
-                            item.factuurdatum,
-                            item.uiterste_betaaldatum,
-                            item.totaalbedrag_excl,
-                            item.btw_bedrag,
-                            item.totaalbedrag_incl,
-                            item.betaalstatus,
-                            item.pdf,
-                            item.factuurnummer
-                        ))
-        # Delete all BevatProducts with corresponding to that factuurnummer
-        cursor.execute("""DELETE FROM BevatProduct WHERE BevatProduct.factuur = ?;""", (item.factuurnummer,))
-        # Insert Bevat products using a for loop
-        for product in item.producten:
-            cursor.execute("""
-                            INSERT INTO BevatProduct
-                            (factuur, product, hoeveelheid, datum)
-                            VALUES
-                            (?, ?, ?, ?);
-                            """, (
-                                item.factuurnummer,
-                                product.product.id,
-                                product.hoeveelheid,
-                                product.datum
-                            ))
-        self.conn.commit()
+        cursor.execute(f"SELECT {_select_columns(FACTUUR_COLUMNS, include_blobs, lazy_blobs)}, Factuur.pdf_ref, Factuur.rowid FROM Factuur WHERE {where} ORDER BY Factuur.rowid;", params)
+        return self._assemble(cursor.fetchall(), where, params, include_blobs, lazy_blobs, include_producten)
+
+    def _assemble(self, facturen: list[tuple], where: str, params: list, include_blobs: bool, lazy_blobs: bool = False, include_producten: bool = True) -> list[Factuur]:
+        # where selects exactly the Factuur rows in facturen, which hold FACTUUR_COLUMNS followed by pdf_ref and the rowid
+        if not facturen:
+            return []
+        cursor = self.conn.cursor()
+        # Every referenced entity is fetched once with a set-based IN query
+        klanten = self._load_entities("Klant", f"SELECT Factuur.klant FROM Factuur WHERE {where}", params, include_blobs, lazy_blobs)
+        bedrijven = self._load_entities("Bedrijf", f"SELECT Factuur.bedrijf FROM Factuur WHERE {where}", params, include_blobs, lazy_blobs)
+        bevatproducten = {}
+        if include_producten:
+            producten = self._load_entities("Product", f"""
+                            SELECT BevatProduct.product FROM BevatProduct
+                            JOIN Factuur ON Factuur.factuurnummer = BevatProduct.factuur
+                            WHERE {where}""", params, include_blobs, lazy_blobs)
+            cursor.execute(f"""
+                            SELECT BevatProduct.factuur, BevatProduct.product, BevatProduct.hoeveelheid, BevatProduct.datum
+                            FROM BevatProduct JOIN Factuur ON Factuur.factuurnummer = BevatProduct.factuur
+                            WHERE {where} ORDER BY BevatProduct.rowid;
+                            """, params)
+            for factuur, product, hoeveelheid, datum in cursor.fetchall():
+                self._add_regel(bevatproducten.setdefault(factuur, Regels()), self._lookup(producten, product, "Product"), hoeveelheid, datum)
+        hydrator_factuur = hydrator(Factuur, tuple(FACTUUR_COLUMNS))
+        items = []
+        for row in facturen:
+            factuur_dict = hydrator_factuur.values(row)
+            if lazy_blobs:
+                factuur_dict = _lazy_blobs(self.conn, "Factuur", factuur_dict, row[-1])
+            if row[-2] is not None and (include_blobs or lazy_blobs):
+                factuur_dict["pdf"] = self._stored_pdf(row[-2], lazy_blobs)
+            factuur_dict["klant"] = self._lookup(klanten, factuur_dict["klant"], "Klant")
+            factuur_dict["bedrijf"] = self._lookup(bedrijven, factuur_dict["bedrijf"], "Bedrijf")
+            factuur_dict["producten"] = bevatproducten.get(factuur_dict["factuurnummer"], Regels())
+            items.append(hydrator_factuur.build(factuur_dict, self.strict))
+        return items
+
+    def _load_entities(self, table_name: str, id_query: str, params: list, include_blobs: bool, lazy_blobs: bool = False) -> dict[int, Product | Klant | Bedrijf]:
+        entity = hydrator(ENTITY_MODELS[table_name])
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT {_select_columns(entity.columns, include_blobs, lazy_blobs)} FROM {table_name} WHERE id IN ({id_query});", params)
+        entities = {}
+        for row in cursor.fetchall():
+            values = entity.values(row)
+            if lazy_blobs:
+                values = _lazy_blobs(self.conn, table_name, values, values["id"])
+            entities[values["id"]] = entity.build(values, self.strict)
+        return entities
+
+    def _entities(self) -> SingleEntityRepository:
+        # Shares the pool, the cache and an explicitly assigned connection with this repository
+        repo = SingleEntityRepository(cache=self.cache, pool=self.pool, strict=self.strict)
+        repo._conn = self._conn
+        return repo
+
+    def _bevatproduct(self, product: Product, hoeveelheid: int, datum: str) -> BevatProduct:
+        return hydrator(BevatProduct).build({"product": product, "hoeveelheid": hoeveelheid, "datum": datum}, self.strict)
+
+    def _add_regel(self, regels: Regels, product: Product, hoeveelheid: int, datum: str) -> None:
+        # A strict repository validates every line before it goes into the arrays
+        if self.strict:
+            regels.append(self._bevatproduct(product, hoeveelheid, datum))
+        else:
+            regels.add(product, hoeveelheid, datum)
+
+    def _stored_pdf(self, pdf_ref: str, lazy: bool) -> bytes | StoredPdf:
+        if self.pdf_store is None:
+            raise ValueError(f"Pdf {pdf_ref} is kept in a PdfStore, but this repository has no pdf_store.")
+        return StoredPdf(self.pdf_store, pdf_ref) if lazy else self.pdf_store.get(pdf_ref)
+
+    def _lookup(self, entities: dict[int, Product | Klant | Bedrijf], id: Union[int, str], table_name: str) -> Product | Klant | Bedrijf:
+        # Foreign keys are stored in VARCHAR columns, so ids come back as text
+        entity = entities.get(int(id))
+        if entity is None:
+            raise ValueError(f"{table_name} with id {id} does not exist.")
+        return entity
     
+    def add(self, item: Factuur) -> None:
+        self._write_many([item], 1, update=False)
+
+    def add_many(self, items: list[Factuur], batch_size: int = 100) -> None:
+        '''
+        Inserts the facturen and their line items with executemany and one commit per batch.
+        A failing batch is rolled back as a whole; earlier batches stay committed.'''
+        self._write_many(items, batch_size, update=False)
+
+    def update(self, item: Factuur) -> None:
+        self._write_many([item], 1, update=True)
+
+    def update_many(self, items: list[Factuur], batch_size: int = 100) -> None:
+        '''
+        Updates the facturen and replaces their line items with executemany and one commit per batch.
+        A failing batch is rolled back as a whole; earlier batches stay committed.'''
+        self._write_many(items, batch_size, update=True)
+
+    def _write_many(self, items: list[Factuur], batch_size: int, update: bool) -> None:
+        # Without foreign key enforcement the references of a batch are checked with one IN query per table before anything is written.
+        # With PRAGMA foreign_keys on, SQLite checks them while writing and the IN queries only run to report a failing batch.
+        foreign_keys = self.conn.execute("PRAGMA foreign_keys;").fetchone()[0]
+        for batch in _batches(items, batch_size):
+            if not foreign_keys:
+                self._check_references(batch)
+            try:
+                with self.conn:
+                    cursor = self.conn.cursor()
+                    if update:
+                        self._update_changes(cursor, batch)
+                    else:
+                        cursor.executemany(INSERT_FACTUUR, [self._factuur_values(item) for item in batch])
+                        cursor.executemany(INSERT_BEVATPRODUCT, self._bevatproduct_values(batch))
+            except sqlite3.IntegrityError:
+                if foreign_keys:
+                    # SQLite does not say which reference failed, so report the missing ids if that was the cause
+                    self._check_references(batch)
+                raise
+
+    def _update_changes(self, cursor: sqlite3.Cursor, items: list[Factuur]) -> None:
+        '''
+        Compares items with the stored facturen and only writes what differs:
+        the changed Factuur columns, and the line items that were added, removed or got another hoeveelheid.
+        When the kept line items are reordered, or new ones are not at the end, the line items of that factuur are replaced as a whole,
+        so they keep the order of item.producten.'''
+        factuurnummers = [item.factuurnummer for item in items]
+        placeholders = ", ".join(["?"] * len(items))
+        columns = [column for column in FACTUUR_WRITE_COLUMNS[1:] if column != "pdf"]
+        cursor.execute(f"SELECT factuurnummer, {', '.join(columns)}, length(pdf), rowid FROM Factuur WHERE factuurnummer IN ({placeholders});", factuurnummers)
+        stored = {row[0]: row for row in cursor.fetchall()}
+        missing = [factuurnummer for factuurnummer in factuurnummers if factuurnummer not in stored]
+        if missing:
+            raise ValueError(f"Factuur with factuurnummer {', '.join(missing)} does not exist.")
+        cursor.execute(f"SELECT factuur, product, datum, hoeveelheid, rowid FROM BevatProduct WHERE factuur IN ({placeholders}) ORDER BY rowid;", factuurnummers)
+        stored_producten = {}
+        for factuur, product, datum, hoeveelheid, rowid in cursor.fetchall():
+            stored_producten.setdefault(factuur, {})[(str(product), datum)] = (hoeveelheid, rowid)
+
+        updates = {}
+        deletes = []
+        changed_hoeveelheden = []
+        replaced = []
+        inserts = []
+        for item in items:
+            row = stored[item.factuurnummer]
+            values = dict(zip(FACTUUR_WRITE_COLUMNS, self._factuur_values(item)))
+            changed = [column for column, old in zip(columns, row[1:]) if not _same_value(old, values[column])]
+            if not _same_pdf(self.conn, values["pdf"], row[-2], row[-1]):
+                changed.append("pdf")
+            if changed:
+                updates.setdefault(tuple(changed), []).append(tuple(values[column] for column in changed) + (item.factuurnummer,))
+
+            old = stored_producten.get(item.factuurnummer, {})
+            new = {(str(product.product.id), product.datum): product for product in item.producten}
+            kept = [key for key in old if key in new]
+            if len(new) != len(item.producten) or list(new)[:len(kept)] != kept:
+                # Duplicate or reordered line items, write them again in the order of item.producten
+                replaced.append((item.factuurnummer,))
+                inserts.extend(self._bevatproduct_values([item]))
+                continue
+            deletes.extend((rowid,) for key, (_, rowid) in old.items() if key not in new)
+            changed_hoeveelheden.extend((new[key].hoeveelheid, rowid) for key, (hoeveelheid, rowid) in old.items() if key in new and hoeveelheid != new[key].hoeveelheid)
+            inserts.extend((item.factuurnummer, product.product.id, product.hoeveelheid, product.datum) for key, product in new.items() if key not in old)
+
+        for changed, params in updates.items():
+            cursor.executemany(f"UPDATE Factuur SET {', '.join(f'{column} = ?' for column in changed)} WHERE factuurnummer = ?;", params)
+        cursor.executemany("""DELETE FROM BevatProduct WHERE BevatProduct.factuur = ?;""", replaced)
+        cursor.executemany("""DELETE FROM BevatProduct WHERE rowid = ?;""", deletes)
+        cursor.executemany("""UPDATE BevatProduct SET hoeveelheid = ? WHERE rowid = ?;""", changed_hoeveelheden)
+        cursor.executemany(INSERT_BEVATPRODUCT, inserts)
+
+    def set_betaalstatus(self, factuurnummers: list[str], betaalstatus: bool = True) -> int:
+        '''
+        Sets the betaalstatus of the facturen in one transaction, without loading them.
+        Facturen that already have that betaalstatus are not written. Returns the number of facturen that changed.'''
+        changed = 0
+        with self.conn:
+            cursor = self.conn.cursor()
+            for batch in _batches(list(factuurnummers), 500):
+                cursor.execute(f"UPDATE Factuur SET betaalstatus = ? WHERE betaalstatus != ? AND factuurnummer IN ({', '.join(['?'] * len(batch))});", [betaalstatus, betaalstatus, *batch])
+                changed += cursor.rowcount
+        return changed
+
+    def _check_references(self, items: list[Factuur]) -> None:
+        '''
+        Raises a ValueError listing every Klant, Bedrijf and Product id of items that does not exist, with one IN query per table.'''
+        errors = []
+        for table_name, ids in [
+            ("Klant", [item.klant.id for item in items]),
+            ("Bedrijf", [item.bedrijf.id for item in items]),
+            ("Product", [product.product.id for item in items for product in item.producten])
+        ]:
+            missing = _missing_ids(self.conn, table_name, ids)
+            if missing:
+                errors.append(f"{table_name} with id {', '.join(str(id) for id in sorted(missing))} does not exist.")
+        if errors:
+            raise ValueError(" ".join(errors))
+
+    def _factuur_values(self, item: Factuur) -> tuple:
+        return (
+            item.factuurnummer,
+            item.klant.id,
+            item.bedrijf.id,
+            item.factuurdatum,
+            item.uiterste_betaaldatum,
+            item.totaalbedrag_excl,
+            item.btw_bedrag,
+            item.totaalbedrag_incl,
+            item.betaalstatus,
+            *self._pdf_values(item.pdf)
+        )
+
+    def _pdf_values(self, pdf: Optional[bytes | LazyBlob | StoredPdf]) -> tuple:
+        # Returns the (pdf, pdf_ref) column values
+        if pdf is None:
+            return (None, None)
+        if self.pdf_store is None:
+            return (pdf, None)
+        if isinstance(pdf, StoredPdf):
+            # Already in the store, so the pdf is neither read nor written again
+            return (None, pdf.key)
+        return (None, self.pdf_store.put(bytes(pdf), self.conn))
+
+    def _bevatproduct_values(self, items: list[Factuur]) -> list[tuple]:
+        return [
+            (item.factuurnummer, product.product.id, product.hoeveelheid, product.datum)
+            for item in items
+            for product in item.producten
+        ]
+
     def delete(self, item: Factuur) -> None:
         cursor = self.conn.cursor()
         cursor.execute("""DELETE FROM BevatProduct WHERE BevatProduct.factuur = ?;""", (item.factuurnummer,))
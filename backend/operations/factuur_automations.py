@@ -1,86 +1,266 @@
 from fpdf import FPDF
-from .database_operations import Product, Klant, Bedrijf, Factuur, BevatProduct
+from fpdf.enums import XPos, YPos
+from fpdf.image_datastructures import ImageCache, RasterImageInfo
+from fpdf.image_parsing import preload_image
+from .database_operations import Product, Klant, Bedrijf, Factuur, BevatProduct, FactuurRepository
+from .geld import euro
+from concurrent.futures import Executor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, Iterator, NamedTuple, Optional
+from collections import OrderedDict
+import asyncio
+import io
 import os
+import threading
+
+# Cursor movement after a cell: continue on the same line, or start the next line
+SAME_LINE = {"new_x": XPos.RIGHT, "new_y": YPos.TOP}
+NEXT_LINE = {"new_x": XPos.LMARGIN, "new_y": YPos.NEXT}
 
 def convert_pic(filename):
     with open(filename, "rb") as f:
         photo = f.read()
     return photo
 
-def generate_pdf(factuur: Factuur) -> Factuur:
+class FactuurTemplate:
+    '''
+    The parts of a factuur pdf that only depend on the Bedrijf: the decoded logo and the static header and footer cells.'''
+    def __init__(self, bedrijf: Bedrijf):
+        # Decode and compress the logo once; every document gets a copy of the resulting image info
+        self.images = ImageCache()
+        self.logo, _, _ = preload_image(self.images, io.BytesIO(bytes(bedrijf.logo)))
+        # The right column of the header, next to the klant and factuur details
+        self.header = [
+            f"{bedrijf.handelsnaam}",
+            f"{bedrijf.straatnaam}, {bedrijf.huisnummer}",
+            f"{bedrijf.postcode}, {bedrijf.plaats}",
+            f"KVK-nummer: {bedrijf.kvk_nummer}",
+            f"BTW-nummer: {bedrijf.btw_nummer}",
+            f"Email: {bedrijf.email}",
+            f"Telefoonnummer: {bedrijf.telefoonnummer}"
+        ]
+        # The left column of the footer, next to the totals
+        self.footer = [
+            f"Bank: {bedrijf.bank}",
+            f"IBAN: {bedrijf.iban}",
+            f"BIC: {bedrijf.bic}"
+        ]
+
+    def image_cache(self) -> ImageCache:
+        # Usage counters and indices are per document, so each document gets its own copy of the image info
+        images = {name: RasterImageInfo(info, usages=0) for name, info in self.images.images.items()}
+        return ImageCache(images=images, icc_profiles=dict(self.images.icc_profiles), image_filter=self.images.image_filter)
+
+_templates = OrderedDict()
+_templates_lock = threading.Lock()
+TEMPLATE_CACHE_SIZE = 64
+
+class _CachedTemplate(NamedTuple):
+    velden: tuple
+    # The logo object the template was built from, and its bytes
+    logo: object
+    logo_bytes: Optional[bytes]
+    template: FactuurTemplate
+
+def _same_logo(bedrijf: Bedrijf, cached: _CachedTemplate) -> bool:
+    # The logo of a Bedrijf object is only compared once: after that it is the object the template was cached with,
+    # so a LazyBlob logo is not read again for every factuur. A different logo object is compared by its length first.
+    if bedrijf.logo is cached.logo:
+        return True
+    if bedrijf.logo is None or cached.logo_bytes is None:
+        return bedrijf.logo is None and cached.logo_bytes is None
+    return bedrijf.logo == cached.logo_bytes
+
+def get_template(bedrijf: Bedrijf) -> FactuurTemplate:
+    '''
+    Returns the cached FactuurTemplate of the bedrijf.
+    The template is rebuilt when any field of the Bedrijf changed since it was cached.'''
+    velden = tuple(bedrijf.model_dump(exclude={"logo"}).values())
+    with _templates_lock:
+        cached = _templates.get(bedrijf.id)
+    if cached is not None and cached.velden == velden and _same_logo(bedrijf, cached):
+        with _templates_lock:
+            if bedrijf.id in _templates:
+                _templates.move_to_end(bedrijf.id)
+                # Later calls with the same Bedrijf object find its logo by identity
+                _templates[bedrijf.id] = cached._replace(logo=bedrijf.logo)
+        return cached.template
+    logo_bytes = bytes(bedrijf.logo) if bedrijf.logo is not None else None
+    template = FactuurTemplate(bedrijf.model_copy(update={"logo": logo_bytes}))
+    with _templates_lock:
+        _templates[bedrijf.id] = _CachedTemplate(velden, bedrijf.logo, logo_bytes, template)
+        _templates.move_to_end(bedrijf.id)
+        while len(_templates) > TEMPLATE_CACHE_SIZE:
+            _templates.popitem(last=False)
+    return template
+
+def clear_templates() -> None:
+    with _templates_lock:
+        _templates.clear()
+
+def _tabel_kop(pdf: FPDF) -> None:
+    pdf.cell(25, 10, text="Datum", border=1, **SAME_LINE, align="C")
+    pdf.cell(40, 10, text="Product", border=1, **SAME_LINE, align="L")
+    pdf.cell(60, 10, text="Omschrijving", border=1, **SAME_LINE, align="L")
+    pdf.cell(15, 10, text="Aantal", border=1, **SAME_LINE, align="C")
+    pdf.cell(20, 10, text="Prijs", border=1, **SAME_LINE, align="C")
+    pdf.cell(30, 10, text="Totaal", border=1, **NEXT_LINE, align="C")
+
+def _pagina_subtotaal(pdf: FPDF, subtotaal: int) -> None:
+    pdf.cell(160, 10, text="Subtotaal pagina", border=1, **SAME_LINE, align="R")
+    pdf.cell(30, 10, text=euro(subtotaal), border=1, **NEXT_LINE, align="R")
+
+def generate_pdf(factuur: Factuur, producten: Optional[Iterable[BevatProduct]] = None) -> Factuur:
     '''
     Generates a pdf for the factuur
-    Then reads the pdf as binary data and stores it in the factuur object
-    Returns the factuur object'''
+    Then stores the pdf as binary data in the factuur object
+    Returns the factuur object
+    The logo and the pdf only live in memory, so it is safe to render concurrently
+    The parts that only depend on the bedrijf come from its cached FactuurTemplate
+    producten can be an iterator over the line items, e.g. FactuurRepository.iter_producten, which is used instead of factuur.producten
+    The product table continues over as many pages as needed, with the table header and a subtotal on every page'''
+    template = get_template(factuur.bedrijf)
     pdf = FPDF()
+    pdf.image_cache = template.image_cache()
     pdf.add_page()
-    pdf.set_font("Arial", size=10)
+    pdf.set_font("Helvetica", size=10)
 
     # Header
-    #convert binary image to png
-    with open("temporary.png", "wb") as f:
-        f.write(factuur.bedrijf.logo)
-    pdf.image("temporary.png", x=10, y=10, h=30)
-    os.remove("temporary.png")
     #print image
+    pdf.image(template.logo, x=10, y=10, h=30)
     pdf.ln(30)
 
-    pdf.cell(100, 10, txt=f"{factuur.klant.handelsnaam}", ln=False)
-    pdf.cell(0, 10, txt=f"{factuur.bedrijf.handelsnaam}", ln=True, align="R")
-    pdf.cell(100, 10, txt=f"{factuur.klant.ten_aanzien_van}", ln=False)
-    pdf.cell(0, 10, txt=f"{factuur.bedrijf.straatnaam}, {factuur.bedrijf.huisnummer}", ln=True, align="R")
-    pdf.cell(100, 10, txt=f"{factuur.klant.straatnaam}, {factuur.klant.huisnummer}", ln=False)
-    pdf.cell(0, 10, txt=f"{factuur.bedrijf.postcode}, {factuur.bedrijf.plaats}", ln=True, align="R")
-    pdf.cell(100, 10, txt=f"{factuur.klant.postcode}, {factuur.klant.plaats}", ln=False)
-    pdf.cell(0, 10, txt=f"KVK-nummer: {factuur.bedrijf.kvk_nummer}", ln=True, align="R")
-    pdf.cell(0, 10, txt=f"BTW-nummer: {factuur.bedrijf.btw_nummer}", ln=True, align="R")
-    pdf.cell(100, 10, txt=f"Factuurnummer: {factuur.factuurnummer}", ln=False)
-    pdf.cell(0, 10, txt=f"Email: {factuur.bedrijf.email}", ln=True, align="R")
-    pdf.cell(100, 10, txt=f"Factuurdatum: {factuur.factuurdatum}", ln=False)
-    pdf.cell(0, 10, txt=f"Telefoonnummer: {factuur.bedrijf.telefoonnummer}", ln=True, align="R")
+    klant_regels = [
+        f"{factuur.klant.handelsnaam}",
+        f"{factuur.klant.ten_aanzien_van}",
+        f"{factuur.klant.straatnaam}, {factuur.klant.huisnummer}",
+        f"{factuur.klant.postcode}, {factuur.klant.plaats}",
+        None,
+        f"Factuurnummer: {factuur.factuurnummer}",
+        f"Factuurdatum: {factuur.factuurdatum}"
+    ]
+    for klant_regel, bedrijf_regel in zip(klant_regels, template.header):
+        if klant_regel is not None:
+            pdf.cell(100, 10, text=klant_regel, **SAME_LINE)
+        pdf.cell(0, 10, text=bedrijf_regel, **NEXT_LINE, align="R")
     pdf.ln(10)
 
     #Producten
-    pdf.cell(25, 10, txt="Datum", border=1, ln=False, align="C")
-    pdf.cell(40, 10, txt="Product", border=1, ln=False, align="L")
-    pdf.cell(60, 10, txt="Omschrijving", border=1, ln=False, align="L")
-    pdf.cell(15, 10, txt="Aantal", border=1, ln=False, align="C")
-    pdf.cell(20, 10, txt="Prijs", border=1, ln=False, align="C")
-    pdf.cell(30, 10, txt="Totaal", border=1, ln=True, align="C")
-
-    # Producten
-    pdf.cell(25, 10, txt="Datum", border=1, ln=False, align="C")
-    pdf.cell(40, 10, txt="Product", border=1, ln=False, align="L")
-    pdf.cell(60, 10, txt="Omschrijving", border=1, ln=False, align="L")
-    pdf.cell(15, 10, txt="Aantal", border=1, ln=False, align="C")
-    pdf.cell(20, 10, txt="Prijs", border=1, ln=False, align="C")
-    pdf.cell(30, 10, txt="Totaal", border=1, ln=True, align="C")
-
-    for bevat_product in factuur.producten:
-        pdf.cell(25, 10, txt=str(bevat_product.datum), border=1, ln=False, align="C")
-        pdf.cell(40, 10, txt=bevat_product.product.naam, border=1, ln=False, align="L")
-        pdf.cell(60, 10, txt=str(bevat_product.product.omschrijving), border=1, ln=False, align="L")
-        pdf.cell(15, 10, txt=str(bevat_product.hoeveelheid), border=1, ln=False, align="C")
-        pdf.cell(20, 10, txt=f"{bevat_product.product.eenheidsprijs:.2f}", border=1, ln=False, align="R")
-        pdf.cell(30, 10, txt=f"{bevat_product.product.eenheidsprijs * bevat_product.hoeveelheid:.2f}", border=1, ln=True, align="R")
+    _tabel_kop(pdf)
+    pagina_subtotaal = 0
+    meerdere_paginas = False
+    for bevat_product in (factuur.producten if producten is None else producten):
+        # Keep room for this row and the subtotal row at the bottom of the page
+        if pdf.will_page_break(20):
+            _pagina_subtotaal(pdf, pagina_subtotaal)
+            pdf.add_page()
+            _tabel_kop(pdf)
+            pagina_subtotaal = 0
+            meerdere_paginas = True
+        regel_totaal = bevat_product.product.eenheidsprijs * bevat_product.hoeveelheid
+        pdf.cell(25, 10, text=str(bevat_product.datum), border=1, **SAME_LINE, align="C")
+        pdf.cell(40, 10, text=bevat_product.product.naam, border=1, **SAME_LINE, align="L")
+        pdf.cell(60, 10, text=str(bevat_product.product.omschrijving), border=1, **SAME_LINE, align="L")
+        pdf.cell(15, 10, text=str(bevat_product.hoeveelheid), border=1, **SAME_LINE, align="C")
+        pdf.cell(20, 10, text=euro(bevat_product.product.eenheidsprijs), border=1, **SAME_LINE, align="R")
+        pdf.cell(30, 10, text=euro(regel_totaal), border=1, **NEXT_LINE, align="R")
+        pagina_subtotaal += regel_totaal
+    if meerdere_paginas:
+        _pagina_subtotaal(pdf, pagina_subtotaal)
 
     # Betaalinformatie, Uiterste betaaldatum, Totaal verschuldigd
-    pdf.cell(100, 10, txt=f"Betaalinformatie:", ln=True)
-    pdf.cell(100, 10, txt=f"Bank: {factuur.bedrijf.bank}", ln=False)
-    pdf.cell(0, 10, txt=f"Totaal excl. BTW: {factuur.totaalbedrag_excl:.2f} EUR", ln=True, align="R")
-    pdf.cell(100, 10, txt=f"IBAN: {factuur.bedrijf.iban}", ln=False)
-    pdf.cell(0, 10, txt=f"BTW: {factuur.btw_bedrag:.2f} EUR", ln=True, align="R")
-    pdf.cell(100, 10, txt=f"BIC: {factuur.bedrijf.bic}", ln=False)
-    pdf.cell(0, 10, txt=f"Totaal incl. BTW: {factuur.totaalbedrag_incl:.2f} EUR", ln=True, align="R")
+    pdf.cell(100, 10, text=f"Betaalinformatie:", **NEXT_LINE)
+    totalen = [
+        f"Totaal excl. BTW: {euro(factuur.totaalbedrag_excl)} EUR",
+        f"BTW: {euro(factuur.btw_bedrag)} EUR",
+        f"Totaal incl. BTW: {euro(factuur.totaalbedrag_incl)} EUR"
+    ]
+    for bedrijf_regel, totaal in zip(template.footer, totalen):
+        pdf.cell(100, 10, text=bedrijf_regel, **SAME_LINE)
+        pdf.cell(0, 10, text=totaal, **NEXT_LINE, align="R")
 
     pdf.ln(10)
 
-    pdf.cell(0, 10, txt=f"Gelieve het bedrag van {factuur.totaalbedrag_incl} EUR te betalen voor {factuur.uiterste_betaaldatum}, onder vermelding van het factuurnummer {factuur.factuurnummer}.", ln=True)
-    pdf.cell(0, 10, txt=f"Alvast bedankt!", ln=True)
+    pdf.cell(0, 10, text=f"Gelieve het bedrag van {euro(factuur.totaalbedrag_incl)} EUR te betalen voor {factuur.uiterste_betaaldatum}, onder vermelding van het factuurnummer {factuur.factuurnummer}.", **NEXT_LINE)
+    pdf.cell(0, 10, text=f"Alvast bedankt!", **NEXT_LINE)
+
+    factuur.pdf = bytes(pdf.output())
+    return factuur
+
+async def generate_pdf_async(factuur: Factuur, executor: Optional[Executor] = None) -> Factuur:
+    '''
+    Awaitable generate_pdf that renders on executor, or on the default executor of the event loop, so the loop is not blocked.
+    With a ProcessPoolExecutor the rendered copy of the factuur is returned, as in generate_pdfs.'''
+    if isinstance(executor, ProcessPoolExecutor):
+        factuur = _picklable(factuur)
+    return await asyncio.get_running_loop().run_in_executor(executor, generate_pdf, factuur)
 
-    pdf.output(f"{factuur.factuurnummer}.pdf")
-    with open(f"{factuur.factuurnummer}.pdf", "rb") as f:
-        pdf = f.read()
-    factuur.pdf = pdf
-    os.remove(f"{factuur.factuurnummer}.pdf")
-    return factuur
\ No newline at end of file
+class PdfResult(NamedTuple):
+    factuurnummer: str
+    factuur: Optional[Factuur]
+    error: Optional[Exception]
+
+def _picklable(factuur: Factuur) -> Factuur:
+    # Lazily loaded blobs hold a database connection, which cannot be sent to a worker process
+    bedrijf = factuur.bedrijf
+    if bedrijf.logo is not None and not isinstance(bedrijf.logo, bytes):
+        bedrijf = bedrijf.model_copy(update={"logo": bytes(bedrijf.logo)})
+    return factuur.model_copy(update={"bedrijf": bedrijf, "pdf": None})
+
+def _write_back(repo: FactuurRepository, results: list[PdfResult], batch_size: int) -> list[PdfResult]:
+    try:
+        repo.update_many([result.factuur for result in results if result.factuur is not None], batch_size=batch_size)
+        return results
+    except Exception:
+        # Write every factuur of the failed batch on its own, so only the facturen that cannot be stored get an error
+        written = []
+        for result in results:
+            if result.factuur is not None:
+                try:
+                    repo.update(result.factuur)
+                except Exception as error:
+                    result = PdfResult(result.factuurnummer, None, error)
+            written.append(result)
+        return written
+
+def generate_pdfs(facturen: Iterable[Factuur], workers: Optional[int] = None, repo: Optional[FactuurRepository] = None, batch_size: int = 100) -> Iterator[PdfResult]:
+    '''
+    Renders the pdfs in a pool of worker processes and yields a PdfResult per factuur as soon as it is done.
+    A factuur that fails to render is reported through the error of its PdfResult, the rest of the batch continues.
+    When repo is given, the rendered facturen are written back with update_many in batches of batch_size,
+    and their results are yielded once their batch is written; a factuur that cannot be written is reported like a failed render.'''
+    workers = workers or os.cpu_count() or 1
+    facturen = iter(facturen)
+    pending = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            # Keep a bounded number of facturen in flight, so the input can be a lazy iterator of any length
+            for factuur in facturen:
+                running[executor.submit(generate_pdf, _picklable(factuur))] = factuur.factuurnummer
+                if len(running) >= 2 * workers:
+                    break
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    factuurnummer = running.pop(future)
+                    try:
+                        result = PdfResult(factuurnummer, future.result(), None)
+                    except Exception as error:
+                        result = PdfResult(factuurnummer, None, error)
+                    factuur = next(facturen, None)
+                    if factuur is not None:
+                        running[executor.submit(generate_pdf, _picklable(factuur))] = factuur.factuurnummer
+                    if repo is None:
+                        yield result
+                        continue
+                    pending.append(result)
+                    if len(pending) >= batch_size:
+                        results, pending = pending, []
+                        yield from _write_back(repo, results, batch_size)
+        if pending:
+            results, pending = pending, []
+            yield from _write_back(repo, results, batch_size)
+    finally:
+        # A run that is stopped early still stores what was rendered
+        if pending:
+            _write_back(repo, pending, batch_size)
@@ -0,0 +1,86 @@
+import sqlite3
+from typing import NamedTuple, Optional
+from .database_operations import ConnectionPool, PoolRepository, StorageProfile
+
+# The factuurnummer of a number in the reeks of a bedrijf and year; the bedrijf is part of it, because factuurnummers are unique over all bedrijven
+FACTUURNUMMER_FORMAAT = "F{bedrijf}-{jaar}-{nummer:05d}"
+
+class Reservering(NamedTuple):
+    '''
+    Numbers handed out by FactuurnummerRepository.reserveer, in ascending order, with their factuurnummers.'''
+    bedrijf: int
+    jaar: int
+    nummers: list[int]
+    factuurnummers: list[str]
+
+class FactuurnummerRepository(PoolRepository):
+    '''
+    Hands out gap-free factuurnummers per bedrijf and year, so parallel generators never guess a number or retry on a collision.
+    A reservation is a single short write transaction for a whole block of numbers, so workers only contend once per block.
+    Numbers of a block that end up unused are given back with geef_terug and handed out again first, which keeps the reeks without gaps;
+    a reused number can therefore be lower than numbers that were used before it.'''
+    def __init__(self, db_path: Optional[str] = None, pool: Optional[ConnectionPool] = None, profile: Optional[StorageProfile] = None, formaat: str = FACTUURNUMMER_FORMAAT):
+        self._borrow(db_path, None, pool, profile)
+        self.formaat = formaat
+
+    def _begin(self, conn: sqlite3.Connection) -> None:
+        # IMMEDIATE takes the write lock before the reeks is read, so no other connection can hand out the same numbers
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE;")
+
+    def reserveer(self, bedrijf: int, jaar: int, aantal: int = 1) -> Reservering:
+        '''
+        Reserves aantal numbers in the reeks of bedrijf and jaar: first the numbers that were given back, then new ones at the end.'''
+        if aantal < 1:
+            raise ValueError(f"Aantal {aantal} must be at least 1.")
+        conn = self.conn
+        self._begin(conn)
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                            DELETE FROM VrijFactuurnummer WHERE rowid IN (
+                            SELECT rowid FROM VrijFactuurnummer WHERE bedrijf = ? AND jaar = ? ORDER BY nummer LIMIT ?
+                            ) RETURNING nummer;
+                            """, (bedrijf, jaar, aantal))
+            nummers = [row[0] for row in cursor.fetchall()]
+            nieuw = aantal - len(nummers)
+            if nieuw:
+                cursor.execute("""
+                                INSERT INTO Factuurreeks (bedrijf, jaar, volgende) VALUES (?, ?, 1 + ?)
+                                ON CONFLICT (bedrijf, jaar) DO UPDATE SET volgende = volgende + excluded.volgende - 1
+                                RETURNING volgende;
+                                """, (bedrijf, jaar, nieuw))
+                volgende = cursor.fetchone()[0]
+                nummers.extend(range(volgende - nieuw, volgende))
+        nummers.sort()
+        return Reservering(bedrijf, jaar, nummers, [self.formaat.format(bedrijf=bedrijf, jaar=jaar, nummer=nummer) for nummer in nummers])
+
+    def geef_terug(self, reservering: Reservering) -> int:
+        '''
+        Gives the numbers of the reservering back for which no Factuur was stored, and returns how many were given back.'''
+        if not reservering.nummers:
+            return 0
+        conn = self.conn
+        self._begin(conn)
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT factuurnummer FROM Factuur WHERE factuurnummer IN ({', '.join(['?'] * len(reservering.factuurnummers))});", reservering.factuurnummers)
+            gebruikt = {row[0] for row in cursor.fetchall()}
+            ongebruikt = [nummer for nummer, factuurnummer in zip(reservering.nummers, reservering.factuurnummers) if factuurnummer not in gebruikt]
+            cursor.executemany("INSERT OR IGNORE INTO VrijFactuurnummer (bedrijf, jaar, nummer) VALUES (?, ?, ?);",
+                               [(reservering.bedrijf, reservering.jaar, nummer) for nummer in ongebruikt])
+        return len(ongebruikt)
+
+    def begin_bij(self, bedrijf: int, jaar: int, nummer: int) -> None:
+        '''
+        Lets the reeks of bedrijf and jaar continue at nummer, e.g. after the numbers before it were handed out by hand.'''
+        conn = self.conn
+        self._begin(conn)
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT volgende FROM Factuurreeks WHERE bedrijf = ? AND jaar = ?;", (bedrijf, jaar))
+            row = cursor.fetchone()
+            if row is not None and row[0] > nummer:
+                raise ValueError(f"Factuurreeks {bedrijf}/{jaar} has already handed out numbers up to {row[0] - 1}.")
+            cursor.execute("INSERT OR REPLACE INTO Factuurreeks (bedrijf, jaar, volgende) VALUES (?, ?, ?);", (bedrijf, jaar, nummer))
@@ -0,0 +1,37 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Annotated
+from pydantic import Strict
+
+# An amount of money in whole eurocents. Strict, so an amount in euros like 0.50 is rejected instead of truncated
+Centen = Annotated[int, Strict()]
+
+def centen(euros: str | Decimal | int | float) -> int:
+    '''
+    Converts an amount in euros to eurocents, rounding half away from zero: centen("0.50") == 50.
+    Prefer str or Decimal; a float is converted through its shortest representation, so centen(1.15) == 115.'''
+    if isinstance(euros, float):
+        euros = repr(euros)
+    return int((Decimal(euros) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def euro(centen: int) -> str:
+    '''
+    Formats eurocents as euros with two decimals: euro(-105) == "-1.05".'''
+    teken = "-" if centen < 0 else ""
+    euros, rest = divmod(abs(centen), 100)
+    return f"{teken}{euros}.{rest:02d}"
+
+def basispunten(btw_percentage: float) -> int:
+    # A btw_percentage in hundredths of a percent, so the BTW of a line is computed with integers only
+    return round(btw_percentage * 100)
+
+def btw_regel(excl: int, btw_percentage: float) -> int:
+    '''
+    The BTW in eurocents of one line item of excl eurocents, rounded per line, half away from zero.
+    btw_regel_sql computes the same in SQLite.'''
+    btw = (abs(excl) * basispunten(btw_percentage) + 5000) // 10000
+    return -btw if excl < 0 else btw
+
+def btw_regel_sql(excl: str, btw_percentage: str) -> str:
+    # The SQLite expression of btw_regel for the SQL expressions excl and btw_percentage; / on integers truncates, like // on positive numbers
+    punten = f"CAST(ROUND({btw_percentage} * 100) AS INTEGER)"
+    return f"(CASE WHEN {excl} < 0 THEN -((-({excl}) * {punten} + 5000) / 10000) ELSE (({excl}) * {punten} + 5000) / 10000 END)"
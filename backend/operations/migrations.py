@@ -0,0 +1,495 @@
+import sqlite3
+from typing import Callable, NamedTuple, Optional
+from .geld import btw_regel_sql
+
+class Migration(NamedTuple):
+    '''
+    One step of the schema history.
+    schema runs in a single transaction; backfill, if given, updates at most batch_size rows per call and returns how many it changed.
+    Both are run again when an upgrade is interrupted, so they must be safe to repeat:
+    use IF NOT EXISTS for schema changes and only select rows that still need the backfill.
+    finish, if given, runs after the backfill in the transaction that records the version.'''
+    version: int
+    description: str
+    schema: Callable[[sqlite3.Connection], None]
+    backfill: Optional[Callable[[sqlite3.Connection, int], int]] = None
+    finish: Optional[Callable[[sqlite3.Connection], None]] = None
+
+def _create_tables(conn: sqlite3.Connection) -> None:
+    cursor = conn.cursor()
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS Product (
+                    id INTEGER NOT NULL,
+                    naam VARCHAR(255) NOT NULL,
+                    omschrijving VARCHAR(255) NOT NULL,
+                    productcategorie VARCHAR(255) NOT NULL,
+                    eenheidsprijs DECIMAL(10,2) NOT NULL,
+                    btw_percentage DECIMAL(10,2) NOT NULL,
+                    PRIMARY KEY (id)
+                    );
+                    """)
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS Klant (
+                    id INTEGER NOT NULL,
+                    handelsnaam VARCHAR(255) NOT NULL,
+                    ten_aanzien_van VARCHAR(255) NOT NULL,
+                    straatnaam VARCHAR(255) NOT NULL,
+                    huisnummer VARCHAR(255) NOT NULL,
+                    postcode VARCHAR(255) NOT NULL,
+                    plaats VARCHAR(255) NOT NULL,
+                    PRIMARY KEY (id)
+                    );
+                    """)
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS Bedrijf (
+                    id INTEGER NOT NULL,
+                    handelsnaam VARCHAR(255) NOT NULL,
+                    straatnaam VARCHAR(255) NOT NULL,
+                    huisnummer VARCHAR(255) NOT NULL,
+                    postcode VARCHAR(255) NOT NULL,
+                    plaats VARCHAR(255) NOT NULL,
+                    kvk_nummer VARCHAR(255) NOT NULL,
+                    btw_nummer VARCHAR(255) NOT NULL,
+                    bank VARCHAR(255) NOT NULL,
+                    iban VARCHAR(255) NOT NULL,
+                    bic VARCHAR(255) NOT NULL,
+                    telefoonnummer VARCHAR(255) NOT NULL,
+                    email VARCHAR(255) NOT NULL,
+                    logo BLOB,
+                    PRIMARY KEY (id)
+                    );
+                    """)
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS Factuur (
+                    factuurnummer VARCHAR(255) NOT NULL,
+                    klant VARCHAR(255) NOT NULL,
+                    bedrijf VARCHAR(255) NOT NULL,
+                    factuurdatum DATE NOT NULL,
+                    uiterste_betaaldatum DATE NOT NULL,
+                    totaalbedrag_excl DECIMAL(10,2) NOT NULL,
+                    btw_bedrag DECIMAL(10,2) NOT NULL,
+                    totaalbedrag_incl DECIMAL(10,2) NOT NULL,
+                    betaalstatus BOOLEAN NOT NULL DEFAULT FALSE,
+                    pdf BLOB,
+                    PRIMARY KEY (factuurnummer),
+                    FOREIGN KEY (klant) REFERENCES Klant(id),
+                    FOREIGN KEY (bedrijf) REFERENCES Bedrijf(id)
+                    );
+                    """)
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS BevatProduct (
+                    factuur VARCHAR(255) NOT NULL,
+                    product VARCHAR(255) NOT NULL,
+                    hoeveelheid INT NOT NULL,
+                    datum DATE NOT NULL,
+                    PRIMARY KEY (factuur, product, datum),
+                    FOREIGN KEY (factuur) REFERENCES Factuur(factuurnummer),
+                    FOREIGN KEY (product) REFERENCES Product(id)
+                    );
+                """)
+
+def _columns(conn: sqlite3.Connection, table_name: str) -> list[str]:
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info({table_name});")
+    return [column[1] for column in cursor.fetchall()]
+
+def _add_pdf_ref(conn: sqlite3.Connection) -> None:
+    # pdf_ref holds the PdfStore key when the pdf is not stored in the Factuur row itself
+    if "pdf_ref" not in _columns(conn, "Factuur"):
+        conn.execute("ALTER TABLE Factuur ADD COLUMN pdf_ref VARCHAR(64);")
+
+# BevatProduct(factuur) keeps the line items of a factuur in rowid order, so they are read without a sort
+# (factuurdatum, factuurnummer) serves date ranges and keyset pagination over the factuurdatum
+FACTUUR_INDEXES = {
+    "idx_factuur_klant": "Factuur (klant)",
+    "idx_factuur_bedrijf": "Factuur (bedrijf)",
+    "idx_factuur_factuurdatum": "Factuur (factuurdatum, factuurnummer)",
+    "idx_factuur_uiterste_betaaldatum": "Factuur (uiterste_betaaldatum)",
+    "idx_factuur_betaalstatus": "Factuur (betaalstatus, uiterste_betaaldatum)",
+    "idx_bevatproduct_factuur": "BevatProduct (factuur)",
+    "idx_bevatproduct_product": "BevatProduct (product)"
+}
+
+def _create_indexes(conn: sqlite3.Connection) -> None:
+    for name, definition in FACTUUR_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition};")
+
+def _upsert(table_name: str, key: list[str], values: list[str], select: str) -> str:
+    # Adds the selected values to the aggregate row with the same key, creating it when it does not exist yet
+    columns = key + values
+    return f"""
+            INSERT INTO {table_name} ({', '.join(columns)}) {select}
+            ON CONFLICT ({', '.join(key)}) DO UPDATE SET {', '.join(f'{column} = {column} + excluded.{column}' for column in values)};"""
+
+def _omzet(row: str, sign: str) -> str:
+    return _upsert("OmzetPerMaand", ["bedrijf", "maand"], ["aantal", "totaal_excl", "btw", "totaal_incl"],
+                   f"SELECT {row}.bedrijf, substr({row}.factuurdatum, 1, 7), {sign}1, {sign}{row}.totaalbedrag_excl, {sign}{row}.btw_bedrag, {sign}{row}.totaalbedrag_incl WHERE true")
+
+def _openstaand(row: str, sign: str) -> str:
+    return _upsert("OpenstaandPerKlant", ["klant", "maand"], ["aantal", "bedrag"],
+                   f"SELECT {row}.klant, substr({row}.factuurdatum, 1, 7), {sign}({row}.betaalstatus = 0), {sign}{row}.totaalbedrag_incl * ({row}.betaalstatus = 0) WHERE true")
+
+def _regel_btw(where: str, sign: str) -> str:
+    # Line items without a Factuur or Product have a snapshot, but are not counted
+    return _upsert("BtwPerTarief", ["bedrijf", "maand", "btw_percentage"], ["aantal", "grondslag", "btw"],
+                   f"SELECT bedrijf, maand, btw_percentage, {sign}1, {sign}grondslag, {sign}btw FROM RegelBtw WHERE {where} AND bedrijf IS NOT NULL AND btw_percentage IS NOT NULL")
+
+def _btw_euro(grondslag: str, btw_percentage: str) -> str:
+    # The BTW of a line item while amounts were stored in euros, before migration 5
+    return f"{grondslag} * {btw_percentage} / 100.0"
+
+def _snapshot_regel(regel: str, factuur: str, product: str, hoeveelheid: str, btw: Callable[[str, str], str] = btw_regel_sql) -> str:
+    # The price and percentage of the product at the time the line item is written
+    grondslag = f"{hoeveelheid} * Product.eenheidsprijs"
+    return f"""
+            INSERT OR REPLACE INTO RegelBtw (regel, factuur, bedrijf, maand, btw_percentage, grondslag, btw)
+            SELECT {regel}, {factuur}, Factuur.bedrijf, substr(Factuur.factuurdatum, 1, 7), Product.btw_percentage,
+            {grondslag}, {btw(grondslag, "Product.btw_percentage")}
+            FROM (SELECT 1) LEFT JOIN Factuur ON Factuur.factuurnummer = {factuur} LEFT JOIN Product ON Product.id = {product};"""
+
+def _create_triggers(conn: sqlite3.Connection, btw: Callable[[str, str], str]) -> None:
+    # The triggers that keep the aggregate tables up to date, with btw computing the BTW of a line item
+    snapshot = _snapshot_regel("NEW.rowid", "NEW.factuur", "NEW.product", "NEW.hoeveelheid", btw)
+    triggers = {
+        "rapportage_factuur_insert": ("AFTER INSERT ON Factuur", _omzet("NEW", "") + _openstaand("NEW", "")),
+        "rapportage_factuur_delete": ("AFTER DELETE ON Factuur", _omzet("OLD", "-") + _openstaand("OLD", "-")),
+        "rapportage_factuur_update": (
+            "AFTER UPDATE OF klant, bedrijf, factuurdatum, totaalbedrag_excl, btw_bedrag, totaalbedrag_incl, betaalstatus ON Factuur",
+            _omzet("OLD", "-") + _openstaand("OLD", "-") + _omzet("NEW", "") + _openstaand("NEW", "")
+        ),
+        "rapportage_factuur_verplaats": (
+            "AFTER UPDATE OF bedrijf, factuurdatum ON Factuur WHEN OLD.bedrijf IS NOT NEW.bedrijf OR OLD.factuurdatum IS NOT NEW.factuurdatum",
+            _regel_btw("factuur = NEW.factuurnummer", "-") + """
+            UPDATE RegelBtw SET bedrijf = NEW.bedrijf, maand = substr(NEW.factuurdatum, 1, 7) WHERE factuur = NEW.factuurnummer AND bedrijf IS NOT NULL;"""
+            + _regel_btw("factuur = NEW.factuurnummer", "")
+        ),
+        "rapportage_regel_insert": ("AFTER INSERT ON BevatProduct", snapshot + _regel_btw("regel = NEW.rowid", "")),
+        "rapportage_regel_delete": (
+            "AFTER DELETE ON BevatProduct",
+            _regel_btw("regel = OLD.rowid", "-") + """
+            DELETE FROM RegelBtw WHERE regel = OLD.rowid;"""
+        ),
+        "rapportage_regel_update": (
+            "AFTER UPDATE OF factuur, product, hoeveelheid ON BevatProduct",
+            _regel_btw("regel = OLD.rowid", "-") + snapshot + _regel_btw("regel = NEW.rowid", "")
+        )
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body}\n            END;")
+
+def _create_reporting(conn: sqlite3.Connection) -> None:
+    '''
+    Aggregate tables for reporting, kept up to date by triggers in the same transaction as every write to Factuur and BevatProduct.
+    RegelBtw keeps what every line item added to BtwPerTarief, so it is subtracted exactly even when the product changed since.'''
+    cursor = conn.cursor()
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS OmzetPerMaand (
+                    bedrijf VARCHAR(255) NOT NULL,
+                    maand VARCHAR(7) NOT NULL,
+                    aantal INT NOT NULL,
+                    totaal_excl DECIMAL(10,2) NOT NULL,
+                    btw DECIMAL(10,2) NOT NULL,
+                    totaal_incl DECIMAL(10,2) NOT NULL,
+                    PRIMARY KEY (bedrijf, maand)
+                    );
+                    """)
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS OpenstaandPerKlant (
+                    klant VARCHAR(255) NOT NULL,
+                    maand VARCHAR(7) NOT NULL,
+                    aantal INT NOT NULL,
+                    bedrag DECIMAL(10,2) NOT NULL,
+                    PRIMARY KEY (klant, maand)
+                    );
+                    """)
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS BtwPerTarief (
+                    bedrijf VARCHAR(255) NOT NULL,
+                    maand VARCHAR(7) NOT NULL,
+                    btw_percentage DECIMAL(10,2) NOT NULL,
+                    aantal INT NOT NULL,
+                    grondslag DECIMAL(10,2) NOT NULL,
+                    btw DECIMAL(10,2) NOT NULL,
+                    PRIMARY KEY (bedrijf, maand, btw_percentage)
+                    );
+                    """)
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS RegelBtw (
+                    regel INTEGER NOT NULL,
+                    factuur VARCHAR(255) NOT NULL,
+                    bedrijf VARCHAR(255),
+                    maand VARCHAR(7),
+                    btw_percentage DECIMAL(10,2),
+                    grondslag DECIMAL(10,2),
+                    btw DECIMAL(10,2),
+                    PRIMARY KEY (regel)
+                    );
+                    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_regelbtw_factuur ON RegelBtw (factuur);")
+    _create_triggers(conn, _btw_euro)
+    # In the same transaction as the triggers, so no factuur is counted twice or missed
+    fill_factuur_totalen(conn)
+
+def fill_factuur_totalen(conn: sqlite3.Connection) -> None:
+    '''
+    Fills OmzetPerMaand and OpenstaandPerKlant from the Factuur table, which must have no rows counted in them yet.'''
+    cursor = conn.cursor()
+    cursor.execute(_upsert("OmzetPerMaand", ["bedrijf", "maand"], ["aantal", "totaal_excl", "btw", "totaal_incl"], """
+                    SELECT bedrijf, substr(factuurdatum, 1, 7), COUNT(*), SUM(totaalbedrag_excl), SUM(btw_bedrag), SUM(totaalbedrag_incl)
+                    FROM Factuur WHERE true GROUP BY bedrijf, substr(factuurdatum, 1, 7)"""))
+    cursor.execute(_upsert("OpenstaandPerKlant", ["klant", "maand"], ["aantal", "bedrag"], """
+                    SELECT klant, substr(factuurdatum, 1, 7), SUM(betaalstatus = 0), SUM(totaalbedrag_incl * (betaalstatus = 0))
+                    FROM Factuur WHERE true GROUP BY klant, substr(factuurdatum, 1, 7)"""))
+
+def backfill_regel_btw(conn: sqlite3.Connection, batch_size: int, btw: Callable[[str, str], str] = btw_regel_sql) -> int:
+    '''
+    Snapshots up to batch_size line items that have no RegelBtw row yet and adds them to BtwPerTarief.
+    Returns the number of line items done.'''
+    cursor = conn.cursor()
+    cursor.execute("""
+                    SELECT BevatProduct.rowid, factuur, product, hoeveelheid FROM BevatProduct
+                    WHERE NOT EXISTS (SELECT 1 FROM RegelBtw WHERE regel = BevatProduct.rowid)
+                    LIMIT ?;""", (batch_size,))
+    regels = cursor.fetchall()
+    cursor.executemany(_snapshot_regel(":regel", ":factuur", ":product", ":hoeveelheid", btw), [
+        {"regel": regel, "factuur": factuur, "product": product, "hoeveelheid": hoeveelheid}
+        for regel, factuur, product, hoeveelheid in regels
+    ])
+    if regels:
+        cursor.execute(_regel_btw(f"regel IN ({', '.join(['?'] * len(regels))})", ""), [regel[0] for regel in regels])
+    return len(regels)
+
+def _backfill_regel_btw_euro(conn: sqlite3.Connection, batch_size: int) -> int:
+    return backfill_regel_btw(conn, batch_size, _btw_euro)
+
+RAPPORTAGE_TRIGGERS = [
+    "rapportage_factuur_insert", "rapportage_factuur_delete", "rapportage_factuur_update", "rapportage_factuur_verplaats",
+    "rapportage_regel_insert", "rapportage_regel_delete", "rapportage_regel_update"
+]
+
+def _centen(column: str) -> str:
+    return f"CAST(ROUND({column} * 100) AS INTEGER)"
+
+# The columns that hold an amount of money, converted from euros to eurocents by migration 5
+CENTEN_KOLOMMEN = {
+    "Product": {"eenheidsprijs": _centen("eenheidsprijs")},
+    "Factuur": {column: _centen(column) for column in ["totaalbedrag_excl", "btw_bedrag", "totaalbedrag_incl"]},
+    # The BTW of a line item is rounded per line from then on, also for the line items already stored
+    "RegelBtw": {"grondslag": _centen("grondslag"), "btw": btw_regel_sql(_centen("grondslag"), "btw_percentage")}
+}
+
+# While the amounts are converted, every write to a row that is not converted yet comes from code that writes eurocents,
+# so these triggers take the row off the list. A write that leaves the amount as it is, e.g. an update of every column after a rename,
+# keeps the row on the list. A new or changed line item loses its RegelBtw snapshot, which _finish_centen takes again
+CENTEN_TRIGGERS = {
+    "centen_product_update": ("AFTER UPDATE OF eenheidsprijs ON Product WHEN NEW.eenheidsprijs IS NOT OLD.eenheidsprijs", "DELETE FROM CentenTeConverteren WHERE tabel = 'Product' AND rij = NEW.rowid;"),
+    "centen_product_delete": ("AFTER DELETE ON Product", "DELETE FROM CentenTeConverteren WHERE tabel = 'Product' AND rij = OLD.rowid;"),
+    "centen_factuur_update": (
+        "AFTER UPDATE OF totaalbedrag_excl, btw_bedrag, totaalbedrag_incl ON Factuur WHEN "
+        "NEW.totaalbedrag_excl IS NOT OLD.totaalbedrag_excl OR NEW.btw_bedrag IS NOT OLD.btw_bedrag OR NEW.totaalbedrag_incl IS NOT OLD.totaalbedrag_incl",
+        "DELETE FROM CentenTeConverteren WHERE tabel = 'Factuur' AND rij = NEW.rowid;"
+    ),
+    "centen_factuur_delete": ("AFTER DELETE ON Factuur", "DELETE FROM CentenTeConverteren WHERE tabel = 'Factuur' AND rij = OLD.rowid;"),
+    "centen_regel_insert": ("AFTER INSERT ON BevatProduct", "DELETE FROM RegelBtw WHERE regel = NEW.rowid; DELETE FROM CentenTeConverteren WHERE tabel = 'RegelBtw' AND rij = NEW.rowid;"),
+    "centen_regel_update": (
+        "AFTER UPDATE OF factuur, product, hoeveelheid ON BevatProduct",
+        "DELETE FROM RegelBtw WHERE regel IN (OLD.rowid, NEW.rowid); DELETE FROM CentenTeConverteren WHERE tabel = 'RegelBtw' AND rij IN (OLD.rowid, NEW.rowid);"
+    ),
+    "centen_regel_delete": ("AFTER DELETE ON BevatProduct", "DELETE FROM RegelBtw WHERE regel = OLD.rowid; DELETE FROM CentenTeConverteren WHERE tabel = 'RegelBtw' AND rij = OLD.rowid;")
+}
+
+def _prepare_centen(conn: sqlite3.Connection) -> None:
+    '''
+    Lists the rows to convert in CentenTeConverteren, so rows written in eurocents while the conversion runs are never converted,
+    and a conversion that is interrupted never converts a row twice.
+    The reporting triggers are dropped while the amounts are converted, and recreated for eurocents by _finish_centen.'''
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'CentenTeConverteren';")
+    if cursor.fetchone() is None:
+        cursor.execute("""
+                        CREATE TABLE CentenTeConverteren (
+                        tabel VARCHAR(255) NOT NULL,
+                        rij INTEGER NOT NULL,
+                        PRIMARY KEY (tabel, rij)
+                        );
+                        """)
+        for table_name in CENTEN_KOLOMMEN:
+            cursor.execute(f"INSERT INTO CentenTeConverteren (tabel, rij) SELECT ?, rowid FROM {table_name};", (table_name,))
+    for name in RAPPORTAGE_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name};")
+    for name, (event, body) in CENTEN_TRIGGERS.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END;")
+
+def _backfill_centen(conn: sqlite3.Connection, batch_size: int) -> int:
+    # Converts the next batch_size listed rows of the first table that is not done yet, and takes them off the list in the same transaction
+    cursor = conn.cursor()
+    for table_name, columns in CENTEN_KOLOMMEN.items():
+        cursor.execute("SELECT rij FROM CentenTeConverteren WHERE tabel = ? ORDER BY rij LIMIT ?;", (table_name, batch_size))
+        rijen = [row[0] for row in cursor.fetchall()]
+        if not rijen:
+            continue
+        placeholders = ", ".join(["?"] * len(rijen))
+        cursor.execute(f"UPDATE {table_name} SET {', '.join(f'{column} = {value}' for column, value in columns.items())} WHERE rowid IN ({placeholders});", rijen)
+        cursor.execute(f"DELETE FROM CentenTeConverteren WHERE tabel = ? AND rij IN ({placeholders});", [table_name, *rijen])
+        return len(rijen)
+    return 0
+
+def _finish_centen(conn: sqlite3.Connection, batch_size: int = 1000) -> None:
+    '''
+    Brings RegelBtw up to date with the line items written while the triggers were dropped, and sums the aggregates again
+    from the converted rows, which is exact where converting the sums would not be.'''
+    cursor = conn.cursor()
+    for name in CENTEN_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name};")
+    cursor.execute("DROP TABLE IF EXISTS CentenTeConverteren;")
+    cursor.execute("DELETE FROM RegelBtw WHERE regel NOT IN (SELECT rowid FROM BevatProduct);")
+    # A factuur can have moved to another bedrijf or month
+    cursor.execute("""
+                    UPDATE RegelBtw SET (bedrijf, maand) = (
+                    SELECT Factuur.bedrijf, substr(Factuur.factuurdatum, 1, 7) FROM Factuur WHERE Factuur.factuurnummer = RegelBtw.factuur
+                    ) WHERE bedrijf IS NOT NULL;
+                    """)
+    while backfill_regel_btw(conn, batch_size):
+        pass
+    for table_name in ["OmzetPerMaand", "OpenstaandPerKlant", "BtwPerTarief"]:
+        cursor.execute(f"DELETE FROM {table_name};")
+    fill_factuur_totalen(conn)
+    cursor.execute(_regel_btw("true", ""))
+    _create_triggers(conn, btw_regel_sql)
+
+# Page through the facturen of one klant or bedrijf in the order of the factuurdatum, see FactuurRepository.page
+# They start with the columns of idx_factuur_klant and idx_factuur_bedrijf, which are dropped
+PAGINA_INDEXES = {
+    "idx_factuur_klant_factuurdatum": "Factuur (klant, factuurdatum, factuurnummer)",
+    "idx_factuur_bedrijf_factuurdatum": "Factuur (bedrijf, factuurdatum, factuurnummer)"
+}
+
+def _create_pagina_indexes(conn: sqlite3.Connection) -> None:
+    for name, definition in PAGINA_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition};")
+    conn.execute("DROP INDEX IF EXISTS idx_factuur_klant;")
+    conn.execute("DROP INDEX IF EXISTS idx_factuur_bedrijf;")
+
+def _create_verlopen_index(conn: sqlite3.Connection) -> None:
+    # Serves page(verlopen) and page(betaalstatus) in the order of the factuurdatum, uiterste_betaaldatum is checked from the index.
+    # It replaces idx_factuur_betaalstatus, so set_betaalstatus keeps a single index over betaalstatus up to date
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_factuur_betaalstatus_factuurdatum ON Factuur (betaalstatus, factuurdatum, factuurnummer, uiterste_betaaldatum);")
+    conn.execute("DROP INDEX IF EXISTS idx_factuur_betaalstatus;")
+
+# The full-text indexes: per FTS5 table the table it indexes, the column its rowid is taken from and the indexed columns
+ZOEK_INDEXES = {
+    "ZoekKlant": ("Klant", "id", ["handelsnaam", "ten_aanzien_van", "plaats", "postcode"]),
+    "ZoekProduct": ("Product", "id", ["naam", "omschrijving", "productcategorie"]),
+    "ZoekFactuur": ("Factuur", "rowid", ["factuurnummer"])
+}
+
+def _create_zoekindexes(conn: sqlite3.Connection) -> None:
+    '''
+    FTS5 tables over the content of Klant, Product and Factuur, which store only the index, not a copy of the text.
+    Triggers update them in the same transaction as every write to the indexed tables.
+    Letters are matched without case and diacritics, and prefixes of up to 3 characters have their own index for type-ahead search.'''
+    cursor = conn.cursor()
+    for name, (table_name, rowid, columns) in ZOEK_INDEXES.items():
+        cursor.execute(f"""
+                        CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(
+                        {', '.join(columns)}, content='{table_name}', content_rowid='{rowid}',
+                        tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+                        );
+                        """)
+        # An external content index is updated by deleting the old values and inserting the new ones
+        insert = f"INSERT INTO {name} (rowid, {', '.join(columns)}) VALUES (NEW.{rowid}, {', '.join(f'NEW.{column}' for column in columns)});"
+        delete = f"INSERT INTO {name} ({name}, rowid, {', '.join(columns)}) VALUES ('delete', OLD.{rowid}, {', '.join(f'OLD.{column}' for column in columns)});"
+        # The implicit rowid cannot be named in UPDATE OF, and is never updated by the repositories
+        updated = [column for column in [rowid, *columns] if column != "rowid"]
+        triggers = {
+            f"zoek_{table_name.lower()}_insert": (f"AFTER INSERT ON {table_name}", insert),
+            f"zoek_{table_name.lower()}_delete": (f"AFTER DELETE ON {table_name}", delete),
+            f"zoek_{table_name.lower()}_update": (f"AFTER UPDATE OF {', '.join(updated)} ON {table_name}", delete + " " + insert)
+        }
+        for trigger, (event, body) in triggers.items():
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {trigger} {event} BEGIN {body} END;")
+        cursor.execute(f"INSERT INTO {name} ({name}) VALUES ('rebuild');")
+
+def _create_factuurreeksen(conn: sqlite3.Connection) -> None:
+    # Factuurreeks holds the next new number per bedrijf and year, VrijFactuurnummer the reserved numbers that were given back unused
+    cursor = conn.cursor()
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS Factuurreeks (
+                    bedrijf INTEGER NOT NULL,
+                    jaar INTEGER NOT NULL,
+                    volgende INTEGER NOT NULL,
+                    PRIMARY KEY (bedrijf, jaar)
+                    );
+                    """)
+    cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS VrijFactuurnummer (
+                    bedrijf INTEGER NOT NULL,
+                    jaar INTEGER NOT NULL,
+                    nummer INTEGER NOT NULL,
+                    PRIMARY KEY (bedrijf, jaar, nummer)
+                    );
+                    """)
+
+# Append new migrations at the end, never change a migration that has been released
+MIGRATIONS = [
+    Migration(1, "Create the Product, Klant, Bedrijf, Factuur and BevatProduct tables", _create_tables),
+    Migration(2, "Add Factuur.pdf_ref for pdfs kept in a PdfStore", _add_pdf_ref),
+    Migration(3, "Add the indexes for factuur lookups", _create_indexes),
+    Migration(4, "Add the reporting aggregates OmzetPerMaand, OpenstaandPerKlant and BtwPerTarief", _create_reporting, _backfill_regel_btw_euro),
+    Migration(5, "Store amounts of money in eurocents instead of euros", _prepare_centen, _backfill_centen, _finish_centen),
+    Migration(6, "Add the indexes for paging through the facturen of a klant or bedrijf", _create_pagina_indexes),
+    Migration(7, "Add the full-text search indexes over Klant, Product and Factuur", _create_zoekindexes),
+    Migration(8, "Add the factuurnummer sequences per bedrijf and year", _create_factuurreeksen),
+    Migration(9, "Replace the betaalstatus index by one for paging through the unpaid facturen", _create_verlopen_index)
+]
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA user_version;")
+    return cursor.fetchone()[0]
+
+def _begin(conn: sqlite3.Connection) -> None:
+    # Schema changes do not start a transaction by themselves, so start one explicitly.
+    # IMMEDIATE takes the write lock before the schema version is read again, so two connections never apply the same step
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE;")
+
+def _step(conn: sqlite3.Connection, migration: Migration, work: Callable[[], int]) -> Optional[int]:
+    # Runs work in its own write transaction and returns its result, or None when another connection recorded the migration meanwhile
+    _begin(conn)
+    with conn:
+        if schema_version(conn) >= migration.version:
+            return None
+        return work()
+
+def _record(conn: sqlite3.Connection, migration: Migration) -> int:
+    if migration.finish is not None:
+        migration.finish(conn)
+    conn.execute(f"PRAGMA user_version = {migration.version};")
+    return migration.version
+
+def migrate(conn: sqlite3.Connection, migrations: list[Migration] = MIGRATIONS, batch_size: int = 1000) -> int:
+    '''
+    Brings the database up to the last of migrations and returns the resulting schema version.
+    The schema version is kept in PRAGMA user_version, so databases created before versioning start at 0.
+    The schema part of a migration runs in a single transaction. A backfill commits after every batch of batch_size rows,
+    so readers and writers are only blocked for one batch at a time.
+    The version is only recorded once the backfill is done, so an interrupted upgrade resumes from where it stopped.
+    Every transaction takes the write lock first and checks the version again, so connections that migrate at the same time
+    skip the steps another connection already recorded.'''
+    version = schema_version(conn)
+    latest = migrations[-1].version if migrations else 0
+    if version > latest:
+        raise ValueError(f"Database schema version {version} is newer than the latest known migration {latest}.")
+    for migration in migrations:
+        if migration.version <= version:
+            continue
+        def schema() -> int:
+            migration.schema(conn)
+            return _record(conn, migration) if migration.backfill is None else 0
+        if _step(conn, migration, schema) is not None and migration.backfill is not None:
+            while _step(conn, migration, lambda: migration.backfill(conn, batch_size)):
+                pass
+            _step(conn, migration, lambda: _record(conn, migration))
+    return schema_version(conn)
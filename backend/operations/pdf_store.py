@@ -0,0 +1,133 @@
+import sqlite3
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Optional, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .database_operations import ConnectionPool
+
+class PdfStore(ABC):
+    '''
+    Content-addressed storage for factuur pdfs.
+    A pdf is stored under the sha256 of its bytes, so identical pdfs are stored once.'''
+    @staticmethod
+    def key(pdf: bytes) -> str:
+        return hashlib.sha256(pdf).hexdigest()
+
+    @abstractmethod
+    def put(self, pdf: bytes, conn: Optional[sqlite3.Connection] = None) -> str:
+        # conn is the connection of the transaction that writes the factuur, for stores that keep the pdfs in the database
+        raise NotImplementedError
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        with self.open(key) as f:
+            return f.read()
+
+class DirectoryPdfStore(PdfStore):
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.pdf")
+
+    def put(self, pdf: bytes, conn: Optional[sqlite3.Connection] = None) -> str:
+        key = self.key(pdf)
+        file = self._file(key)
+        if not os.path.exists(file):
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            # Write to a temporary file first, so a reader never sees a partial pdf
+            fd, temporary = tempfile.mkstemp(dir=os.path.dirname(file))
+            with os.fdopen(fd, "wb") as f:
+                f.write(pdf)
+            os.replace(temporary, file)
+        return key
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            return open(self._file(key), "rb")
+        except FileNotFoundError:
+            raise ValueError(f"Pdf with key {key} does not exist.")
+
+class SqlitePdfStore(PdfStore):
+    '''
+    Stores the pdfs in a separate PdfBestand table.
+    Give it the ConnectionPool of the repositories, so every thread reads the pdfs on its own connection.
+    Nothing is committed here, and FactuurRepository passes its own connection to put,
+    so a pdf is written in the same transaction as the factuur that references it.'''
+    def __init__(self, conn: Union[sqlite3.Connection, "ConnectionPool"]):
+        self.pool = None if isinstance(conn, sqlite3.Connection) else conn
+        self._conn = conn if self.pool is None else None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return self._conn if self.pool is None else self.pool.connection()
+
+    def create(self) -> None:
+        cursor = self.conn.cursor()
+        cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS PdfBestand (
+                        hash VARCHAR(64) NOT NULL,
+                        pdf BLOB NOT NULL,
+                        PRIMARY KEY (hash)
+                        );
+                        """)
+
+    def put(self, pdf: bytes, conn: Optional[sqlite3.Connection] = None) -> str:
+        key = self.key(pdf)
+        cursor = (conn if conn is not None else self.conn).cursor()
+        cursor.execute("""INSERT OR IGNORE INTO PdfBestand (hash, pdf) VALUES (?, ?);""", (key, pdf))
+        return key
+
+    def open(self, key: str) -> BinaryIO:
+        cursor = self.conn.cursor()
+        cursor.execute("""SELECT rowid FROM PdfBestand WHERE hash = ?;""", (key,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Pdf with key {key} does not exist.")
+        return self.conn.blobopen("PdfBestand", "pdf", row[0], readonly=True)
+
+class StoredPdf:
+    '''
+    Handle to a pdf in a PdfStore that is only read when it is accessed.'''
+    def __init__(self, store: PdfStore, key: str):
+        self.store = store
+        self.key = key
+
+    def open(self) -> BinaryIO:
+        return self.store.open(self.key)
+
+    def read(self) -> bytes:
+        return self.store.get(self.key)
+
+    def copy_to(self, file: BinaryIO, chunk_size: int = 64 * 1024) -> None:
+        with self.open() as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                file.write(chunk)
+
+    def __bytes__(self) -> bytes:
+        return self.read()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, StoredPdf):
+            return self.key == other.key
+        if not isinstance(other, bytes):
+            return NotImplemented
+        return self.key == PdfStore.key(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"StoredPdf({self.key})"
+
+# A StoredPdf written to a repository without a PdfStore is stored inline
+sqlite3.register_adapter(StoredPdf, StoredPdf.read)
@@ -0,0 +1,78 @@
+from typing import NamedTuple, Optional
+from .database_operations import ConnectionPool, PoolRepository, StorageProfile
+from .migrations import fill_factuur_totalen, backfill_regel_btw
+
+class Omzet(NamedTuple):
+    maand: str
+    aantal: int
+    totaal_excl: int
+    btw: int
+    totaal_incl: int
+
+class BtwTarief(NamedTuple):
+    btw_percentage: float
+    grondslag: int
+    btw: int
+
+class Openstaand(NamedTuple):
+    klant: int
+    maand: str
+    aantal: int
+    bedrag: int
+
+class ReportRepository(PoolRepository):
+    '''
+    Revenue and BTW reports read from the aggregate tables of the reporting migration, so a report costs one row per period instead of one per factuur.
+    The aggregates are kept up to date by triggers, in the same transaction as every write to Factuur and BevatProduct.
+    Months are given as 'YYYY-MM' and ranges include both ends. Amounts are in eurocents. Reports can run on a read-only StorageProfile.'''
+    def __init__(self, db_path: Optional[str] = None, pool: Optional[ConnectionPool] = None, profile: Optional[StorageProfile] = None):
+        self._borrow(db_path, None, pool, profile)
+
+    def omzet(self, bedrijf: int, vanaf: Optional[str] = None, tot_en_met: Optional[str] = None) -> list[Omzet]:
+        '''
+        Returns the number of facturen and their totals per month of the factuurdatum.'''
+        cursor = self.conn.cursor()
+        cursor.execute("""
+                        SELECT maand, aantal, totaal_excl, btw, totaal_incl FROM OmzetPerMaand
+                        WHERE bedrijf = ? AND aantal > 0 AND maand >= ? AND maand <= ? ORDER BY maand;
+                        """, (bedrijf, vanaf or "", tot_en_met or "9999-12"))
+        return [Omzet(*row) for row in cursor.fetchall()]
+
+    def btw_per_tarief(self, bedrijf: int, vanaf: str, tot_en_met: str) -> list[BtwTarief]:
+        '''
+        Returns the taxable amount and the BTW per btw_percentage over the months.'''
+        cursor = self.conn.cursor()
+        cursor.execute("""
+                        SELECT CAST(btw_percentage AS REAL), SUM(grondslag), SUM(btw) FROM BtwPerTarief
+                        WHERE bedrijf = ? AND maand >= ? AND maand <= ? AND aantal > 0
+                        GROUP BY btw_percentage ORDER BY btw_percentage;
+                        """, (bedrijf, vanaf, tot_en_met))
+        return [BtwTarief(*row) for row in cursor.fetchall()]
+
+    def btw_aangifte(self, bedrijf: int, jaar: int, kwartaal: int) -> list[BtwTarief]:
+        if kwartaal not in (1, 2, 3, 4):
+            raise ValueError(f"Kwartaal {kwartaal} does not exist.")
+        return self.btw_per_tarief(bedrijf, f"{jaar}-{3 * kwartaal - 2:02d}", f"{jaar}-{3 * kwartaal:02d}")
+
+    def openstaand(self, klant: Optional[int] = None, tot_en_met: Optional[str] = None) -> list[Openstaand]:
+        '''
+        Returns the number and the total incl. BTW of the unpaid facturen per klant and month.'''
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+                        SELECT klant, maand, aantal, bedrag FROM OpenstaandPerKlant
+                        WHERE aantal > 0 AND maand <= ? {"AND klant = ?" if klant is not None else ""}
+                        ORDER BY CAST(klant AS INTEGER), maand;
+                        """, (tot_en_met or "9999-12", *([klant] if klant is not None else [])))
+        return [Openstaand(int(row[0]), *row[1:]) for row in cursor.fetchall()]
+
+    def rebuild(self, batch_size: int = 1000) -> None:
+        '''
+        Recomputes all aggregates from the facturen in one transaction, e.g. after the tables were written to with the triggers disabled.
+        The BTW of the line items is recomputed with the current prices of the products.'''
+        with self.conn:
+            cursor = self.conn.cursor()
+            for table_name in ["OmzetPerMaand", "OpenstaandPerKlant", "BtwPerTarief", "RegelBtw"]:
+                cursor.execute(f"DELETE FROM {table_name};")
+            fill_factuur_totalen(self.conn)
+            while backfill_regel_btw(self.conn, batch_size):
+                pass
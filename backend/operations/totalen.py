@@ -0,0 +1,72 @@
+import numpy as np
+from typing import NamedTuple, Sequence
+from .database_operations import Factuur, FactuurRepository
+
+class Totalen(NamedTuple):
+    '''
+    Totals per factuur in eurocents, in the order in which the facturen first occur in the line items.'''
+    factuurnummers: list[str]
+    totaalbedrag_excl: list[int]
+    btw_bedrag: list[int]
+    totaalbedrag_incl: list[int]
+
+def bereken_totalen(factuurnummers: Sequence[str], eenheidsprijzen: Sequence[int], hoeveelheden: Sequence[int], btw_percentages: Sequence[float]) -> Totalen:
+    '''
+    Computes the totals of many facturen at once from columnar line items, one entry per line item in each sequence.
+    The eenheidsprijzen are in eurocents, so the sums are exact and the result is identical to the totals Factuur computes per object:
+    the BTW is rounded per line item like btw_regel does.
+    Facturen without line items do not occur in the line items, so they are not in the result.'''
+    groepen, eerste, regel_groep = np.unique(np.asarray(factuurnummers, dtype=object), return_index=True, return_inverse=True)
+    regel_excl = np.asarray(eenheidsprijzen, dtype=np.int64) * np.asarray(hoeveelheden, dtype=np.int64)
+    basispunten = np.round(np.asarray(btw_percentages, dtype=np.float64) * 100).astype(np.int64)
+    regel_btw = np.sign(regel_excl) * ((np.abs(regel_excl) * basispunten + 5000) // 10000)
+    excl = np.zeros(len(groepen), dtype=np.int64)
+    btw = np.zeros(len(groepen), dtype=np.int64)
+    np.add.at(excl, regel_groep, regel_excl)
+    np.add.at(btw, regel_groep, regel_btw)
+    incl = excl + btw
+    volgorde = np.argsort(eerste, kind="stable")
+    return Totalen(groepen[volgorde].tolist(), excl[volgorde].tolist(), btw[volgorde].tolist(), incl[volgorde].tolist())
+
+def uiterste_betaaldata(factuurdata: Sequence[str], dagen: int = 30) -> list[str]:
+    '''
+    Adds dagen to every 'YYYY-MM-DD' factuurdatum at once, as Factuur does for a missing uiterste_betaaldatum.'''
+    return (np.asarray(factuurdata, dtype="datetime64[D]") + np.timedelta64(dagen, "D")).astype(str).tolist()
+
+def herbereken(facturen: list[Factuur]) -> list[Factuur]:
+    '''
+    Returns copies of the facturen with their totals computed again from the current products of their line items.'''
+    regels = [(factuur.factuurnummer, bevatproduct) for factuur in facturen for bevatproduct in factuur.producten]
+    totalen = bereken_totalen(
+        [factuurnummer for factuurnummer, _ in regels],
+        [bevatproduct.product.eenheidsprijs for _, bevatproduct in regels],
+        [bevatproduct.hoeveelheid for _, bevatproduct in regels],
+        [bevatproduct.product.btw_percentage for _, bevatproduct in regels]
+    )
+    per_factuur = {factuurnummer: waarden for factuurnummer, *waarden in zip(*totalen)}
+    return [factuur.model_copy(update=dict(zip(
+        ["totaalbedrag_excl", "btw_bedrag", "totaalbedrag_incl"],
+        per_factuur.get(factuur.factuurnummer, (0, 0, 0))
+    ))) for factuur in facturen]
+
+def herbereken_opgeslagen(repo: FactuurRepository) -> int:
+    '''
+    Computes the totals of all stored facturen again from the current products, reading only the columns that are needed,
+    and writes the totals that changed in one transaction. Returns the number of facturen that changed.
+    Facturen without line items are left as they are.'''
+    cursor = repo.conn.cursor()
+    cursor.execute("""
+                    SELECT BevatProduct.factuur, Product.eenheidsprijs, BevatProduct.hoeveelheid, Product.btw_percentage
+                    FROM BevatProduct JOIN Product ON Product.id = BevatProduct.product
+                    ORDER BY BevatProduct.rowid;
+                    """)
+    regels = cursor.fetchall()
+    if not regels:
+        return 0
+    totalen = bereken_totalen(*zip(*regels))
+    with repo.conn:
+        cursor.executemany("""
+                        UPDATE Factuur SET totaalbedrag_excl = ?, btw_bedrag = ?, totaalbedrag_incl = ?
+                        WHERE factuurnummer = ? AND (totaalbedrag_excl != ? OR btw_bedrag != ? OR totaalbedrag_incl != ?);
+                        """, [(excl, btw, incl, factuurnummer, excl, btw, incl) for factuurnummer, excl, btw, incl in zip(*totalen)])
+        return cursor.rowcount
@@ -0,0 +1,67 @@
+import re
+from typing import Optional
+from .database_operations import Product, Klant, ConnectionPool, PoolRepository, StorageProfile, FactuurOverzicht, factuur_overzicht, hydrator
+from .migrations import ZOEK_INDEXES
+
+# The weight of every indexed column in the ranking, in the order of ZOEK_INDEXES; a match in a name counts most
+GEWICHTEN = {
+    "ZoekKlant": [10.0, 5.0, 2.0, 2.0],
+    "ZoekProduct": [10.0, 1.0, 2.0],
+    "ZoekFactuur": [1.0]
+}
+
+def zoekvraag(tekst: str) -> Optional[str]:
+    '''
+    Turns what a user typed into an FTS5 query in which every word is a prefix: "jan ams" finds "Jansen, Amsterdam".
+    Returns None when tekst has no words.'''
+    # Words only consist of letters and digits, so they never contain FTS5 syntax such as quotes or operators
+    woorden = re.findall(r"\w+", tekst)
+    if not woorden:
+        return None
+    return " ".join(f'"{woord}"*' for woord in woorden)
+
+class SearchRepository(PoolRepository):
+    '''
+    Ranked type-ahead search over klanten, producten and factuurnummers, read from the FTS5 indexes of the search migration.
+    The indexes are kept up to date by triggers, in the same transaction as every write of the repositories.
+    The best matches come first; searches can run on a read-only StorageProfile.'''
+    def __init__(self, db_path: Optional[str] = None, pool: Optional[ConnectionPool] = None, profile: Optional[StorageProfile] = None):
+        self._borrow(db_path, None, pool, profile)
+
+    def _search(self, index: str, columns: list[str], tekst: str, limit: int) -> list[tuple]:
+        table_name, rowid, _ = ZOEK_INDEXES[index]
+        vraag = zoekvraag(tekst)
+        if vraag is None:
+            return []
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+                        SELECT {', '.join(f'{table_name}.{column}' for column in columns)}
+                        FROM {index} JOIN {table_name} ON {table_name}.{rowid} = {index}.rowid
+                        WHERE {index} MATCH ? ORDER BY bm25({index}, {', '.join(map(str, GEWICHTEN[index]))}) LIMIT ?;
+                        """, (vraag, limit))
+        return cursor.fetchall()
+
+    def klanten(self, tekst: str, limit: int = 10) -> list[Klant]:
+        '''
+        Returns the klanten whose handelsnaam, ten_aanzien_van, plaats or postcode contain words starting with every word of tekst.'''
+        klant = hydrator(Klant)
+        return [klant.build(klant.values(row)) for row in self._search("ZoekKlant", list(klant.columns), tekst, limit)]
+
+    def producten(self, tekst: str, limit: int = 10) -> list[Product]:
+        '''
+        Returns the producten whose naam, omschrijving or productcategorie contain words starting with every word of tekst.'''
+        product = hydrator(Product)
+        return [product.build(product.values(row)) for row in self._search("ZoekProduct", list(product.columns), tekst, limit)]
+
+    def facturen(self, tekst: str, limit: int = 10) -> list[FactuurOverzicht]:
+        '''
+        Returns the facturen whose factuurnummer starts with tekst, e.g. "F2024" or "f2024 00".'''
+        return [factuur_overzicht(row) for row in self._search("ZoekFactuur", list(FactuurOverzicht._fields), tekst, limit)]
+
+    def rebuild(self) -> None:
+        '''
+        Builds all indexes again from the indexed tables, e.g. after they were written to with the triggers disabled,
+        or after a VACUUM renumbered the rowids of Factuur.'''
+        with self.conn:
+            for index in ZOEK_INDEXES:
+                self.conn.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild');")
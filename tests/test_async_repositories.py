@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import pytest
+from backend.operations.database_operations import Product, Klant, Bedrijf, Factuur, BevatProduct
+from backend.operations.database_operations import SingleEntityRepository, FactuurRepository, ConnectionPool
+from backend.operations.async_repositories import AsyncSingleEntityRepository, AsyncFactuurRepository
+
+Google = Bedrijf(
+    id=1,
+    handelsnaam="Google",
+    straatnaam="Main Street",
+    huisnummer="2",
+    postcode="1234AB",
+    plaats="New York",
+    kvk_nummer="12345678",
+    btw_nummer="12345678",
+    bank="ING",
+    iban="NL12INGB1234567890",
+    bic="INGBNL2A",
+    telefoonnummer="123456789",
+    email="info@google.com"
+)
+
+John_Doe = Klant(
+    id=1,
+    handelsnaam="John Doe Inc.",
+    ten_aanzien_van="John Doe",
+    straatnaam="Pannekoeken Street",
+    huisnummer="1",
+    postcode="1234AB",
+    plaats="New York"
+)
+
+Appel = Product(
+    id=1,
+    naam="Appel",
+    omschrijving="Een apppel.",
+    productcategorie="fruit",
+    eenheidsprijs=50,
+    btw_percentage=21.0
+)
+
+def make_factuur(factuurnummer: str) -> Factuur:
+    return Factuur(
+        factuurnummer=factuurnummer,
+        klant=John_Doe,
+        bedrijf=Google,
+        factuurdatum="2024-01-01",
+        producten=[BevatProduct(product=Appel, hoeveelheid=2, datum="2024-01-01")]
+    )
+
+def test_async_repositories(tmp_path) -> None:
+    async def run() -> None:
+        with ConnectionPool(str(tmp_path / "facturen.db")) as pool:
+            async with AsyncSingleEntityRepository(SingleEntityRepository(pool=pool), max_workers=2) as repo:
+                factuur_repo = AsyncFactuurRepository(FactuurRepository(pool=pool), executor=repo.executor, max_workers=2)
+                await repo.create()
+                await asyncio.gather(repo.add(Google), repo.add(John_Doe), repo.add(Appel))
+                assert await repo.get(Appel.id, "Product") == Appel
+                await factuur_repo.add_many([make_factuur(f"F20240{index:02d}") for index in range(10)])
+                facturen = await asyncio.gather(*(factuur_repo.get(f"F20240{index:02d}") for index in range(10)))
+                assert facturen == [make_factuur(f"F20240{index:02d}") for index in range(10)]
+                assert [factuur async for factuur in factuur_repo.get_all(chunk_size=3)] == facturen
+                await factuur_repo.update(facturen[0].model_copy(update={"betaalstatus": True}))
+                assert await factuur_repo.set_betaalstatus(["F2024001", "F2024002"]) == 2
+                await factuur_repo.set_betaalstatus(["F2024001", "F2024002"], False)
+                assert [factuur.factuurnummer async for factuur in factuur_repo.get_all(betaalstatus=True)] == ["F2024000"]
+                await repo.delete(Appel)
+                assert [product async for product in repo.get_all("Product")] == []
+            assert repo.executor._shutdown
+    asyncio.run(run())
+
+def test_all_chunks_of_an_iteration_are_read_on_one_connection(tmp_path) -> None:
+    async def run() -> None:
+        with ConnectionPool(str(tmp_path / "facturen.db")) as pool:
+            async with AsyncFactuurRepository(FactuurRepository(pool=pool), max_workers=4) as factuur_repo:
+                await factuur_repo.create()
+                SingleEntityRepository(pool=pool).add_many([Google, John_Doe, Appel])
+                await factuur_repo.add_many([make_factuur(f"F20240{index:02d}") for index in range(20)])
+                items = factuur_repo.repo.iter_all(chunk_size=2)
+                threads = []
+                def recorded():
+                    for factuur in items:
+                        threads.append(threading.get_ident())
+                        yield factuur
+                iteration = factuur_repo._iterate(recorded(), 2)
+                facturen = []
+                async for factuur in iteration:
+                    facturen.append(factuur.factuurnummer)
+                    # Other calls keep the shared executor busy between the chunks
+                    await asyncio.gather(*(factuur_repo.get(f"F20240{index:02d}") for index in range(4)))
+                assert facturen == [f"F20240{index:02d}" for index in range(20)]
+                assert len(set(threads)) == 1
+                # Only the connections of this thread and the 4 workers remain, the one of the iterating thread is released
+                assert len(pool.connections) <= 5
+    asyncio.run(run())
+
+def test_concurrent_iterations_are_bounded_by_max_workers(tmp_path) -> None:
+    async def run() -> None:
+        with ConnectionPool(str(tmp_path / "facturen.db")) as pool:
+            async with AsyncFactuurRepository(FactuurRepository(pool=pool), max_workers=2) as factuur_repo:
+                await factuur_repo.create()
+                SingleEntityRepository(pool=pool).add_many([Google, John_Doe, Appel])
+                await factuur_repo.add_many([make_factuur(f"F20240{index:02d}") for index in range(6)])
+                running = []
+                peak = []
+                def counted():
+                    running.append(None)
+                    peak.append(len(running))
+                    try:
+                        yield from factuur_repo.repo.iter_all(chunk_size=1)
+                    finally:
+                        running.pop()
+                async def consume() -> int:
+                    return len([factuur async for factuur in factuur_repo._iterate(counted(), 1)])
+                assert await asyncio.gather(*(consume() for _ in range(6))) == [6] * 6
+                assert max(peak) <= 2
+    asyncio.run(run())
+
+def test_async_repository_needs_a_pool() -> None:
+    repo = SingleEntityRepository(':memory:')
+    repo.conn = SingleEntityRepository(':memory:').conn
+    with pytest.raises(ValueError):
+        AsyncSingleEntityRepository(repo)
@@ -1,6 +1,11 @@
 import pytest
-from backend.operations.database_operations import Product, Klant, Bedrijf, Factuur, BevatProduct
-from backend.operations.database_operations import SingleEntityRepository, FactuurRepository
+from backend.operations.database_operations import Product, Klant, Bedrijf, Factuur, BevatProduct, Regels
+from backend.operations.database_operations import SingleEntityRepository, FactuurRepository, EntityCache, LazyBlob, ConnectionPool, StorageProfile, WAL_PROFIEL
+from concurrent.futures import ThreadPoolExecutor
+import io
+import pickle
+import sqlite3
+import threading
 
 repo = SingleEntityRepository(':memory:')
 repo.create()
@@ -16,7 +21,7 @@ Appel = Product(
     naam="Appel",
     omschrijving="Een apppel.",
     productcategorie="fruit",
-    eenheidsprijs=0.50,
+    eenheidsprijs=50,
     btw_percentage=21.0
 )
 
@@ -25,7 +30,7 @@ Banaan = Product(
     naam="Banaan",
     omschrijving="Een banaan.",
     productcategorie="fruit",
-    eenheidsprijs=0.75,
+    eenheidsprijs=75,
     btw_percentage=21.0
 )
 
@@ -42,7 +47,7 @@ Banaan = Product(
     naam="Banaan",
     omschrijving="Een banaan.",
     productcategorie="fruit",
-    eenheidsprijs=0.75,
+    eenheidsprijs=75,
     btw_percentage=21.0
 )
 
@@ -229,7 +234,7 @@ Mango = Product(
     naam="Mango",
     omschrijving="Een mango.",
     productcategorie="fruit",
-    eenheidsprijs=1.99,
+    eenheidsprijs=199,
     btw_percentage=21.0
 )
 
@@ -260,4 +265,362 @@ def test_factuur_update_and_get() -> None:
 def test_factuur_delete() -> None:
     factuur_repo.delete(f2024002)
     with pytest.raises(ValueError):
-        factuur_repo.get(f2024002.factuurnummer)
\ No newline at end of file
+        factuur_repo.get(f2024002.factuurnummer)
+
+def test_factuur_get_all_matches_get() -> None:
+    assert factuur_repo.get_all() == [factuur_repo.get(f2024001_update.factuurnummer)]
+
+def test_factuur_get_all_with_filters() -> None:
+    assert factuur_repo.get_all(klant=John_Doe.id) == [f2024001_update]
+    assert factuur_repo.get_all(bedrijf=Google.id, betaalstatus=False) == [f2024001_update]
+    assert factuur_repo.get_all(vanaf="2021-01-01", tot_en_met="2021-12-31") == [f2024001_update]
+    assert factuur_repo.get_all(vanaf="2022-01-01") == []
+    assert factuur_repo.get_all(klant=Hans_Klaas.id) == []
+    assert factuur_repo.get_all(betaalstatus=True) == []
+
+
+def test_entity_cache_hits_and_invalidation() -> None:
+    cached_repo = SingleEntityRepository(':memory:', cache=EntityCache(maxsize=2))
+    cached_repo.create()
+    cached_repo.add(Appel)
+    assert cached_repo.get(Appel.id, 'Product') is cached_repo.get(Appel.id, 'Product')
+    assert (cached_repo.cache.hits, cached_repo.cache.misses) == (1, 1)
+    assert cached_repo.get_all('Product') == [Appel]
+    Dure_Appel = Appel.model_copy(update={"eenheidsprijs": 125})
+    cached_repo.update(Dure_Appel)
+    assert cached_repo.get(Appel.id, 'Product') == Dure_Appel
+    assert cached_repo.get_all('Product') == [Dure_Appel]
+    cached_repo.add(Banaan)
+    cached_repo.add(Mango)
+    for product in (Dure_Appel, Banaan, Mango):
+        assert cached_repo.get(product.id, 'Product') == product
+    assert len(cached_repo.cache.entries) == 2
+    cached_repo.delete(Mango)
+    with pytest.raises(ValueError):
+        cached_repo.get(Mango.id, 'Product')
+
+@pytest.fixture
+def repos():
+    '''
+    A SingleEntityRepository and a FactuurRepository on a fresh in-memory database, with Appel, Banaan, John_Doe and Google added.'''
+    entity_repo = SingleEntityRepository(':memory:')
+    entity_repo.create()
+    entity_repo.add_many([Appel, Banaan, John_Doe, Google])
+    yield entity_repo, FactuurRepository(pool=entity_repo.pool)
+    entity_repo.close()
+
+def test_add_many_and_update_many() -> None:
+    batch_repo = SingleEntityRepository(':memory:')
+    batch_repo.create()
+    batch_repo.add_many([Appel, Banaan, John_Doe, Google], batch_size=2)
+    assert batch_repo.get_all('Product') == [Appel, Banaan]
+    batch_factuur_repo = FactuurRepository(':memory:')
+    batch_factuur_repo.conn = batch_repo.conn
+    batch_factuur_repo.create()
+    batch_factuur_repo.add_many([f2024001, f2024002], batch_size=1)
+    assert batch_factuur_repo.get_all() == [f2024001, f2024002]
+    batch_factuur_repo.update_many([f2024002.model_copy(update={"betaalstatus": True})])
+    assert batch_factuur_repo.get(f2024002.factuurnummer).betaalstatus is True
+    Dure_Banaan = Banaan.model_copy(update={"eenheidsprijs": 250})
+    batch_repo.update_many([Dure_Banaan, John_Doe])
+    assert batch_repo.get(Banaan.id, 'Product') == Dure_Banaan
+
+def test_add_many_rolls_back_failing_batch(repos) -> None:
+    batch_repo, batch_factuur_repo = repos
+    with pytest.raises(ValueError, match="Product with id 3 does not exist"):
+        batch_factuur_repo.add_many([f2024002, f2024001_update])
+    assert batch_factuur_repo.get_all() == []
+    with pytest.raises(Exception):
+        batch_factuur_repo.add_many([f2024002, f2024002])
+    assert batch_factuur_repo.get_all() == []
+
+def test_iter_all_streams_in_chunks(repos) -> None:
+    stream_repo, stream_factuur_repo = repos
+    assert list(stream_repo.iter_all('Product', chunk_size=1)) == [Appel, Banaan]
+    assert [bedrijf.logo for bedrijf in stream_repo.iter_all('Bedrijf')] == [None]
+    assert list(stream_repo.iter_all('Bedrijf', include_blobs=True)) == [Google]
+    stream_factuur_repo.add_many([f2024001, f2024002])
+    assert list(stream_factuur_repo.iter_all(chunk_size=1, include_blobs=True)) == [f2024001, f2024002]
+    streamed = list(stream_factuur_repo.iter_all(vanaf="2022-01-01"))
+    assert [factuur.factuurnummer for factuur in streamed] == [f2024002.factuurnummer]
+    assert streamed[0].bedrijf.logo is None and streamed[0].producten == f2024002.producten
+
+def test_lazy_blobs_are_read_on_access(repos) -> None:
+    lazy_repo, lazy_factuur_repo = repos
+    lazy_factuur_repo.add(f2024002.model_copy(update={"pdf": b"%PDF-1.3 factuur"}))
+    lazy_factuur = lazy_factuur_repo.get(f2024002.factuurnummer, lazy_blobs=True)
+    assert isinstance(lazy_factuur.pdf, LazyBlob) and isinstance(lazy_factuur.bedrijf.logo, LazyBlob)
+    assert len(lazy_factuur.pdf) == len(b"%PDF-1.3 factuur")
+    assert lazy_factuur == lazy_factuur_repo.get(f2024002.factuurnummer)
+    assert lazy_factuur_repo.get_all(lazy_blobs=True) == [lazy_factuur]
+    output = io.BytesIO()
+    lazy_factuur.pdf.copy_to(output, chunk_size=4)
+    assert output.getvalue() == b"%PDF-1.3 factuur"
+    assert bytes(lazy_repo.get(Google.id, 'Bedrijf', lazy_blobs=True).logo) == Google.logo
+    lazy_factuur_repo.update(lazy_factuur.model_copy(update={"betaalstatus": True}))
+    assert lazy_factuur_repo.get(f2024002.factuurnummer).pdf == b"%PDF-1.3 factuur"
+
+def test_indexes_are_created_and_used(repos) -> None:
+    index_repo, index_factuur_repo = repos
+    index_factuur_repo.add_many([f2024001, f2024002])
+    plans = index_factuur_repo.explain()
+    assert any("idx_factuur_klant" in step for step in plans["get_all(klant)"])
+    assert any("idx_factuur_factuurdatum" in step for step in plans["get_all(vanaf, tot_en_met)"])
+    assert any("idx_bevatproduct_factuur" in step for step in plans["iter_producten"])
+    for method, plan in plans.items():
+        if method not in ("get_all", "iter_all"):
+            assert not any(step.startswith("SCAN Factuur") for step in plan), method
+    assert index_repo.explain("Product")["get"] == ["SEARCH Product USING INTEGER PRIMARY KEY (rowid=?)"]
+
+def test_connection_pool_gives_each_thread_its_own_connection(tmp_path) -> None:
+    with ConnectionPool(str(tmp_path / "facturen.db")) as pool:
+        pool_repo = SingleEntityRepository(pool=pool)
+        pool_repo.create()
+        pool_repo.add_many([Appel, Banaan, John_Doe, Google])
+        pool_factuur_repo = FactuurRepository(pool=pool)
+        pool_factuur_repo.add_many([f2024001, f2024002])
+        assert pool_factuur_repo.cache is pool_repo.cache is pool.cache
+        # Loading a factuur borrows the connection of the thread instead of opening a new one
+        assert pool_factuur_repo.get(f2024001.factuurnummer) == f2024001
+        assert len(pool.connections) == 1
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            facturen = list(executor.map(pool_factuur_repo.get, [f2024001.factuurnummer, f2024002.factuurnummer] * 8))
+            connections = set(executor.map(lambda _: (threading.get_ident(), id(pool_repo.conn)), range(8)))
+        assert facturen == [f2024001, f2024002] * 8
+        # Every worker thread has its own connection, next to the one of the main thread
+        assert len({thread for thread, _ in connections}) == len({conn for _, conn in connections})
+        assert id(pool_repo.conn) not in {conn for _, conn in connections}
+        assert len(pool.connections) <= 5
+    assert pool.connections == []
+    with pytest.raises(ValueError):
+        pool.connection()
+    # The transactions of threads would interleave on the single connection of an in-memory database
+    memory_repo = SingleEntityRepository(':memory:')
+    memory_repo.create()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(ValueError):
+            executor.submit(memory_repo.add, Appel).result()
+    memory_repo.close()
+
+def test_storage_profile_and_read_only_reporting(tmp_path) -> None:
+    db_path = str(tmp_path / "facturen.db")
+    # The defaults of SQLite are kept unless a profile asks for something else
+    default = SingleEntityRepository(db_path)
+    default.create()
+    assert default.conn.execute("PRAGMA journal_mode;").fetchone()[0] == "delete"
+    assert default.conn.execute("PRAGMA synchronous;").fetchone()[0] == 2
+    default.close()
+    writer = SingleEntityRepository(db_path, profile=WAL_PROFIEL._replace(busy_timeout=1000))
+    writer.add(Appel)
+    assert writer.conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+    assert writer.conn.execute("PRAGMA synchronous;").fetchone()[0] == 1
+    assert writer.conn.execute("PRAGMA busy_timeout;").fetchone()[0] == 1000
+    reporting = SingleEntityRepository(db_path, profile=StorageProfile(read_only=True))
+    # A read that is still open does not block the writer
+    cursor = reporting.conn.execute("SELECT * FROM Product;")
+    assert cursor.fetchone()[0] == Appel.id
+    writer.add(Banaan)
+    assert cursor.fetchone() is None
+    assert reporting.get_all("Product") == [Appel, Banaan]
+    with pytest.raises(sqlite3.OperationalError):
+        reporting.add(Banaan.model_copy(update={"id": 3}))
+    reporting.close()
+    writer.close()
+
+def test_add_reports_all_missing_references() -> None:
+    check_repo = SingleEntityRepository(':memory:')
+    check_repo.create()
+    check_repo.add(John_Doe)
+    check_factuur_repo = FactuurRepository(':memory:')
+    check_factuur_repo.conn = check_repo.conn
+    check_factuur_repo.create()
+    with pytest.raises(ValueError, match="Bedrijf with id 1 does not exist. Product with id 1, 3 does not exist."):
+        check_factuur_repo.add(f2024001_update)
+    assert check_factuur_repo.get_all() == []
+
+def test_foreign_keys_replace_the_reference_check(tmp_path) -> None:
+    fk_repo = SingleEntityRepository(str(tmp_path / "facturen.db"), profile=StorageProfile(foreign_keys=True))
+    fk_repo.create()
+    fk_repo.add_many([Appel, Banaan, John_Doe, Google])
+    fk_factuur_repo = FactuurRepository(pool=fk_repo.pool)
+    queries = []
+    fk_repo.conn.set_trace_callback(queries.append)
+    fk_factuur_repo.add(f2024001)
+    fk_repo.conn.set_trace_callback(None)
+    assert not any("WHERE id IN" in query for query in queries)
+    assert fk_factuur_repo.get(f2024001.factuurnummer) == f2024001
+    # A failing reference is still reported by id, and nothing of the factuur is written
+    with pytest.raises(ValueError, match="Product with id 3 does not exist."):
+        fk_factuur_repo.update(f2024001_update)
+    assert fk_factuur_repo.get(f2024001.factuurnummer) == f2024001
+    fk_repo.close()
+
+def test_update_only_writes_changes(repos) -> None:
+    diff_repo, diff_factuur_repo = repos
+    diff_repo.add(Mango)
+    met_pdf = f2024001.model_copy(update={"pdf": b"%PDF-1.3 a"})
+    diff_factuur_repo.add(met_pdf)
+    writes = []
+    # Statements run by triggers are traced as the statement that fired them, so every statement is only recorded once
+    diff_repo.conn.set_trace_callback(lambda statement: writes.append(statement) if statement.startswith(("UPDATE", "INSERT", "DELETE")) and statement not in writes[-1:] else None)
+    diff_factuur_repo.update(met_pdf)
+    assert writes == []
+    diff_factuur_repo.update(met_pdf.model_copy(update={"betaalstatus": True}))
+    assert writes == ["UPDATE Factuur SET betaalstatus = 1 WHERE factuurnummer = 'f2024001';"]
+    writes.clear()
+    # One line item gets another hoeveelheid, one is removed and one is added at the end
+    producten = [f2024001.producten[0].model_copy(update={"hoeveelheid": 5}), BevatProduct(product=Mango, hoeveelheid=1, datum="2021-01-03")]
+    gewijzigd = met_pdf.model_copy(update={"betaalstatus": True, "producten": producten})
+    diff_factuur_repo.update(gewijzigd)
+    assert [write.split(" WHERE")[0] for write in writes] == [
+        "DELETE FROM BevatProduct",
+        "UPDATE BevatProduct SET hoeveelheid = 5",
+        "INSERT INTO BevatProduct (factuur, product, hoeveelheid, datum) VALUES ('f2024001', 3, 1, '2021-01-03');"
+    ]
+    assert diff_factuur_repo.get("f2024001").producten == producten
+    # Reordered line items are written again in their new order
+    omgedraaid = gewijzigd.model_copy(update={"producten": producten[::-1]})
+    diff_factuur_repo.update(omgedraaid)
+    assert diff_factuur_repo.get("f2024001").producten == producten[::-1]
+    diff_repo.conn.set_trace_callback(None)
+    with pytest.raises(ValueError, match="Factuur with factuurnummer f2024002 does not exist."):
+        diff_factuur_repo.update(f2024002)
+
+def test_set_betaalstatus(repos) -> None:
+    status_repo, status_factuur_repo = repos
+    status_factuur_repo.add_many([f2024001, f2024002])
+    assert status_factuur_repo.set_betaalstatus([f2024001.factuurnummer, f2024002.factuurnummer, "onbekend"]) == 2
+    assert status_factuur_repo.set_betaalstatus([f2024001.factuurnummer]) == 0
+    assert [factuur.betaalstatus for factuur in status_factuur_repo.get_all()] == [True, True]
+    assert status_factuur_repo.set_betaalstatus([f2024002.factuurnummer], False) == 1
+    assert [factuur.factuurnummer for factuur in status_factuur_repo.get_all(betaalstatus=False)] == [f2024002.factuurnummer]
+
+def test_trusted_rows_skip_validation_and_strict_rows_do_not() -> None:
+    trusted_repo = SingleEntityRepository(':memory:', cache=EntityCache())
+    trusted_repo.create()
+    trusted_repo.add_many([Appel, Banaan, John_Doe, Google])
+    trusted_factuur_repo = FactuurRepository(pool=trusted_repo.pool)
+    trusted_factuur_repo.add(f2024001)
+    # Stored values are used as they are, even when they no longer match the line items
+    with trusted_repo.conn:
+        trusted_repo.conn.execute("UPDATE Factuur SET totaalbedrag_incl = 1, uiterste_betaaldatum = '2021-02-15' WHERE factuurnummer = ?;", (f2024001.factuurnummer,))
+    factuur = trusted_factuur_repo.get(f2024001.factuurnummer)
+    assert (factuur.totaalbedrag_incl, factuur.uiterste_betaaldatum, factuur.betaalstatus) == (1, "2021-02-15", False)
+    assert factuur == trusted_factuur_repo.get_all()[0]
+    assert type(factuur.betaalstatus) is bool and type(factuur.producten[0].product.btw_percentage) is float
+    # A price in euros, as imported from an old database, is only rejected by strict repositories
+    with trusted_repo.conn:
+        trusted_repo.conn.execute("UPDATE Product SET eenheidsprijs = 0.5 WHERE id = ?;", (Appel.id,))
+    trusted_repo.cache.clear()
+    assert trusted_repo.get(Appel.id, "Product").eenheidsprijs == 0.5
+    # Strict repositories on the same pool do not return the unvalidated models of its cache
+    strict_repo = SingleEntityRepository(pool=trusted_repo.pool, strict=True)
+    with pytest.raises(ValueError):
+        strict_repo.get(Appel.id, "Product")
+    with pytest.raises(ValueError):
+        FactuurRepository(pool=trusted_repo.pool, strict=True).get(f2024001.factuurnummer)
+    with pytest.raises(ValueError):
+        FactuurRepository(pool=trusted_repo.pool, strict=True).get_all()
+
+def test_regels_store_line_items_in_arrays() -> None:
+    lines = [BevatProduct(product=[Appel, Banaan][index % 2], hoeveelheid=index, datum=f"2024-01-{index % 28 + 1:02d}") for index in range(20000)]
+    groot = Factuur(factuurnummer="f2024100", klant=John_Doe, bedrijf=Google, factuurdatum="2024-01-01", producten=lines)
+    regels = groot.producten
+    assert isinstance(regels, Regels) and regels == lines and len(regels) == 20000
+    assert (regels[-1], regels[1:3]) == (lines[-1], lines[1:3])
+    # Every product and datum is kept once
+    assert len(regels.producten) == 2 and len(regels.datums) == 28
+    assert regels[0].product is regels[2].product
+    assert groot.totaalbedrag_excl == sum(line.product.eenheidsprijs * line.hoeveelheid for line in lines)
+    assert groot.model_dump()["producten"][1] == lines[1].model_dump()
+    assert pickle.loads(pickle.dumps(groot)) == groot
+    # A line with a price of its own keeps its own Product, an equal copy shares the interned one
+    regels.append(BevatProduct(product=Appel.model_copy(update={"eenheidsprijs": 1}), hoeveelheid=1, datum="2024-01-01"))
+    regels.append(BevatProduct(product=Appel.model_copy(), hoeveelheid=1, datum="2024-01-01"))
+    assert len(regels.producten) == 3
+    assert (regels[-2].product.eenheidsprijs, regels[-1].product) == (1, Appel)
+    assert regels[-1].product is regels[0].product
+    korting = Factuur(factuurnummer="f2024101", klant=John_Doe, bedrijf=Google, factuurdatum="2024-01-01", producten=[
+        BevatProduct(product=Appel, hoeveelheid=2, datum="2024-01-01"),
+        BevatProduct(product=Appel.model_copy(update={"eenheidsprijs": 25}), hoeveelheid=2, datum="2024-01-01")
+    ])
+    assert korting.totaalbedrag_excl == 150
+
+def test_page_through_facturen_with_a_cursor(repos) -> None:
+    page_repo, page_factuur_repo = repos
+    facturen = [Factuur(factuurnummer=f"f2024{index:03d}", klant=John_Doe, bedrijf=Google, factuurdatum=f"2024-{index % 12 + 1:02d}-01", producten=[
+        BevatProduct(product=Appel, hoeveelheid=index + 1, datum="2024-01-01")
+    ], betaalstatus=index % 3 == 0) for index in range(25)]
+    page_factuur_repo.add_many(facturen)
+    ordered = sorted(facturen, key=lambda factuur: (factuur.factuurdatum, factuur.factuurnummer))
+    seen, na = [], None
+    while True:
+        pagina = page_factuur_repo.page(klant=John_Doe.id, na=na, limit=10)
+        seen.extend(pagina.facturen)
+        na = pagina.volgende
+        if na is None:
+            break
+    assert [overzicht.factuurnummer for overzicht in seen] == [factuur.factuurnummer for factuur in ordered]
+    assert seen[0] == (ordered[0].factuurnummer, John_Doe.id, Google.id, ordered[0].factuurdatum, ordered[0].uiterste_betaaldatum,
+                       ordered[0].totaalbedrag_excl, ordered[0].btw_bedrag, ordered[0].totaalbedrag_incl, ordered[0].betaalstatus)
+    nieuwste = page_factuur_repo.page(bedrijf=Google.id, limit=3, aflopend=True)
+    assert [overzicht.factuurnummer for overzicht in nieuwste.facturen] == [factuur.factuurnummer for factuur in ordered[::-1][:3]]
+    assert page_factuur_repo.page(bedrijf=Google.id, na=nieuwste.volgende, limit=3, aflopend=True).facturen[0].factuurnummer == ordered[-4].factuurnummer
+    verlopen = page_factuur_repo.page(verlopen=True, vandaag="2024-04-01", limit=100)
+    assert [overzicht.factuurnummer for overzicht in verlopen.facturen] == [
+        factuur.factuurnummer for factuur in ordered if not factuur.betaalstatus and factuur.uiterste_betaaldatum < "2024-04-01"
+    ]
+    assert verlopen.volgende is None
+    plans = page_factuur_repo.explain()
+    assert any("idx_factuur_klant_factuurdatum" in step for step in plans["page(klant)"])
+    assert any("idx_factuur_bedrijf_factuurdatum" in step for step in plans["page(bedrijf, aflopend)"])
+    # The index of migration 9 replaces idx_factuur_betaalstatus, also for get_all(betaalstatus)
+    for method in ["page(verlopen)", "get_all(betaalstatus)"]:
+        assert any("idx_factuur_betaalstatus_factuurdatum" in step for step in plans[method]), method
+    assert page_repo.conn.execute("SELECT name FROM sqlite_master WHERE name = 'idx_factuur_betaalstatus';").fetchall() == []
+    for method in ["page", "page(klant)", "page(bedrijf, aflopend)", "page(verlopen)"]:
+        assert not any("TEMP B-TREE" in step for step in plans[method]), method
+    with pytest.raises(ValueError):
+        page_factuur_repo.page(limit=0)
+
+def test_repositories_on_the_same_file_never_read_stale_entities(tmp_path) -> None:
+    db_path = str(tmp_path / "facturen.db")
+    writer = SingleEntityRepository(db_path)
+    writer.create()
+    writer.add_many([Appel, Banaan, John_Doe, Google])
+    reader = SingleEntityRepository(db_path)
+    reader_factuur_repo = FactuurRepository(db_path)
+    reader_factuur_repo.add(f2024001)
+    assert reader.get(Appel.id, "Product") == Appel
+    assert reader_factuur_repo.get(f2024001.factuurnummer).producten[0].product == Appel
+    Dure_Appel = Appel.model_copy(update={"naam": "Dure appel"})
+    writer.update(Dure_Appel)
+    assert reader.get(Appel.id, "Product") == Dure_Appel
+    assert reader_factuur_repo.get(f2024001.factuurnummer).producten[0].product == Dure_Appel
+    writer.delete(Banaan)
+    with pytest.raises(ValueError):
+        reader.get(Banaan.id, "Product")
+    for repository in (writer, reader, reader_factuur_repo):
+        repository.close()
+
+def test_repositories_on_a_shared_pool_never_read_stale_entities(tmp_path) -> None:
+    with ConnectionPool(str(tmp_path / "facturen.db")) as pool:
+        writer = SingleEntityRepository(pool=pool)
+        writer.create()
+        writer.add_many([Appel, Banaan, John_Doe, Google])
+        shared_factuur_repo = FactuurRepository(pool=pool)
+        shared_factuur_repo.add(f2024001)
+        assert shared_factuur_repo.get(f2024001.factuurnummer) == f2024001
+        # The ids stored as text in Factuur and BevatProduct are cached under the keys that writes invalidate
+        verhuisd = John_Doe.model_copy(update={"plaats": "Utrecht"})
+        writer.update(verhuisd)
+        assert shared_factuur_repo.get(f2024001.factuurnummer).klant == verhuisd
+        writer.delete(Banaan)
+        with pytest.raises(ValueError):
+            shared_factuur_repo.get(f2024001.factuurnummer)
+    # A model read before a write is not cached after the write invalidated it
+    cache = EntityCache()
+    version = cache.version(("Klant", John_Doe.id))
+    cache.invalidate("Klant", John_Doe.id)
+    cache.put(("Klant", str(John_Doe.id)), John_Doe, version)
+    assert cache.get(("Klant", John_Doe.id)) is None
@@ -1,7 +1,7 @@
 import pytest
 from backend.operations.database_operations import Product, Klant, Bedrijf, Factuur, BevatProduct
 from backend.operations.database_operations import SingleEntityRepository, FactuurRepository
-from backend.operations.factuur_automations import generate_pdf
+from backend.operations.factuur_automations import generate_pdf, generate_pdfs, generate_pdf_async, get_template, clear_templates
 import os
 
 repo = SingleEntityRepository(':memory:')
@@ -44,7 +44,7 @@ Appel = Product(
     naam="Appel",
     omschrijving="Een apppel.",
     productcategorie="fruit",
-    eenheidsprijs=0.50,
+    eenheidsprijs=50,
     btw_percentage=21.0
 )
 
@@ -53,7 +53,7 @@ Banaan = Product(
     naam="Banaan",
     omschrijving="Een banaan.",
     productcategorie="fruit",
-    eenheidsprijs=0.75,
+    eenheidsprijs=75,
     btw_percentage=21.0
 )
 
@@ -120,4 +120,93 @@ def test_generate_pdf_writing_pdf() -> None:
     with open("factuur.pdf", "wb") as f:
         f.write(f2024002_with_pdf.pdf)
     assert os.path.exists("factuur.pdf") == True
-    os.remove("factuur.pdf")
\ No newline at end of file
+    os.remove("factuur.pdf")
+
+@pytest.fixture
+def repos():
+    """A SingleEntityRepository and a FactuurRepository on a fresh in-memory database, with Google, John_Doe, Appel and Banaan added."""
+    entity_repo = SingleEntityRepository(':memory:')
+    entity_repo.create()
+    entity_repo.add_many([Google, John_Doe, Appel, Banaan])
+    yield entity_repo, FactuurRepository(pool=entity_repo.pool)
+    entity_repo.close()
+
+def test_generate_pdfs_in_process_pool(repos) -> None:
+    """Test if generate_pdfs renders in worker processes, reports failures per factuur and writes the results back."""
+    Zonder_logo = Google.model_copy(update={"id": 2, "logo": None})
+    pool_repo, pool_factuur_repo = repos
+    pool_repo.add(Zonder_logo)
+    facturen = [
+        f2024002.model_copy(update={"pdf": None}),
+        f2024002.model_copy(update={"factuurnummer": "F2024003", "bedrijf": Zonder_logo, "pdf": None})
+    ]
+    pool_factuur_repo.add_many(facturen)
+    # A factuur of a klant that does not exist renders, but cannot be written back
+    onbekend = f2024002.model_copy(update={"factuurnummer": "F2024004", "klant": John_Doe.model_copy(update={"id": 99}), "pdf": None})
+    results = {result.factuurnummer: result for result in generate_pdfs([*facturen, onbekend], workers=2, repo=pool_factuur_repo)}
+    assert results["F2024004"].factuur is None
+    assert isinstance(results["F2024004"].error, ValueError)
+    assert results["F2024002"].error is None
+    assert results["F2024002"].factuur.pdf.startswith(b"%PDF")
+    assert results["F2024003"].factuur is None
+    assert isinstance(results["F2024003"].error, TypeError)
+    assert pool_factuur_repo.get("F2024002").pdf == results["F2024002"].factuur.pdf
+    assert pool_factuur_repo.get("F2024003").pdf is None
+
+def test_generate_pdf_does_no_disk_io(tmp_path, monkeypatch) -> None:
+    """Test if generate_pdf renders in memory only, so concurrent renders in threads do not interfere."""
+    from concurrent.futures import ThreadPoolExecutor
+    monkeypatch.chdir(tmp_path)
+    facturen = [f2024002.model_copy(update={"factuurnummer": f"F20241{index:02d}", "pdf": None}) for index in range(8)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        rendered = list(executor.map(generate_pdf, facturen))
+    assert all(factuur.pdf.startswith(b"%PDF") for factuur in rendered)
+    assert os.listdir(tmp_path) == []
+
+def test_template_is_cached_per_bedrijf() -> None:
+    """Test if the template of a bedrijf is reused, and rebuilt when the bedrijf changes."""
+    clear_templates()
+    template = get_template(Google)
+    assert get_template(Google.model_copy()) is template
+    Google_nieuwe_bank = Google.model_copy(update={"iban": "NL99RABO0123456789"})
+    rebuilt = get_template(Google_nieuwe_bank)
+    assert rebuilt is not template
+    assert "IBAN: NL99RABO0123456789" in rebuilt.footer
+    assert get_template(Google_nieuwe_bank) is rebuilt
+    # A lazily loaded logo is read once per loaded Bedrijf, not for every factuur
+    lazy_repo = SingleEntityRepository(':memory:')
+    lazy_repo.create()
+    lazy_repo.add(Google)
+    lazy_google = lazy_repo.get(Google.id, "Bedrijf", lazy_blobs=True)
+    template = get_template(lazy_google)
+    lazy_repo.conn.close()
+    assert get_template(lazy_google) is template
+
+def test_generate_pdf_streams_many_line_items_over_pages(repos) -> None:
+    """Test if a factuur with many line items streamed from the repo is rendered over several pages."""
+    _, stream_factuur_repo = repos
+    producten = [BevatProduct(product=Appel if dag % 2 else Banaan, hoeveelheid=dag, datum=f"2024-01-{dag:02d}") for dag in range(1, 29)] * 2
+    producten = [product.model_copy(update={"datum": f"{product.datum}-{index}"}) for index, product in enumerate(producten)]
+    groot = Factuur(factuurnummer="F2024100", klant=John_Doe, bedrijf=Google, factuurdatum="2024-02-01", producten=producten)
+    stream_factuur_repo.add(groot)
+    header = stream_factuur_repo.get("F2024100", include_producten=False)
+    assert header.producten == [] and header.totaalbedrag_incl == groot.totaalbedrag_incl
+    assert list(stream_factuur_repo.iter_producten("F2024100", chunk_size=7)) == producten
+    rendered = generate_pdf(header, producten=stream_factuur_repo.iter_producten("F2024100"))
+    assert rendered.pdf.count(b"/Type /Page\n") > 2
+
+def test_generate_pdf_async() -> None:
+    """Test if generate_pdf_async renders without blocking the event loop, in threads and in worker processes."""
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+
+    async def run() -> list[Factuur]:
+        facturen = [f2024002.model_copy(update={"factuurnummer": f"F20242{index:02d}", "pdf": None}) for index in range(4)]
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            in_processes = await asyncio.gather(*(generate_pdf_async(factuur, executor) for factuur in facturen[:2]))
+        in_threads = await asyncio.gather(*(generate_pdf_async(factuur) for factuur in facturen[2:]))
+        return in_processes + in_threads
+
+    rendered = asyncio.run(run())
+    assert [factuur.factuurnummer for factuur in rendered] == [f"F20242{index:02d}" for index in range(4)]
+    assert all(factuur.pdf.startswith(b"%PDF") for factuur in rendered)
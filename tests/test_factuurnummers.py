@@ -0,0 +1,61 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from backend.operations.database_operations import Klant, Bedrijf, Factuur, SingleEntityRepository, FactuurRepository
+from backend.operations.factuurnummers import FactuurnummerRepository
+
+Google = Bedrijf(
+    id=1,
+    handelsnaam="Google",
+    straatnaam="Main Street",
+    huisnummer="2",
+    postcode="1234AB",
+    plaats="New York",
+    kvk_nummer="12345678",
+    btw_nummer="12345678",
+    bank="ING",
+    iban="NL12INGB1234567890",
+    bic="INGBNL2A",
+    telefoonnummer="123456789",
+    email="info@google.com"
+)
+
+John_Doe = Klant(
+    id=1,
+    handelsnaam="John Doe Inc.",
+    ten_aanzien_van="John Doe",
+    straatnaam="Pannekoeken Street",
+    huisnummer="1",
+    postcode="1234AB",
+    plaats="New York"
+)
+
+def test_parallel_reservations_are_gap_free(tmp_path) -> None:
+    repo = SingleEntityRepository(str(tmp_path / "facturen.db"))
+    repo.create()
+    nummers = FactuurnummerRepository(pool=repo.pool)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        reserveringen = list(executor.map(lambda _: nummers.reserveer(Google.id, 2024, 10), range(40)))
+    assert sorted(nummer for reservering in reserveringen for nummer in reservering.nummers) == list(range(1, 401))
+    # Every bedrijf and year has its own reeks
+    assert nummers.reserveer(Google.id, 2025).factuurnummers == ["F1-2025-00001"]
+    assert nummers.reserveer(2, 2024).nummers == [1]
+    repo.close()
+
+def test_unused_numbers_are_handed_out_again() -> None:
+    repo = SingleEntityRepository(':memory:')
+    repo.create()
+    repo.add_many([Google, John_Doe])
+    factuur_repo = FactuurRepository(pool=repo.pool)
+    nummers = FactuurnummerRepository(pool=repo.pool)
+    blok = nummers.reserveer(Google.id, 2024, 5)
+    assert blok.factuurnummers == [f"F1-2024-0000{nummer}" for nummer in range(1, 6)]
+    factuur_repo.add_many([Factuur(factuurnummer=factuurnummer, klant=John_Doe, bedrijf=Google, factuurdatum="2024-01-01", producten=[])
+                           for factuurnummer in blok.factuurnummers[:2]])
+    assert nummers.geef_terug(blok) == 3
+    assert nummers.reserveer(Google.id, 2024, 4).nummers == [3, 4, 5, 6]
+    with pytest.raises(ValueError):
+        nummers.begin_bij(Google.id, 2024, 5)
+    nummers.begin_bij(Google.id, 2024, 100)
+    assert nummers.reserveer(Google.id, 2024).nummers == [100]
+    with pytest.raises(ValueError):
+        nummers.reserveer(Google.id, 2024, 0)
@@ -0,0 +1,13 @@
+import sqlite3
+from backend.operations.geld import centen, euro, btw_regel, btw_regel_sql
+
+def test_centen_and_euro() -> None:
+    assert [centen("0.50"), centen(1.15), centen(2), centen("-0.005")] == [50, 115, 200, -1]
+    assert [euro(50), euro(-105), euro(0), euro(123456)] == ["0.50", "-1.05", "0.00", "1234.56"]
+
+def test_btw_regel_sql_is_identical_to_btw_regel() -> None:
+    conn = sqlite3.connect(':memory:')
+    for excl in [-1295, -50, 0, 1, 50, 105, 3885, 123457]:
+        for btw_percentage in [0.0, 9.0, 21.0, 5.5]:
+            assert conn.execute(f"SELECT {btw_regel_sql(':excl', ':btw_percentage')};", {"excl": excl, "btw_percentage": btw_percentage}).fetchone()[0] == btw_regel(excl, btw_percentage)
+    assert btw_regel(3885, 9.0) == 350 and btw_regel(-3885, 9.0) == -350
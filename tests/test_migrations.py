@@ -0,0 +1,165 @@
+import sqlite3
+import pytest
+from backend.operations.migrations import Migration, MIGRATIONS, migrate, schema_version
+
+def test_migrate_new_database() -> None:
+    conn = sqlite3.connect(':memory:')
+    assert schema_version(conn) == 0
+    assert migrate(conn) == MIGRATIONS[-1].version
+    assert schema_version(conn) == MIGRATIONS[-1].version
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_factuur_klant%';")
+    assert cursor.fetchall() == [("idx_factuur_klant_factuurdatum",)]
+    # Running it again changes nothing
+    assert migrate(conn) == MIGRATIONS[-1].version
+
+def test_migrate_database_from_before_versioning() -> None:
+    conn = sqlite3.connect(':memory:')
+    MIGRATIONS[0].schema(conn)
+    conn.execute("INSERT INTO Factuur (factuurnummer, klant, bedrijf, factuurdatum, uiterste_betaaldatum, totaalbedrag_excl, btw_bedrag, totaalbedrag_incl) VALUES ('F2024001', 1, 1, '2024-01-01', '2024-01-31', 1, 0.21, 1.21);")
+    conn.commit()
+    migrate(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT factuurnummer, pdf_ref FROM Factuur;")
+    assert cursor.fetchall() == [("F2024001", None)]
+
+def test_backfill_commits_per_batch_and_resumes() -> None:
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE Regel (id INTEGER PRIMARY KEY, bedrag DECIMAL(10,2) NOT NULL);")
+    conn.executemany("INSERT INTO Regel (bedrag) VALUES (?);", [(i / 100,) for i in range(1, 11)])
+    conn.commit()
+    batches = []
+
+    def add_centen(conn: sqlite3.Connection) -> None:
+        if "centen" not in [column[1] for column in conn.execute("PRAGMA table_info(Regel);")]:
+            conn.execute("ALTER TABLE Regel ADD COLUMN centen INT;")
+
+    def backfill_centen(conn: sqlite3.Connection, batch_size: int) -> int:
+        if len(batches) == 2:
+            raise RuntimeError("interrupted")
+        cursor = conn.cursor()
+        cursor.execute("UPDATE Regel SET centen = CAST(ROUND(bedrag * 100) AS INT) WHERE id IN (SELECT id FROM Regel WHERE centen IS NULL LIMIT ?);", (batch_size,))
+        batches.append(cursor.rowcount)
+        return cursor.rowcount
+
+    migrations = [Migration(1, "Add Regel.centen", add_centen, backfill_centen)]
+    with pytest.raises(RuntimeError):
+        migrate(conn, migrations, batch_size=4)
+    # The finished batches are committed, but the version is not recorded yet
+    assert schema_version(conn) == 0
+    assert conn.execute("SELECT COUNT(*) FROM Regel WHERE centen IS NOT NULL;").fetchone()[0] == 8
+    batches.clear()
+    # The rerun resumes with the rows that were not backfilled yet
+    assert migrate(conn, migrations, batch_size=4) == 1
+    assert batches == [2, 0]
+    assert conn.execute("SELECT SUM(centen) FROM Regel;").fetchone()[0] == 55
+
+def test_migrate_rejects_newer_database() -> None:
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f"PRAGMA user_version = {MIGRATIONS[-1].version + 1};")
+    with pytest.raises(ValueError):
+        migrate(conn)
+
+def test_migrate_amounts_to_centen() -> None:
+    conn = sqlite3.connect(':memory:')
+    migrate(conn, MIGRATIONS[:4])
+    conn.execute("INSERT INTO Product (id, naam, omschrijving, productcategorie, eenheidsprijs, btw_percentage) VALUES (1, 'Appel', 'Een appel.', 'fruit', 0.35, 21), (2, 'Boek', 'Een boek.', 'boeken', 12.95, 9);")
+    conn.executemany("INSERT INTO Factuur (factuurnummer, klant, bedrijf, factuurdatum, uiterste_betaaldatum, totaalbedrag_excl, btw_bedrag, totaalbedrag_incl) VALUES (?, 1, 1, '2024-01-01', '2024-01-31', ?, ?, ?);", [
+        ("F2024001", 1.05, 0.22, 1.27), ("F2024002", 38.85, 3.5, 42.35)
+    ])
+    conn.executemany("INSERT INTO BevatProduct (factuur, product, hoeveelheid, datum) VALUES (?, ?, ?, '2024-01-01');", [("F2024001", 1, 3), ("F2024002", 2, 3)])
+    conn.commit()
+    assert migrate(conn, batch_size=1) == MIGRATIONS[-1].version
+    cursor = conn.cursor()
+    cursor.execute("SELECT eenheidsprijs FROM Product ORDER BY id;")
+    assert cursor.fetchall() == [(35,), (1295,)]
+    cursor.execute("SELECT totaalbedrag_excl, btw_bedrag, totaalbedrag_incl FROM Factuur ORDER BY factuurnummer;")
+    assert cursor.fetchall() == [(105, 22, 127), (3885, 350, 4235)]
+    # The BTW of the line items is rounded per line: 3 * 12.95 * 9% = 3.4965
+    cursor.execute("SELECT grondslag, btw FROM RegelBtw ORDER BY regel;")
+    assert cursor.fetchall() == [(105, 22), (3885, 350)]
+    cursor.execute("SELECT aantal, totaal_excl, btw, totaal_incl FROM OmzetPerMaand;")
+    assert cursor.fetchall() == [(2, 3990, 372, 4362)]
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'CentenTeConverteren' OR name LIKE 'centen_%';").fetchone()[0] == 0
+    # The triggers that were recreated compute in eurocents
+    with conn:
+        conn.execute("INSERT INTO BevatProduct (factuur, product, hoeveelheid, datum) VALUES ('F2024001', 2, 1, '2024-01-02');")
+    cursor.execute("SELECT btw_percentage, grondslag, btw FROM BtwPerTarief ORDER BY btw_percentage;")
+    assert cursor.fetchall() == [(9, 5180, 467), (21, 105, 22)]
+
+def test_rows_written_during_the_centen_conversion_are_kept() -> None:
+    conn = sqlite3.connect(':memory:')
+    migrate(conn, MIGRATIONS[:4])
+    conn.execute("INSERT INTO Product (id, naam, omschrijving, productcategorie, eenheidsprijs, btw_percentage) VALUES (1, 'Appel', 'Een appel.', 'fruit', 0.35, 21), (2, 'Boek', 'Een boek.', 'boeken', 12.95, 9);")
+    conn.execute("INSERT INTO Factuur (factuurnummer, klant, bedrijf, factuurdatum, uiterste_betaaldatum, totaalbedrag_excl, btw_bedrag, totaalbedrag_incl) VALUES ('F2024001', 1, 1, '2024-01-01', '2024-01-31', 1.05, 0.22, 1.27);")
+    conn.execute("INSERT INTO BevatProduct (factuur, product, hoeveelheid, datum) VALUES ('F2024001', 1, 3, '2024-01-01');")
+    conn.commit()
+    backfill = MIGRATIONS[4].backfill
+    batches = []
+
+    def write_between_batches(conn: sqlite3.Connection, batch_size: int) -> int:
+        # Written by code that already stores eurocents, between the first and the second batch
+        if len(batches) == 1:
+            conn.execute("UPDATE Product SET eenheidsprijs = 40 WHERE id = 1;")
+            conn.execute("INSERT INTO Product (id, naam, omschrijving, productcategorie, eenheidsprijs, btw_percentage) VALUES (3, 'Peer', 'Een peer.', 'fruit', 60, 9);")
+            conn.execute("INSERT INTO Factuur (factuurnummer, klant, bedrijf, factuurdatum, uiterste_betaaldatum, totaalbedrag_excl, btw_bedrag, totaalbedrag_incl) VALUES ('F2024002', 1, 1, '2024-02-01', '2024-03-02', 100, 21, 121);")
+            conn.execute("INSERT INTO BevatProduct (factuur, product, hoeveelheid, datum) VALUES ('F2024002', 3, 2, '2024-02-01');")
+            conn.execute("UPDATE BevatProduct SET hoeveelheid = 5 WHERE factuur = 'F2024001';")
+        batches.append(backfill(conn, batch_size))
+        return batches[-1]
+
+    migrate(conn, MIGRATIONS[:4] + [MIGRATIONS[4]._replace(backfill=write_between_batches)] + MIGRATIONS[5:], batch_size=1)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, eenheidsprijs FROM Product ORDER BY id;")
+    assert cursor.fetchall() == [(1, 40), (2, 1295), (3, 60)]
+    cursor.execute("SELECT factuurnummer, totaalbedrag_incl FROM Factuur ORDER BY factuurnummer;")
+    assert cursor.fetchall() == [("F2024001", 127), ("F2024002", 121)]
+    # Both line items are in the BTW report, the changed one with its new hoeveelheid
+    cursor.execute("SELECT maand, btw_percentage, grondslag, btw FROM BtwPerTarief WHERE aantal > 0 ORDER BY maand;")
+    assert cursor.fetchall() == [("2024-01", 21, 200, 42), ("2024-02", 9, 120, 11)]
+
+def test_rows_rewritten_unchanged_during_the_centen_conversion_are_still_converted() -> None:
+    conn = sqlite3.connect(':memory:')
+    migrate(conn, MIGRATIONS[:4])
+    conn.execute("INSERT INTO Product (id, naam, omschrijving, productcategorie, eenheidsprijs, btw_percentage) VALUES (1, 'Appel', 'Een appel.', 'fruit', 0.35, 21), (2, 'Boek', 'Een boek.', 'boeken', 12.95, 9);")
+    conn.execute("INSERT INTO Factuur (factuurnummer, klant, bedrijf, factuurdatum, uiterste_betaaldatum, totaalbedrag_excl, btw_bedrag, totaalbedrag_incl) VALUES ('F2024001', 1, 1, '2024-01-01', '2024-01-31', 1.05, 0.22, 1.27);")
+    conn.commit()
+    backfill = MIGRATIONS[4].backfill
+    batches = []
+
+    def rename_between_batches(conn: sqlite3.Connection, batch_size: int) -> int:
+        # A read-modify-write of rows that are not converted yet, which writes every column back as it was read
+        if len(batches) == 1:
+            conn.execute("UPDATE Product SET naam = 'Kookboek', eenheidsprijs = eenheidsprijs WHERE id = 2;")
+            conn.execute("UPDATE Factuur SET betaalstatus = 1, totaalbedrag_excl = totaalbedrag_excl, btw_bedrag = btw_bedrag, totaalbedrag_incl = totaalbedrag_incl;")
+        batches.append(backfill(conn, batch_size))
+        return batches[-1]
+
+    migrate(conn, MIGRATIONS[:4] + [MIGRATIONS[4]._replace(backfill=rename_between_batches)] + MIGRATIONS[5:], batch_size=1)
+    cursor = conn.cursor()
+    cursor.execute("SELECT naam, eenheidsprijs FROM Product ORDER BY id;")
+    assert cursor.fetchall() == [("Appel", 35), ("Kookboek", 1295)]
+    cursor.execute("SELECT totaalbedrag_excl, btw_bedrag, totaalbedrag_incl FROM Factuur;")
+    assert cursor.fetchall() == [(105, 22, 127)]
+
+def test_connections_that_migrate_at_the_same_time_apply_every_step_once(tmp_path, monkeypatch) -> None:
+    from backend.operations import migrations
+    db_path = str(tmp_path / "facturen.db")
+    worker_a = sqlite3.connect(db_path)
+    worker_b = sqlite3.connect(db_path)
+    migrate(worker_a, MIGRATIONS[:3])
+    worker_a.execute("INSERT INTO Product (id, naam, omschrijving, productcategorie, eenheidsprijs, btw_percentage) VALUES (1, 'Appel', 'Een appel.', 'fruit', 0.5, 21);")
+    worker_a.execute("INSERT INTO Factuur (factuurnummer, klant, bedrijf, factuurdatum, uiterste_betaaldatum, totaalbedrag_excl, btw_bedrag, totaalbedrag_incl) VALUES ('F2024001', 1, 1, '2024-01-01', '2024-01-31', 1, 0.21, 1.21);")
+    worker_a.execute("INSERT INTO BevatProduct (factuur, product, hoeveelheid, datum) VALUES ('F2024001', 1, 2, '2024-01-01');")
+    worker_a.commit()
+    # Worker b reads version 3, then worker a finishes the whole upgrade before b starts its first step
+    read_version = migrations.schema_version
+    def version_read_before_a_finished(conn: sqlite3.Connection) -> int:
+        monkeypatch.setattr(migrations, "schema_version", read_version)
+        version = read_version(conn)
+        migrate(worker_a)
+        return version
+    monkeypatch.setattr(migrations, "schema_version", version_read_before_a_finished)
+    assert migrate(worker_b) == MIGRATIONS[-1].version
+    assert worker_b.execute("SELECT eenheidsprijs FROM Product;").fetchall() == [(50,)]
+    assert worker_b.execute("SELECT totaalbedrag_excl, btw_bedrag, totaalbedrag_incl FROM Factuur;").fetchall() == [(100, 21, 121)]
@@ -0,0 +1,106 @@
+import os
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from backend.operations.database_operations import Product, Klant, Bedrijf, Factuur, BevatProduct
+from backend.operations.database_operations import SingleEntityRepository, FactuurRepository
+from backend.operations.pdf_store import DirectoryPdfStore, SqlitePdfStore, StoredPdf
+
+Google = Bedrijf(
+    id=1,
+    handelsnaam="Google",
+    straatnaam="Main Street",
+    huisnummer="2",
+    postcode="1234AB",
+    plaats="New York",
+    kvk_nummer="12345678",
+    btw_nummer="12345678",
+    bank="ING",
+    iban="NL12INGB1234567890",
+    bic="INGBNL2A",
+    telefoonnummer="123456789",
+    email="info@google.com"
+)
+
+John_Doe = Klant(
+    id=1,
+    handelsnaam="John Doe Inc.",
+    ten_aanzien_van="John Doe",
+    straatnaam="Pannekoeken Street",
+    huisnummer="1",
+    postcode="1234AB",
+    plaats="New York"
+)
+
+Appel = Product(
+    id=1,
+    naam="Appel",
+    omschrijving="Een apppel.",
+    productcategorie="fruit",
+    eenheidsprijs=50,
+    btw_percentage=21.0
+)
+
+def make_factuur(factuurnummer: str, pdf: bytes) -> Factuur:
+    return Factuur(
+        factuurnummer=factuurnummer,
+        klant=John_Doe,
+        bedrijf=Google,
+        factuurdatum="2024-01-01",
+        producten=[BevatProduct(product=Appel, hoeveelheid=2, datum="2024-01-01")],
+        pdf=pdf
+    )
+
+def make_repo() -> FactuurRepository:
+    repo = SingleEntityRepository(':memory:')
+    repo.create()
+    repo.add_many([Google, John_Doe, Appel])
+    store = SqlitePdfStore(repo.conn)
+    store.create()
+    factuur_repo = FactuurRepository(':memory:', pdf_store=store)
+    factuur_repo.conn = repo.conn
+    factuur_repo.create()
+    return factuur_repo
+
+def test_directory_store_deduplicates(tmp_path) -> None:
+    store = DirectoryPdfStore(str(tmp_path))
+    key = store.put(b"%PDF-1.3 a")
+    assert store.put(b"%PDF-1.3 a") == key
+    assert store.get(key) == b"%PDF-1.3 a"
+    assert sum(len(files) for _, _, files in os.walk(tmp_path)) == 1
+    with pytest.raises(ValueError):
+        store.get(store.key(b"missing"))
+
+def test_sqlite_store_keeps_only_a_reference_in_factuur() -> None:
+    factuur_repo = make_repo()
+    factuur_repo.add_many([make_factuur("F2024001", b"%PDF-1.3 a"), make_factuur("F2024002", b"%PDF-1.3 a")])
+    cursor = factuur_repo.conn.cursor()
+    cursor.execute("SELECT pdf, pdf_ref FROM Factuur;")
+    assert {row for row in cursor.fetchall()} == {(None, factuur_repo.pdf_store.key(b"%PDF-1.3 a"))}
+    cursor.execute("SELECT COUNT(*) FROM PdfBestand;")
+    assert cursor.fetchone()[0] == 1
+    assert factuur_repo.get("F2024001") == make_factuur("F2024001", b"%PDF-1.3 a")
+    assert factuur_repo.get_all() == [make_factuur("F2024001", b"%PDF-1.3 a"), make_factuur("F2024002", b"%PDF-1.3 a")]
+
+def test_update_without_pdf_change_does_not_write_pdf() -> None:
+    factuur_repo = make_repo()
+    factuur_repo.add(make_factuur("F2024001", b"%PDF-1.3 a"))
+    factuur = factuur_repo.get("F2024001", lazy_blobs=True)
+    assert isinstance(factuur.pdf, StoredPdf)
+    writes = []
+    factuur_repo.pdf_store.put = writes.append
+    factuur_repo.update(factuur.model_copy(update={"betaalstatus": True}))
+    assert writes == []
+    assert factuur_repo.get("F2024001").pdf == b"%PDF-1.3 a"
+
+def test_sqlite_pdf_store_writes_on_the_connection_of_each_thread(tmp_path) -> None:
+    repo = SingleEntityRepository(str(tmp_path / "facturen.db"))
+    repo.create()
+    repo.add_many([Google, John_Doe, Appel])
+    store = SqlitePdfStore(repo.pool)
+    store.create()
+    repo.conn.commit()
+    factuur_repo = FactuurRepository(pool=repo.pool, pdf_store=store)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda index: factuur_repo.add(make_factuur(f"F2024{index:03d}", f"%PDF-1.3 {index}".encode())), range(8)))
+    assert sorted(bytes(factuur.pdf) for factuur in factuur_repo.get_all()) == sorted(f"%PDF-1.3 {index}".encode() for index in range(8))
+    repo.close()
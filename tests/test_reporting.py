@@ -0,0 +1,125 @@
+import pytest
+from backend.operations.database_operations import Product, Klant, Bedrijf, Factuur, BevatProduct
+from backend.operations.database_operations import SingleEntityRepository, FactuurRepository
+from backend.operations.migrations import MIGRATIONS, migrate
+from backend.operations.reporting import ReportRepository, Omzet, BtwTarief, Openstaand
+
+Google = Bedrijf(
+    id=1,
+    handelsnaam="Google",
+    straatnaam="Main Street",
+    huisnummer="2",
+    postcode="1234AB",
+    plaats="New York",
+    kvk_nummer="12345678",
+    btw_nummer="12345678",
+    bank="ING",
+    iban="NL12INGB1234567890",
+    bic="INGBNL2A",
+    telefoonnummer="123456789",
+    email="info@google.com"
+)
+
+John_Doe = Klant(
+    id=1,
+    handelsnaam="John Doe Inc.",
+    ten_aanzien_van="John Doe",
+    straatnaam="Pannekoeken Street",
+    huisnummer="1",
+    postcode="1234AB",
+    plaats="New York"
+)
+
+Hans_Klaas = John_Doe.model_copy(update={"id": 2, "handelsnaam": "Hans Klaas B.V."})
+
+Appel = Product(
+    id=1,
+    naam="Appel",
+    omschrijving="Een apppel.",
+    productcategorie="fruit",
+    eenheidsprijs=50,
+    btw_percentage=21.0
+)
+
+Boek = Product(
+    id=2,
+    naam="Boek",
+    omschrijving="Een boek.",
+    productcategorie="boeken",
+    eenheidsprijs=1000,
+    btw_percentage=9.0
+)
+
+januari = Factuur(factuurnummer="F2024001", klant=John_Doe, bedrijf=Google, factuurdatum="2024-01-05", producten=[
+    BevatProduct(product=Appel, hoeveelheid=2, datum="2024-01-05"),
+    BevatProduct(product=Boek, hoeveelheid=1, datum="2024-01-05")
+])
+februari = Factuur(factuurnummer="F2024002", klant=Hans_Klaas, bedrijf=Google, factuurdatum="2024-02-10", producten=[
+    BevatProduct(product=Appel, hoeveelheid=4, datum="2024-02-10")
+])
+april = Factuur(factuurnummer="F2024003", klant=John_Doe, bedrijf=Google, factuurdatum="2024-04-01", producten=[
+    BevatProduct(product=Boek, hoeveelheid=3, datum="2024-04-01")
+])
+
+def make_repos(migrations=MIGRATIONS) -> tuple[SingleEntityRepository, FactuurRepository, ReportRepository]:
+    repo = SingleEntityRepository(':memory:')
+    migrate(repo.conn, migrations)
+    repo.add_many([Google, John_Doe, Hans_Klaas, Appel, Boek])
+    factuur_repo = FactuurRepository(pool=repo.pool)
+    return repo, factuur_repo, ReportRepository(pool=repo.pool)
+
+def expected_omzet(facturen: list[Factuur]) -> list[Omzet]:
+    maanden = {}
+    for factuur in facturen:
+        maanden.setdefault(factuur.factuurdatum[:7], []).append(factuur)
+    return [Omzet(
+        maand,
+        len(per_maand),
+        sum(factuur.totaalbedrag_excl for factuur in per_maand),
+        sum(factuur.btw_bedrag for factuur in per_maand),
+        sum(factuur.totaalbedrag_incl for factuur in per_maand)
+    ) for maand, per_maand in sorted(maanden.items())]
+
+def test_reports_follow_every_write() -> None:
+    repo, factuur_repo, report = make_repos()
+    factuur_repo.add_many([januari, februari, april])
+    assert report.omzet(Google.id) == expected_omzet([januari, februari, april])
+    assert report.omzet(Google.id, vanaf="2024-02", tot_en_met="2024-03") == expected_omzet([februari])
+    assert report.btw_aangifte(Google.id, 2024, 1) == [BtwTarief(9.0, 1000, 90), BtwTarief(21.0, 300, 63)]
+    assert report.btw_aangifte(Google.id, 2024, 2) == [BtwTarief(9.0, 3000, 270)]
+    assert report.openstaand() == [
+        Openstaand(1, "2024-01", 1, januari.totaalbedrag_incl),
+        Openstaand(1, "2024-04", 1, april.totaalbedrag_incl),
+        Openstaand(2, "2024-02", 1, februari.totaalbedrag_incl)
+    ]
+
+    factuur_repo.set_betaalstatus([januari.factuurnummer])
+    assert report.openstaand(klant=1) == [Openstaand(1, "2024-04", 1, april.totaalbedrag_incl)]
+    # Moving a factuur to another month moves its totals and its BTW
+    verplaatst = februari.model_copy(update={"factuurdatum": "2024-04-02"})
+    factuur_repo.update(verplaatst)
+    assert report.omzet(Google.id) == expected_omzet([januari, verplaatst, april])
+    assert report.btw_aangifte(Google.id, 2024, 1) == [BtwTarief(9.0, 1000, 90), BtwTarief(21.0, 100, 21)]
+    assert report.btw_aangifte(Google.id, 2024, 2) == [BtwTarief(9.0, 3000, 270), BtwTarief(21.0, 200, 42)]
+    before = (report.omzet(Google.id), report.btw_aangifte(Google.id, 2024, 1), report.openstaand())
+    report.rebuild(batch_size=1)
+    assert (report.omzet(Google.id), report.btw_aangifte(Google.id, 2024, 1), report.openstaand()) == before
+    # A price change after invoicing does not change what the line items of earlier facturen added
+    repo.update(Appel.model_copy(update={"eenheidsprijs": 75}))
+    factuur_repo.delete(verplaatst)
+    factuur_repo.delete(april)
+    assert report.omzet(Google.id) == expected_omzet([januari])
+    assert report.btw_aangifte(Google.id, 2024, 2) == []
+    assert report.openstaand() == []
+
+    with pytest.raises(ValueError):
+        report.btw_aangifte(Google.id, 2024, 5)
+
+def test_reporting_migration_backfills_existing_facturen() -> None:
+    repo, factuur_repo, report = make_repos(MIGRATIONS[:3])
+    factuur_repo.add_many([januari, februari, april])
+    # Up to the reporting migration only, later migrations expect the amounts of a version 4 database in euros
+    migrate(repo.conn, MIGRATIONS[:4], batch_size=2)
+    assert report.omzet(Google.id) == expected_omzet([januari, februari, april])
+    assert report.btw_aangifte(Google.id, 2024, 1) == [BtwTarief(9.0, 1000, 90), BtwTarief(21.0, 300, 63)]
+    assert [openstaand.klant for openstaand in report.openstaand()] == [1, 1, 2]
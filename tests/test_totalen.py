@@ -0,0 +1,90 @@
+import random
+from backend.operations.database_operations import Product, Klant, Bedrijf, Factuur, BevatProduct
+from backend.operations.database_operations import SingleEntityRepository, FactuurRepository
+from backend.operations.totalen import bereken_totalen, uiterste_betaaldata, herbereken, herbereken_opgeslagen
+
+Google = Bedrijf(
+    id=1,
+    handelsnaam="Google",
+    straatnaam="Main Street",
+    huisnummer="2",
+    postcode="1234AB",
+    plaats="New York",
+    kvk_nummer="12345678",
+    btw_nummer="12345678",
+    bank="ING",
+    iban="NL12INGB1234567890",
+    bic="INGBNL2A",
+    telefoonnummer="123456789",
+    email="info@google.com"
+)
+
+John_Doe = Klant(
+    id=1,
+    handelsnaam="John Doe Inc.",
+    ten_aanzien_van="John Doe",
+    straatnaam="Pannekoeken Street",
+    huisnummer="1",
+    postcode="1234AB",
+    plaats="New York"
+)
+
+def make_facturen(aantal: int) -> list[Factuur]:
+    willekeurig = random.Random(2024)
+    producten = [Product(
+        id=id,
+        naam=f"Product {id}",
+        omschrijving="Een product.",
+        productcategorie="overig",
+        eenheidsprijs=willekeurig.randint(1, 25000),
+        btw_percentage=willekeurig.choice([0.0, 9.0, 21.0])
+    ) for id in range(1, 21)]
+    return [Factuur(
+        factuurnummer=f"F2024{index:04d}",
+        klant=John_Doe,
+        bedrijf=Google,
+        factuurdatum=f"2024-{willekeurig.randint(1, 12):02d}-{willekeurig.randint(1, 28):02d}",
+        producten=[BevatProduct(product=willekeurig.choice(producten), hoeveelheid=willekeurig.randint(1, 40), datum=f"2024-01-{dag:02d}") for dag in range(1, willekeurig.randint(1, 25))]
+    ) for index in range(aantal)]
+
+def test_bereken_totalen_is_identical_to_factuur() -> None:
+    facturen = make_facturen(500)
+    regels = [(factuur.factuurnummer, bevatproduct) for factuur in facturen for bevatproduct in factuur.producten]
+    # Line items of different facturen may be interleaved
+    random.Random(1).shuffle(regels)
+    regels.sort(key=lambda regel: regel[0][-1])
+    totalen = bereken_totalen(
+        [factuurnummer for factuurnummer, _ in regels],
+        [bevatproduct.product.eenheidsprijs for _, bevatproduct in regels],
+        [bevatproduct.hoeveelheid for _, bevatproduct in regels],
+        [bevatproduct.product.btw_percentage for _, bevatproduct in regels]
+    )
+    per_object = {factuur.factuurnummer: Factuur(
+        factuurnummer=factuur.factuurnummer,
+        klant=John_Doe,
+        bedrijf=Google,
+        factuurdatum=factuur.factuurdatum,
+        producten=[bevatproduct for factuurnummer, bevatproduct in regels if factuurnummer == factuur.factuurnummer]
+    ) for factuur in facturen}
+    assert totalen.factuurnummers == list(dict.fromkeys(factuurnummer for factuurnummer, _ in regels))
+    for factuurnummer, excl, btw, incl in zip(*totalen):
+        factuur = per_object[factuurnummer]
+        assert (excl, btw, incl) == (factuur.totaalbedrag_excl, factuur.btw_bedrag, factuur.totaalbedrag_incl)
+    assert uiterste_betaaldata([factuur.factuurdatum for factuur in facturen]) == [factuur.uiterste_betaaldatum for factuur in facturen]
+
+def test_herbereken_after_price_change() -> None:
+    facturen = make_facturen(50)
+    producten = {bevatproduct.product.id: bevatproduct.product for factuur in facturen for bevatproduct in factuur.producten}
+    repo = SingleEntityRepository(':memory:')
+    repo.create()
+    repo.add_many([Google, John_Doe, *producten.values()])
+    factuur_repo = FactuurRepository(pool=repo.pool)
+    factuur_repo.add_many(facturen)
+    assert herbereken_opgeslagen(factuur_repo) == 0
+    duurder = {id: product.model_copy(update={"eenheidsprijs": round(product.eenheidsprijs * 1.1)}) for id, product in producten.items()}
+    repo.update_many(list(duurder.values()))
+    nieuw = [factuur.model_copy(update={"producten": [bevatproduct.model_copy(update={"product": duurder[bevatproduct.product.id]}) for bevatproduct in factuur.producten]}) for factuur in facturen]
+    herberekend = herbereken(nieuw)
+    assert [factuur.btw_bedrag for factuur in herberekend] == [Factuur(factuurnummer=factuur.factuurnummer, klant=John_Doe, bedrijf=Google, factuurdatum=factuur.factuurdatum, producten=factuur.producten).btw_bedrag for factuur in nieuw]
+    assert herbereken_opgeslagen(factuur_repo) == len([factuur for factuur in facturen if factuur.producten])
+    assert [factuur.totaalbedrag_incl for factuur in factuur_repo.get_all()] == [factuur.totaalbedrag_incl for factuur in herberekend]
@@ -0,0 +1,100 @@
+from backend.operations.database_operations import Product, Klant, Bedrijf, Factuur, BevatProduct
+from backend.operations.database_operations import SingleEntityRepository, FactuurRepository
+from backend.operations.migrations import MIGRATIONS, migrate
+from backend.operations.zoeken import SearchRepository, zoekvraag
+
+Google = Bedrijf(
+    id=1,
+    handelsnaam="Google",
+    straatnaam="Main Street",
+    huisnummer="2",
+    postcode="1234AB",
+    plaats="New York",
+    kvk_nummer="12345678",
+    btw_nummer="12345678",
+    bank="ING",
+    iban="NL12INGB1234567890",
+    bic="INGBNL2A",
+    telefoonnummer="123456789",
+    email="info@google.com"
+)
+
+John_Doe = Klant(
+    id=1,
+    handelsnaam="John Doe Inc.",
+    ten_aanzien_van="John Doe",
+    straatnaam="Pannekoeken Street",
+    huisnummer="1",
+    postcode="1234AB",
+    plaats="New York"
+)
+
+Cafe_Jansen = Klant(
+    id=2,
+    handelsnaam="Café Jansen",
+    ten_aanzien_van="Piet Jansen",
+    straatnaam="Dorpsstraat",
+    huisnummer="10",
+    postcode="9876 ZX",
+    plaats="Amsterdam"
+)
+
+Appel = Product(
+    id=1,
+    naam="Appel",
+    omschrijving="Een appel.",
+    productcategorie="fruit",
+    eenheidsprijs=50,
+    btw_percentage=9.0
+)
+
+Appeltaart = Product(
+    id=2,
+    naam="Appeltaart",
+    omschrijving="Een taart met appel.",
+    productcategorie="gebak",
+    eenheidsprijs=1250,
+    btw_percentage=9.0
+)
+
+def make_repos(migrations=MIGRATIONS) -> tuple[SingleEntityRepository, FactuurRepository, SearchRepository]:
+    repo = SingleEntityRepository(':memory:')
+    migrate(repo.conn, migrations)
+    repo.add_many([Google, John_Doe, Cafe_Jansen, Appel, Appeltaart])
+    factuur_repo = FactuurRepository(pool=repo.pool)
+    factuur_repo.add_many([Factuur(factuurnummer=f"F2024-{index:03d}", klant=John_Doe, bedrijf=Google, factuurdatum="2024-01-01", producten=[
+        BevatProduct(product=Appel, hoeveelheid=1, datum="2024-01-01")
+    ]) for index in range(1, 12)])
+    return repo, factuur_repo, SearchRepository(pool=repo.pool)
+
+def test_search_follows_every_write() -> None:
+    repo, factuur_repo, search = make_repos()
+    assert search.klanten("jan") == [Cafe_Jansen]
+    # Without case and diacritics, every word is a prefix
+    assert search.klanten("CAFE ams") == [Cafe_Jansen]
+    assert search.klanten("9876") == [Cafe_Jansen]
+    assert search.klanten("new") == [John_Doe]
+    # A match in the naam ranks above a match in the omschrijving
+    assert search.producten("appel") == [Appel, Appeltaart]
+    assert search.producten("taart") == [Appeltaart]
+    assert [overzicht.factuurnummer for overzicht in search.facturen("f2024 01")] == ["F2024-010", "F2024-011"]
+    assert search.facturen("F2024-001")[0].totaalbedrag_incl == 55
+
+    verhuisd = Cafe_Jansen.model_copy(update={"plaats": "Utrecht"})
+    repo.update(verhuisd)
+    assert search.klanten("ams") == []
+    assert search.klanten("utr") == [verhuisd]
+    repo.delete(Appeltaart)
+    assert search.producten("appel") == [Appel]
+    factuur_repo.delete(factuur_repo.get("F2024-010"))
+    assert [overzicht.factuurnummer for overzicht in search.facturen("f2024 01")] == ["F2024-011"]
+    assert search.klanten("") == search.klanten("  *\"") == []
+    search.rebuild()
+    assert search.klanten("utr") == [verhuisd]
+
+def test_search_migration_indexes_existing_rows() -> None:
+    repo, factuur_repo, search = make_repos(MIGRATIONS[:-1])
+    migrate(repo.conn)
+    assert search.klanten("piet") == [Cafe_Jansen]
+    assert len(search.facturen("f2024", limit=100)) == 11
+    assert zoekvraag('jan "or" -x') == '"jan"* "or"* "x"*'